@@ -0,0 +1,47 @@
+# async_database.py
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database import engine, install_sqlite_pragmas, DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_ECHO
+
+# Async drivers for the backends database.py supports
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url):
+    """Swaps a sync database URL's driver for its asyncio counterpart."""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def create_async_db_engine(url=None, pragmas=None, pool_size=DATABASE_POOL_SIZE,
+                           max_overflow=DATABASE_MAX_OVERFLOW, echo=DATABASE_ECHO, **kwargs):
+    """
+    Async engine on the same database as database.engine (or url), with a sized
+    connection pool. SQLite gets the same pragmas as the sync engine, set once per
+    pooled connection. Pooled connections belong to the event loop that opened
+    them, so code that starts several loops (e.g. tests calling asyncio.run) must
+    await dispose() before each loop ends, or pass poolclass=NullPool.
+    """
+    url = to_async_url(url or engine.url)
+    if "poolclass" not in kwargs:
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow)
+    new_engine = create_async_engine(url, echo=echo, **kwargs)
+    if url.get_backend_name() == "sqlite":
+        install_sqlite_pragmas(new_engine.sync_engine, pragmas)
+    return new_engine
+
+
+async_engine = create_async_db_engine()
+# Rows are read and returned after the session closes, so don't expire them on commit
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+async def run_query_async(statement, shape):
+    """Async counterpart of database.run_query: executes statement and returns shape(result)."""
+    async with AsyncSessionLocal() as db:
+        return shape(await db.execute(statement))
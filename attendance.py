@@ -3,9 +3,37 @@ import os
 import json
 from datetime import datetime
 from abc import ABC, abstractmethod
-from database import SessionLocal, Attendance
-from collections import defaultdict
+from sqlalchemy import func, select
+from database import SessionLocal, Attendance, scope_to_department, run_query
+from async_database import run_query_async
 from typing import Optional, List
+
+def hours_from_seconds(worked_seconds):
+    """Converts a stored worked_seconds value to display hours (0 for open or unparseable entries)."""
+    if worked_seconds is None:
+        return 0
+    return round(worked_seconds / 3600, 2)
+
+# Result shapes shared by the sync and async read methods
+def _records(result):
+    return result.scalars().all()
+
+def _employee_record_dicts(result):
+    return [
+        {
+            "date": r.date,
+            "check_in": r.check_in,
+            "check_out": r.check_out,
+            "hours": hours_from_seconds(r.worked_seconds)
+        } for r in result.scalars()
+    ]
+
+def _hours_total(result):
+    return hours_from_seconds(result.scalar() or 0)
+
+def _hours_by_employee(result):
+    return {employee_id: hours_from_seconds(total) for employee_id, total in result}
+
 # ----------------------
 # Adapter Interface
 # ----------------------
@@ -68,7 +96,7 @@ class AttendanceManager:
                 return False, "No check-in found for today."
 
             entry.check_out = current_time
-            db.commit()
+            db.commit() # worked_seconds is set by the Attendance before_update event
 
             if self.notifier:
                 self.notifier.send_notification(f"Checked out at {current_time}", employee_id)
@@ -77,10 +105,50 @@ class AttendanceManager:
         finally:
             db.close()
 
+    # --- Read queries ---
+    # Each builder returns (statement, shape). The plain methods run it on a sync
+    # session; the *_async variants, awaited by the FastAPI routes, on an async one.
+    def _attendance_for_employee_query(self, employee_id):
+        return select(Attendance).where(Attendance.employee_id == employee_id), _employee_record_dicts
+
+    def _total_hours_for_employee_query(self, employee_id):
+        statement = select(func.sum(Attendance.worked_seconds)).where(Attendance.employee_id == employee_id)
+        return statement, _hours_total
+
+    def _all_records_query(self):
+        return select(Attendance), _records
+
+    def _department_records_query(self, root_department_id):
+        # Resolve the hierarchy with a join on the department closure table
+        # instead of an IN (...) list of usernames
+        return scope_to_department(select(Attendance), Attendance.employee_id, root_department_id), _records
+
+    def _hours_by_employee_query(self, statement=None):
+        # SUM(worked_seconds) per employee; open entries don't count
+        statement = statement if statement is not None else select(Attendance.employee_id, func.sum(Attendance.worked_seconds))
+        statement = statement.where(Attendance.worked_seconds.is_not(None)).group_by(Attendance.employee_id)
+        return statement, _hours_by_employee
+
+    def _department_hours_query(self, root_department_id):
+        statement = select(Attendance.employee_id, func.sum(Attendance.worked_seconds))
+        return self._hours_by_employee_query(scope_to_department(statement, Attendance.employee_id, root_department_id))
+
     def get_attendance_for_employee(self, employee_id):
+        return run_query(*self._attendance_for_employee_query(employee_id))
+
+    async def get_attendance_for_employee_async(self, employee_id):
+        return await run_query_async(*self._attendance_for_employee_query(employee_id))
+
+    def get_total_hours_for_employee(self, employee_id):
+        return run_query(*self._total_hours_for_employee_query(employee_id))
+
+    async def get_total_hours_for_employee_async(self, employee_id):
+        return await run_query_async(*self._total_hours_for_employee_query(employee_id))
+
+    def get_summary_by_date(self, date):
         db = SessionLocal()
         try:
-            records = db.query(Attendance).filter(Attendance.employee_id == employee_id).all()
+            records = db.query(Attendance).filter(Attendance.date == date).all()
             return [
                 {
                     "date": r.date,
@@ -91,56 +159,38 @@ class AttendanceManager:
         finally:
             db.close()
 
-    def get_total_hours_for_employee(self, employee_id):
+    def get_attendance_between(self, start_date, end_date, employee_ids: Optional[List[str]] = None):
+        """Records dated start_date..end_date inclusive, optionally limited to some employees."""
         db = SessionLocal()
         try:
-            records = db.query(Attendance).filter(Attendance.employee_id == employee_id).all()
-            total_hours = 0
-            for r in records:
-                if r.check_in and r.check_out:
-                    in_time = datetime.strptime(r.check_in, "%H:%M:%S")
-                    out_time = datetime.strptime(r.check_out, "%H:%M:%S")
-                    delta = out_time - in_time
-                    total_hours += delta.total_seconds() / 3600
-            return round(total_hours, 2)
-        finally:
-            db.close()
-
-    def get_summary_by_date(self, date):
-        db = SessionLocal()
-        try:
-            records = db.query(Attendance).filter(Attendance.date == date).all()
+            query = db.query(Attendance).filter(Attendance.date.between(start_date, end_date))
+            if employee_ids is not None:
+                query = query.filter(Attendance.employee_id.in_(employee_ids))
+            records = query.order_by(Attendance.date, Attendance.employee_id).all()
             return [
                 {
+                    "employee_id": r.employee_id,
                     "date": r.date,
                     "check_in": r.check_in,
-                    "check_out": r.check_out
+                    "check_out": r.check_out,
+                    "hours": hours_from_seconds(r.worked_seconds)
                 } for r in records
             ]
         finally:
             db.close()
+
     def get_all_attendance_records(self):
-        db = SessionLocal()
-        try:
-            records = db.query(Attendance).all()
-            return records
-        finally:
-            db.close()
+        return run_query(*self._all_records_query())
+
+    async def get_all_attendance_records_async(self):
+        return await run_query_async(*self._all_records_query())
 
     def get_total_hours_for_all_employees(self):
-        db = SessionLocal()
-        try:
-            entries = db.query(Attendance).all()
-            totals = defaultdict(float)
-            for e in entries:
-                if e.check_in and e.check_out:
-                    in_time = datetime.strptime(e.check_in, "%H:%M:%S")
-                    out_time = datetime.strptime(e.check_out, "%H:%M:%S")
-                    worked = round((out_time - in_time).total_seconds() / 3600, 2)
-                    totals[e.employee_id] += worked
-            return dict(totals)
-        finally:
-            db.close()
+        return run_query(*self._hours_by_employee_query())
+
+    async def get_total_hours_for_all_employees_async(self):
+        return await run_query_async(*self._hours_by_employee_query())
+
     def get_attendance_for_employees(self, employee_ids: List[str]):
         db = SessionLocal()
         try:
@@ -150,19 +200,23 @@ class AttendanceManager:
             db.close()
 
     def get_total_hours_for_employees(self, employee_ids: List[str]):
-        db = SessionLocal()
-        try:
-            records = db.query(Attendance).filter(Attendance.employee_id.in_(employee_ids)).all()
-            totals = defaultdict(float)
-            for r in records:
-                if r.check_in and r.check_out:
-                    in_time = datetime.strptime(r.check_in, "%H:%M:%S")
-                    out_time = datetime.strptime(r.check_out, "%H:%M:%S")
-                    worked = round((out_time - in_time).total_seconds() / 3600, 2)
-                    totals[r.employee_id] += worked
-            return dict(totals)
-        finally:
-            db.close()
+        statement = select(Attendance.employee_id, func.sum(Attendance.worked_seconds)).where(
+            Attendance.employee_id.in_(employee_ids)
+        )
+        return run_query(*self._hours_by_employee_query(statement))
+
+    # Department-scoped variants
+    def get_attendance_for_department(self, root_department_id):
+        return run_query(*self._department_records_query(root_department_id))
+
+    async def get_attendance_for_department_async(self, root_department_id):
+        return await run_query_async(*self._department_records_query(root_department_id))
+
+    def get_total_hours_for_department(self, root_department_id):
+        return run_query(*self._department_hours_query(root_department_id))
+
+    async def get_total_hours_for_department_async(self, root_department_id):
+        return await run_query_async(*self._department_hours_query(root_department_id))
 
 # ----------------------
 # Adapter Design Pattern
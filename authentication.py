@@ -5,8 +5,12 @@ import uuid
 import os
 from threading import Lock
 import uuid
-from database import SessionLocal, User
+from sqlalchemy import select
+from database import SessionLocal, User, run_query
+from async_database import run_query_async
 from typing import Optional, List
+from session_store import SessionStore, create_session_store_from_env
+from department_scope import DepartmentScopeResolver
 
 class AuthManager:
     __instance = None
@@ -15,7 +19,9 @@ class AuthManager:
     def __init__(self):
         if AuthManager.__instance is not None:
             raise Exception("This class is a singleton! Use get_instance().")
-        self.sessions = {}
+        # token -> principal dict (username, role, department_id), resolved once
+        # at login so page views don't need a User query
+        self.sessions: SessionStore = create_session_store_from_env()
 
     @staticmethod
     def get_instance():
@@ -27,6 +33,17 @@ class AuthManager:
     def _get_user(self, db, username):
         return db.query(User).filter(User.username == username).first()
 
+    def _build_principal(self, user) -> dict:
+        return {
+            "username": user.username,
+            "role": user.role,
+            "department_id": user.department_id
+        }
+
+    def set_session_store(self, store: SessionStore):
+        """Swaps the session backend (e.g. a shared store when running several workers)."""
+        self.sessions = store
+
     def register_user(self, username, password, role):
         db = SessionLocal()
         try:
@@ -51,33 +68,59 @@ class AuthManager:
                 return False, "Invalid password."
 
             token = str(uuid.uuid4())
-            self.sessions[token] = username
+            self.sessions.put(token, self._build_principal(user))
             return True, token
         finally:
             db.close()
 
     def logout(self, token):
-        if token in self.sessions:
-            del self.sessions[token]
+        if self.sessions.delete(token):
             return True, "Logged out."
         return False, "Invalid token."
 
     def validate_token(self, token):
         return token in self.sessions
 
+    def get_principal(self, token) -> Optional[dict]:
+        """Returns the cached principal for a session token, or None if the token is unknown."""
+        return self.sessions.get(token)
+
     def get_user_role(self, token):
-        username = self.sessions.get(token)
-        if username:
-            db = SessionLocal()
-            try:
-                user = self._get_user(db, username)
-                return user.role if user else None
-            finally:
-                db.close()
-        return None
+        principal = self.sessions.get(token)
+        return principal["role"] if principal else None
     
     def get_logged_in_user(self, token):
-        return self.sessions.get(token)
+        principal = self.sessions.get(token)
+        return principal["username"] if principal else None
+
+    def get_user_department_id(self, token) -> Optional[int]:
+        principal = self.sessions.get(token)
+        return principal["department_id"] if principal else None
+
+    def get_department_scope(self, token) -> List[int]:
+        """
+        Returns the department IDs (own department plus sub-departments) for the
+        session's user, from the shared DepartmentScopeResolver cache.
+        """
+        principal = self.sessions.get(token)
+        if not principal:
+            return []
+        return DepartmentScopeResolver.get_instance().get_department_ids(principal["department_id"])
+
+    def invalidate_user_sessions(self, username, role=None, department_id=None):
+        """Refreshes the stored principal of every live session belonging to username."""
+        for token in self.sessions.tokens_for_user(username):
+            principal = self.sessions.get(token)
+            if principal is None:
+                continue
+            principal = dict(principal, department_id=department_id)
+            if role is not None:
+                principal["role"] = role
+            self.sessions.update(token, principal)
+
+    def get_session_stats(self) -> dict:
+        """Returns live/expired/reaped session counters from the session store."""
+        return self.sessions.stats()
 
     def update_user_role(self, admin_username, target_username, new_role, new_department_id=None): # <-- Corrected signature
         """Allows an admin to change a user's role and department, with restrictions."""
@@ -99,17 +142,23 @@ class AuthManager:
             target_user.department_id = new_department_id # <-- Ensure this line is present
             
             db.commit()
+            self.invalidate_user_sessions(target_username, new_role, new_department_id)
             return True, f"Role for {target_username} updated to {new_role} and department set."
         finally:
             db.close()
 
+    def _all_users_query(self):
+        statement = select(User.username, User.role, User.department_id)
+        return statement, lambda result: [
+            {"username": u.username, "role": u.role, "department_id": u.department_id} for u in result
+        ]
+
     def get_all_users(self):
-        db = SessionLocal()
-        try:
-            users = db.query(User).all()
-            return [{"username": u.username, "role": u.role, "department_id": u.department_id} for u in users]
-        finally:
-            db.close()
+        return run_query(*self._all_users_query())
+
+    async def get_all_users_async(self):
+        return await run_query_async(*self._all_users_query())
+
     def create_default_admin(self):
         db = SessionLocal()
         try:
@@ -0,0 +1,87 @@
+# benchmarks/bench_checkin_throughput.py
+"""
+Concurrent check-in/check-out throughput through AttendanceManager:
+  * default - create_engine() with SQLite's defaults (rollback journal, synchronous=FULL)
+  * tuned   - create_db_engine(): WAL, synchronous=NORMAL, busy_timeout, page cache, mmap
+Each worker thread checks a batch of employees in and out while reader threads
+load attendance pages, so writers and readers contend the way they do under load.
+
+Runs against throwaway SQLite databases in a temporary directory:
+    python benchmarks/bench_checkin_throughput.py [writers] [employees_per_writer] [readers]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp()) # database.py uses ./company.db
+
+from sqlalchemy import create_engine
+from database import SessionLocal, create_db_engine
+from migrations import run_migrations
+from attendance import AttendanceManager
+
+
+def run(label, make_engine, writers, per_writer, readers):
+    path = os.path.join(tempfile.mkdtemp(), "company.db")
+    bench_engine = make_engine(f"sqlite:///{path}")
+    SessionLocal.remove()
+    SessionLocal.configure(bind=bench_engine)
+    run_migrations(bench_engine)
+
+    manager = AttendanceManager()
+    errors = []
+    done = threading.Event()
+    reads = [0]
+
+    def writer(w):
+        SessionLocal.remove() # Fresh thread-local session on this engine
+        for i in range(per_writer):
+            employee = f"emp_{w}_{i}"
+            try:
+                manager.check_in(employee)
+                manager.check_out(employee)
+            except Exception as e: # e.g. "database is locked"
+                errors.append(e)
+        SessionLocal.remove()
+
+    def reader(r):
+        SessionLocal.remove()
+        while not done.is_set():
+            manager.get_attendance_for_employee(f"emp_{r}_0")
+            manager.get_total_hours_for_all_employees()
+            reads[0] += 1
+        SessionLocal.remove()
+
+    with ThreadPoolExecutor(max_workers=writers + readers) as pool:
+        reader_futures = [pool.submit(reader, r) for r in range(readers)]
+        start = time.perf_counter()
+        for future in [pool.submit(writer, w) for w in range(writers)]:
+            future.result()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for future in reader_futures:
+            future.result()
+
+    operations = writers * per_writer * 2
+    print(f"  {label:<8} {operations / elapsed:10.1f} writes/s  {reads[0] / elapsed:10.1f} reads/s  "
+          f"{elapsed:7.2f} s  errors={len(errors)}")
+    SessionLocal.remove()
+    bench_engine.dispose()
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    per_writer = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    print(f"Check-in throughput ({writers} writers x {per_writer} employees, {readers} readers)")
+    run("default", lambda url: create_engine(url, connect_args={"check_same_thread": False}), writers, per_writer, readers)
+    run("tuned", lambda url: create_db_engine(url), writers, per_writer, readers)
+
+
+if __name__ == "__main__":
+    main()
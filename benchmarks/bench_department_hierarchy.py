@@ -0,0 +1,126 @@
+# benchmarks/bench_department_hierarchy.py
+"""
+Compares the ways of answering "which departments are under X?":
+  * legacy  - the original Python BFS over all rows (O(n^2) per call)
+  * closure - DepartmentManager(hierarchy_mode="sql"), one department_closure query
+  * index   - DepartmentManager(hierarchy_mode="index"), cached Euler-tour index
+and the circular-dependency check (one SELECT per ancestor vs. one closure lookup).
+
+Runs against a throwaway SQLite database in a temporary directory:
+    python benchmarks/bench_department_hierarchy.py [departments] [depth]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp()) # database.py uses ./company.db
+
+from database import SessionLocal, Department, create_tables
+from department_manager import DepartmentManager
+
+
+def legacy_bfs(root_department_id):
+    """The pre-index implementation of get_all_department_ids_in_hierarchy."""
+    db = SessionLocal()
+    try:
+        all_depts = db.query(Department).all()
+        if not any(d.id == root_department_id for d in all_depts):
+            return []
+        ids = [root_department_id]
+        queue = [root_department_id]
+        while queue:
+            current = queue.pop(0)
+            for child in all_depts:
+                if child.parent_department_id == current:
+                    ids.append(child.id)
+                    queue.append(child.id)
+        return ids
+    finally:
+        db.close()
+
+
+def legacy_is_descendant(department_id, new_parent_id):
+    """The original circular-dependency loop: one SELECT per ancestor."""
+    db = SessionLocal()
+    try:
+        current = new_parent_id
+        while current is not None:
+            if current == department_id:
+                return True
+            parent = db.query(Department).filter(Department.id == current).first()
+            current = parent.parent_department_id if parent else None
+        return False
+    finally:
+        db.close()
+
+
+def seed(count, depth):
+    """A random tree of `count` departments plus one chain `depth` levels deep."""
+    db = SessionLocal()
+    try:
+        ids = []
+        for i in range(count):
+            parent = random.choice(ids) if ids and random.random() < 0.9 else None
+            dept = Department(name=f"Dept {i}", parent_department_id=parent)
+            db.add(dept)
+            db.flush()
+            ids.append(dept.id)
+        chain = []
+        parent = None
+        for level in range(depth):
+            dept = Department(name=f"Chain {level}", parent_department_id=parent)
+            db.add(dept)
+            db.flush()
+            chain.append(dept.id)
+            parent = dept.id
+        db.commit()
+        return ids, chain
+    finally:
+        db.close()
+
+
+def timed(label, fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"  {label:<28} {elapsed * 1000:10.3f} ms/call")
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    random.seed(327)
+    create_tables()
+    ids, chain = seed(count, depth)
+    roots = [d for d in ids[:20]]
+
+    closure = DepartmentManager(hierarchy_mode="sql")
+    index = DepartmentManager(hierarchy_mode="index")
+    for root in roots: # All strategies must agree
+        assert sorted(legacy_bfs(root)) == sorted(closure.get_all_department_ids_in_hierarchy(root)) \
+            == sorted(index.get_all_department_ids_in_hierarchy(root))
+
+    print(f"Descendant lookup ({count} departments, {len(roots)} roots per call)")
+    timed("legacy Python BFS", lambda: [legacy_bfs(r) for r in roots], 1)
+    timed("closure table", lambda: [closure.get_all_department_ids_in_hierarchy(r) for r in roots], 5)
+    DepartmentManager.invalidate_hierarchy_cache()
+    timed("index (cold build)", lambda: index.get_all_department_ids_in_hierarchy(roots[0]), 1)
+    timed("index (warm)", lambda: [index.get_all_department_ids_in_hierarchy(r) for r in roots], 50)
+
+    print(f"Circular-dependency check (chain depth {depth})")
+    timed("legacy per-ancestor SELECTs", lambda: legacy_is_descendant(chain[0], chain[-1]), 5)
+
+    def closure_check():
+        return closure.is_in_hierarchy(chain[-1], chain[0])
+    assert closure_check() and legacy_is_descendant(chain[0], chain[-1])
+    timed("closure table", closure_check, 20)
+
+
+if __name__ == "__main__":
+    main()
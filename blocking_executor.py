@@ -0,0 +1,107 @@
+# blocking_executor.py
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+
+class ExecutorSaturatedError(Exception):
+    """Raised when the executor's queue is full; the caller should shed the request."""
+
+
+class BlockingExecutor:
+    """
+    Bounded thread pool for blocking work (sync DB calls, PDF rendering, file
+    appends) called from async routes, so it doesn't run on the event loop.
+    At most max_workers calls run at once and at most max_queue wait for a thread;
+    beyond that run() fails fast with ExecutorSaturatedError instead of queueing
+    without bound. The app shares one instance through get_instance().
+    """
+    __instance = None
+    __lock = Lock()
+
+    def __init__(self, max_workers=None, max_queue=None):
+        self.max_workers = max_workers or int(os.getenv("BLOCKING_EXECUTOR_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("BLOCKING_EXECUTOR_QUEUE", 100))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="blocking")
+        self._stats_lock = Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @staticmethod
+    def get_instance():
+        if BlockingExecutor.__instance is None:
+            with BlockingExecutor.__lock:
+                if BlockingExecutor.__instance is None:
+                    BlockingExecutor.__instance = BlockingExecutor()
+        return BlockingExecutor.__instance
+
+    def _call(self, slot, fn, args, kwargs):
+        wait = time.monotonic() - slot["submitted_at"]
+        with self._stats_lock:
+            slot["started"] = True
+            self._queued -= 1
+            self._active += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self._active -= 1
+                self._completed += 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) on the pool and awaits its result."""
+        with self._stats_lock:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise ExecutorSaturatedError(f"{self._queued} calls already waiting for a worker thread")
+            self._queued += 1
+            if self._pool is None: # Restarted after shutdown()
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="blocking")
+            pool = self._pool
+        slot = {"submitted_at": time.monotonic(), "started": False}
+        try:
+            future = pool.submit(self._call, slot, fn, args, kwargs)
+        except BaseException:
+            self._release_slot(slot)
+            raise
+        # A call cancelled (or dropped by shutdown) while still waiting never reaches
+        # _call, so its queue slot has to be given back here.
+        future.add_done_callback(lambda _: self._release_slot(slot))
+        return await asyncio.wrap_future(future)
+
+    def _release_slot(self, slot):
+        with self._stats_lock:
+            if not slot["started"]:
+                slot["started"] = True
+                self._queued -= 1
+
+    def metrics(self):
+        with self._stats_lock:
+            started = self._completed + self._active
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queue_depth": self._queued,
+                "saturation": round(self._active / self.max_workers, 3),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / started * 1000, 3) if started else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+            }
+
+    def shutdown(self, wait=True):
+        """Stops the worker threads; the next run() starts a fresh pool."""
+        with self._stats_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
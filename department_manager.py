@@ -1,52 +1,154 @@
 # department_manager.py
 
-from database import SessionLocal, Department
+from database import SessionLocal, Department, DepartmentClosure
 from department_composite import ( # Import the Composite components
     DepartmentComponent,
     DepartmentLeaf,
     DepartmentComposite,
 )
-from typing import Any, Tuple, List, Optional
+from typing import Any, Tuple, List, Optional, Dict
 from collections import defaultdict # Needed for building the tree
+from threading import Lock
+import os
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+
+class DepartmentHierarchyIndex:
+    """
+    In-memory adjacency index of the department tree, built from a single query.
+    Departments are numbered in DFS pre-order (an Euler tour), so the subtree of
+    a department is the contiguous slice order[entry[id]:exit[id]]. Descendant
+    lookups cost O(size of answer) and ancestry checks O(1).
+    """
+    def __init__(self, rows):
+        self.departments: Dict[int, Tuple[str, Optional[int]]] = {} # id -> (name, parent_id)
+        self.children = defaultdict(list) # parent_id -> [child ids]
+        self.roots: List[int] = []
+        for dept_id, name, parent_id in rows:
+            self.departments[dept_id] = (name, parent_id)
+        for dept_id, (name, parent_id) in self.departments.items():
+            if parent_id is None:
+                self.roots.append(dept_id)
+            else:
+                self.children[parent_id].append(dept_id)
+
+        self.order: List[int] = []
+        self.entry: Dict[int, int] = {}
+        self.exit: Dict[int, int] = {}
+        for root_id in self.roots:
+            self._tour(root_id)
+        # Orphans (missing parent) and any corrupt cycles are numbered as their own subtrees
+        for dept_id in self.departments:
+            if dept_id not in self.entry:
+                self._tour(dept_id)
+
+    def _tour(self, start_id):
+        stack = [(start_id, False)]
+        while stack:
+            dept_id, leaving = stack.pop()
+            if leaving:
+                self.exit[dept_id] = len(self.order)
+                continue
+            if dept_id in self.entry:
+                continue
+            self.entry[dept_id] = len(self.order)
+            self.order.append(dept_id)
+            stack.append((dept_id, True))
+            for child_id in reversed(self.children.get(dept_id, [])):
+                stack.append((child_id, False))
+
+    def __contains__(self, dept_id):
+        return dept_id in self.departments
+
+    def subtree_ids(self, dept_id) -> List[int]:
+        """Returns dept_id followed by all of its descendants, or [] if it does not exist."""
+        if dept_id not in self.entry:
+            return []
+        return self.order[self.entry[dept_id]:self.exit[dept_id]]
+
+    def is_in_subtree(self, dept_id, root_id) -> bool:
+        """True if dept_id is root_id or one of its descendants."""
+        if dept_id not in self.entry or root_id not in self.entry:
+            return False
+        return self.entry[root_id] <= self.entry[dept_id] < self.exit[root_id]
+
+    def build_tree(self) -> List[DepartmentComponent]:
+        """Builds the Composite components for the whole tree in O(n)."""
+        components = {}
+        for dept_id, (name, parent_id) in self.departments.items():
+            if self.children.get(dept_id):
+                components[dept_id] = DepartmentComposite(dept_id, name, parent_id)
+            else:
+                components[dept_id] = DepartmentLeaf(dept_id, name, parent_id)
+        for parent_id, child_ids in self.children.items():
+            parent_component = components.get(parent_id)
+            if isinstance(parent_component, DepartmentComposite):
+                for child_id in child_ids:
+                    parent_component.add(components[child_id])
+            # Orphaned children (parent_component is None) are left out of the tree
+        return [components[dept_id] for dept_id in self.roots]
+
+
+# "index": answer hierarchy questions from the process-local DepartmentHierarchyIndex.
+# "sql":   answer them from the department_closure table on every call, for
+#          deployments where a process-local cache can't be trusted (e.g. several
+#          workers writing).
+HIERARCHY_MODES = ("index", "sql")
+
 
 class DepartmentManager:
-    def __init__(self):
-        # We'll build the composite structure on demand or on startup
-        pass
+    # The hierarchy index is shared by every DepartmentManager in the process and
+    # rebuilt lazily after any change to the departments table.
+    _hierarchy_index: Optional[DepartmentHierarchyIndex] = None
+    _hierarchy_generation = 0 # Bumped by invalidate_hierarchy_cache()
+    _hierarchy_lock = Lock()
+
+    def __init__(self, hierarchy_mode=None):
+        self.hierarchy_mode = hierarchy_mode or os.getenv("DEPARTMENT_HIERARCHY_MODE", "index")
+        if self.hierarchy_mode not in HIERARCHY_MODES:
+            raise ValueError(f"Unknown hierarchy mode: {self.hierarchy_mode}")
+
+    @property
+    def uses_process_cache(self) -> bool:
+        return self.hierarchy_mode == "index"
+
+    @classmethod
+    def invalidate_hierarchy_cache(cls):
+        with cls._hierarchy_lock:
+            cls._hierarchy_index = None
+            cls._hierarchy_generation += 1
+
+    def _get_hierarchy_index(self, db=None) -> DepartmentHierarchyIndex:
+        """
+        Returns the cached index, building it if needed. Pass the caller's session
+        when one is open: SessionLocal is thread-scoped, so opening and closing a
+        second one here would close the caller's session too.
+        """
+        with DepartmentManager._hierarchy_lock:
+            index = DepartmentManager._hierarchy_index
+            generation = DepartmentManager._hierarchy_generation
+        if index is not None and self.uses_process_cache:
+            return index
+        session = db or SessionLocal()
+        try:
+            rows = session.query(Department.id, Department.name, Department.parent_department_id).order_by(Department.id).all()
+        finally:
+            if db is None:
+                session.close()
+        index = DepartmentHierarchyIndex(rows)
+        if self.uses_process_cache:
+            with DepartmentManager._hierarchy_lock:
+                if DepartmentManager._hierarchy_generation == generation: # Otherwise rows may predate a commit
+                    DepartmentManager._hierarchy_index = index
+        return index
 
     def _build_department_tree(self) -> List[DepartmentComponent]:
         """
         Builds the hierarchical structure of departments from flat database records
         into Composite pattern components.
         """
-        db = SessionLocal()
-        try:
-            departments_db = db.query(Department).all()
-            
-            # Create component objects for all departments
-            # Determine if a department is a composite or a leaf based on whether it has children
-            components = {}
-            for d in departments_db:
-                has_children = any(child.parent_department_id == d.id for child in departments_db)
-                if has_children:
-                    components[d.id] = DepartmentComposite(d.id, d.name, d.parent_department_id)
-                else:
-                    components[d.id] = DepartmentLeaf(d.id, d.name, d.parent_department_id)
-
-            # Link children to their parents
-            root_departments = []
-            for d_db in departments_db:
-                component = components[d_db.id]
-                if d_db.parent_department_id is None:
-                    root_departments.append(component)
-                else:
-                    parent_component = components.get(d_db.parent_department_id)
-                    if isinstance(parent_component, DepartmentComposite):
-                        parent_component.add(component)
-                    # Handle orphaned children if parent_component is None (optional: log or fix data)
-            return root_departments
-        finally:
-            db.close()
+        return self._get_hierarchy_index().build_tree()
 
     def create_default_department(self):
         db = SessionLocal()
@@ -67,16 +169,11 @@ class DepartmentManager:
             if db.query(Department).filter(Department.name == name).first():
                 return False, "Department with this name already exists."
             
-            # Check for circular dependency if parent_department_id is not None
+            # A new department has no descendants, so the parent only needs to exist
             if parent_department_id:
                 parent_dept = db.query(Department).filter(Department.id == parent_department_id).first()
                 if not parent_dept:
                     return False, "Parent department not found."
-                
-                # Prevent a department from being its own parent or a descendant of itself
-                # This is a basic check; a full check would involve traversing the tree
-                if parent_department_id == parent_dept.id: # Should not happen with current logic, but good for safety
-                    return False, "Cannot set department as its own parent."
 
             new_department = Department(name=name, parent_department_id=parent_department_id)
             db.add(new_department)
@@ -111,14 +208,10 @@ class DepartmentManager:
             if new_parent_id == department_id:
                 return False, "A department cannot be its own parent."
 
-            # Prevent circular dependencies (more complex check required for full tree traversal)
-            if new_parent_id is not None:
-                current_dept_id = new_parent_id
-                while current_dept_id is not None:
-                    if current_dept_id == department_id:
-                        return False, "Circular dependency detected: cannot set parent as a descendant."
-                    parent_dept = db.query(Department).filter(Department.id == current_dept_id).first()
-                    current_dept_id = parent_dept.parent_department_id if parent_dept else None
+            # Prevent circular dependencies: the new parent must not be inside this department's subtree.
+            # Checked against the closure table in this transaction, never a cached index.
+            if new_parent_id is not None and self.is_in_hierarchy(new_parent_id, department_id, db):
+                return False, "Circular dependency detected: cannot set parent as a descendant."
 
             if new_name:
                 department.name = new_name
@@ -159,47 +252,62 @@ class DepartmentManager:
         root_components = self._build_department_tree()
         return [comp.get_info() for comp in root_components]
 
+    @staticmethod
+    def subtree_query(root_department_id: int):
+        """
+        SELECT of root_department_id and all of its descendant IDs, read from the
+        closure table. Embed it in other queries to scope them to a department's
+        hierarchy with one indexed lookup instead of passing ID lists around.
+        """
+        return select(DepartmentClosure.descendant_id).where(DepartmentClosure.ancestor_id == root_department_id)
+
+    def is_in_hierarchy(self, department_id: int, root_department_id: int, db=None) -> bool:
+        """
+        True if department_id is root_department_id or one of its descendants (one
+        primary-key lookup). Pass the caller's session when one is open, as for
+        _get_hierarchy_index.
+        """
+        session = db or SessionLocal()
+        try:
+            return session.query(DepartmentClosure).filter(
+                DepartmentClosure.ancestor_id == root_department_id,
+                DepartmentClosure.descendant_id == department_id
+            ).first() is not None
+        finally:
+            if db is None:
+                session.close()
+
     def get_all_department_ids_in_hierarchy(self, root_department_id: int) -> List[int]:
         """
         Returns all department IDs within a given department's hierarchy (including itself).
         This is useful for filtering tasks/attendance for a manager's department.
         """
+        if self.uses_process_cache:
+            return list(self._get_hierarchy_index().subtree_ids(root_department_id))
         db = SessionLocal()
         try:
-            # Rebuild a specific branch of the tree to get descendants
-            all_depts_flat = db.query(Department).all()
-            
-            # Find the root department from the flat list
-            root_db_dept = next((d for d in all_depts_flat if d.id == root_department_id), None)
-            if not root_db_dept:
-                return [] # Department not found
-
-            # Create the root component for this specific query
-            root_component: DepartmentComponent
-            if any(child.parent_department_id == root_db_dept.id for child in all_depts_flat):
-                root_component = DepartmentComposite(root_db_dept.id, root_db_dept.name, root_db_dept.parent_department_id)
-            else:
-                root_component = DepartmentLeaf(root_db_dept.id, root_db_dept.name, root_db_dept.parent_department_id)
-
-            # Recursively add children to this specific root_component
-            # This is a simplified tree builder for getting descendant IDs
-            queue = [(root_component, root_db_dept)]
-            while queue:
-                current_comp, current_db_dept = queue.pop(0)
-                if isinstance(current_comp, DepartmentComposite):
-                    for child_db in all_depts_flat:
-                        if child_db.parent_department_id == current_db_dept.id:
-                            child_comp: DepartmentComponent
-                            if any(grandchild.parent_department_id == child_db.id for grandchild in all_depts_flat):
-                                child_comp = DepartmentComposite(child_db.id, child_db.name, child_db.parent_department_id)
-                            else:
-                                child_comp = DepartmentLeaf(child_db.id, child_db.name, child_db.parent_department_id)
-                            current_comp.add(child_comp)
-                            queue.append((child_comp, child_db))
-
-            # Get all IDs from the component (including itself)
-            all_ids = [root_component.id]
-            all_ids.extend(root_component.get_all_descendant_ids())
-            return all_ids
+            # Depth order keeps the root first, as the index path does
+            statement = self.subtree_query(root_department_id).order_by(DepartmentClosure.depth)
+            return list(db.execute(statement).scalars().all())
         finally:
-            db.close()
\ No newline at end of file
+            db.close()
+
+
+# --- Cache invalidation ---
+# Invalidate at flush time and again after commit, so a reader that rebuilt the
+# index between the two cannot keep pre-commit data.
+def _on_department_change(mapper, connection, target):
+    DepartmentManager.invalidate_hierarchy_cache()
+    session = object_session(target)
+    if session is not None:
+        session.info["department_hierarchy_changed"] = True
+
+
+def _on_commit(session):
+    if session.info.pop("department_hierarchy_changed", False):
+        DepartmentManager.invalidate_hierarchy_cache()
+
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(Department, _event_name, _on_department_change)
+event.listen(Session, "after_commit", _on_commit)
@@ -0,0 +1,106 @@
+# department_scope.py
+
+from threading import Lock
+from typing import List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from database import SessionLocal, User, Department
+
+
+class DepartmentScopeResolver:
+    """
+    Singleton service that resolves the scope of a department: the IDs of the
+    department and all its sub-departments, plus the users assigned to them.
+    Managers see data for exactly this scope, so the result is cached per
+    department and dropped whenever a User or Department row changes.
+    """
+    __instance = None
+    __lock = Lock()
+
+    def __init__(self):
+        if DepartmentScopeResolver.__instance is not None:
+            raise Exception("This class is a singleton! Use get_instance().")
+        self._scopes = {} # department_id -> (department_ids, users)
+        self._scopes_lock = Lock()
+        self._generation = 0 # Bumped by invalidate()
+
+    @staticmethod
+    def get_instance():
+        if DepartmentScopeResolver.__instance is None:
+            with DepartmentScopeResolver.__lock:
+                if DepartmentScopeResolver.__instance is None:
+                    DepartmentScopeResolver.__instance = DepartmentScopeResolver()
+        return DepartmentScopeResolver.__instance
+
+    def _load_scope(self, department_id) -> Tuple[List[int], List[dict]]:
+        from department_manager import DepartmentManager # Import here to avoid circular dependency
+        department_ids = DepartmentManager().get_all_department_ids_in_hierarchy(department_id)
+        if not department_ids:
+            return [], []
+        db = SessionLocal()
+        try:
+            users = db.query(User.username, User.role, User.department_id).filter(
+                User.department_id.in_(department_ids)
+            ).all()
+            return department_ids, [
+                {"username": u.username, "role": u.role, "department_id": u.department_id} for u in users
+            ]
+        finally:
+            db.close()
+
+    def _get(self, department_id) -> Tuple[List[int], List[dict]]:
+        if not department_id:
+            return [], []
+        from department_manager import DepartmentManager # Import here to avoid circular dependency
+        if not DepartmentManager().uses_process_cache:
+            return self._load_scope(department_id) # Other workers' writes can't invalidate a local cache
+        with self._scopes_lock:
+            scope = self._scopes.get(department_id)
+            generation = self._generation
+        if scope is None:
+            scope = self._load_scope(department_id)
+            with self._scopes_lock:
+                if self._generation == generation: # Otherwise a write landed mid-load and scope may be stale
+                    self._scopes[department_id] = scope
+        return scope
+
+    def resolve(self, department_id) -> Tuple[List[int], List[str]]:
+        """Returns (department_ids, usernames) for a department and its sub-departments."""
+        department_ids, users = self._get(department_id)
+        return department_ids, [u["username"] for u in users]
+
+    def get_department_ids(self, department_id) -> List[int]:
+        return self._get(department_id)[0]
+
+    def get_users(self, department_id) -> List[dict]:
+        """Returns the users (username, role, department_id) within a department's hierarchy."""
+        return self._get(department_id)[1]
+
+    def invalidate(self):
+        with self._scopes_lock:
+            self._scopes.clear()
+            self._generation += 1
+
+
+# --- Cache invalidation ---
+# Any write to users or departments can change a scope. Invalidate at flush time
+# and again after commit, so a reader that refilled the cache between the two
+# cannot leave pre-commit data behind.
+def _on_scope_change(mapper, connection, target):
+    DepartmentScopeResolver.get_instance().invalidate()
+    session = object_session(target)
+    if session is not None:
+        session.info["department_scope_changed"] = True
+
+
+def _on_commit(session):
+    if session.info.pop("department_scope_changed", False):
+        DepartmentScopeResolver.get_instance().invalidate()
+
+
+for _model in (User, Department):
+    for _event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event_name, _on_scope_change)
+event.listen(Session, "after_commit", _on_commit)
@@ -1,12 +1,103 @@
 # logger.py
+import atexit
+import gzip
 import json
 import os
-from datetime import datetime
-from threading import Lock
+import queue
+import shutil
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import islice
+from threading import Event, Lock, Thread
+import time
+from sqlalchemy import insert, select, delete, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal, AuditEntry
+
+FSYNC_POLICIES = ("none", "batch") # "batch": fsync after every flushed batch
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+ARCHIVE_STAMP_FORMAT = "%Y%m%d-%H%M%S-%f" # audit.log.<rotation time>.gz; sorts by time
+# Queue marker: write the pending batch now and then stop the writer
+_STOP = object()
+
+class _FlushRequest:
+    """Queue marker: write the pending batch now, then set done."""
+    def __init__(self):
+        self.done = Event()
+
+def read_lines_reversed(path, block_size=64 * 1024):
+    """Yields the non-empty lines of a file last to first, reading it backwards in blocks."""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + remainder).split(b"\n")
+            remainder = lines.pop(0) # May continue in the previous block
+            for line in reversed(lines):
+                if line.strip():
+                    yield line.decode("utf-8")
+        if remainder.strip():
+            yield remainder.decode("utf-8")
+
+def archive_segments(log_file):
+    """Compressed segments rotated out of log_file, oldest first, as (rotated_at, path)."""
+    directory = os.path.dirname(log_file) or "."
+    prefix = os.path.basename(log_file) + "."
+    segments = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(".gz"):
+            try:
+                rotated_at = datetime.strptime(name[len(prefix):-len(".gz")], ARCHIVE_STAMP_FORMAT)
+            except ValueError:
+                continue
+            segments.append((rotated_at, os.path.join(directory, name)))
+    return sorted(segments)
+
+def iter_segment_lines(log_file):
+    """Yields every line of log_file's archives and then of log_file itself, oldest first."""
+    for _, path in archive_segments(log_file):
+        with gzip.open(path, "rt") as f: # Decompressed as it is read
+            yield from f
+    if os.path.exists(log_file):
+        with open(log_file, "r") as f:
+            yield from f
+
+def _read_archive_reversed(path):
+    # gzip can't be read backwards cheaply; a segment holds at most max_bytes of text
+    with gzip.open(path, "rt") as f:
+        lines = [line for line in f if line.strip()]
+    yield from reversed(lines)
+
+def _to_row(entry):
+    return {
+        "timestamp": entry["timestamp"],
+        "username": entry["username"],
+        "action": entry["action"],
+        "details": json.dumps(entry["details"])
+    }
+
+def _from_row(row):
+    return {
+        "timestamp": row.timestamp,
+        "username": row.username,
+        "action": row.action,
+        "details": json.loads(row.details) if row.details else {}
+    }
 
 class Logger:
     """
     Singleton class for logging system events and user actions.
+    Entries are handed to a background writer through a bounded queue; the
+    writer appends them to audit.log in batches, one write call per batch, once
+    batch_size entries are pending or flush_interval seconds have passed.
+    Only the most recent entries are kept in memory; older history is read
+    from audit.log backwards, a page at a time. Each batch is also inserted
+    into the indexed audit_log table, which query_logs filters and pages.
+    The writer rotates audit.log into gzip archives by size and age, and
+    rotation drops archives and table rows past the retention period.
     """
     __instance = None
     __lock = Lock()
@@ -15,8 +106,24 @@ class Logger:
     def __init__(self):
         if Logger.__instance is not None:
             raise Exception("This class is a singleton! Use get_instance().")
-        self.logs = []
+        self.recent = deque(maxlen=int(os.getenv("AUDIT_LOG_RECENT_SIZE", 1000)))
+        self.batch_size = int(os.getenv("AUDIT_LOG_BATCH_SIZE", 100))
+        self.flush_interval = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL_SECONDS", 0.5))
+        self.fsync_policy = os.getenv("AUDIT_LOG_FSYNC", "none").lower()
+        if self.fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"AUDIT_LOG_FSYNC must be one of {FSYNC_POLICIES}")
+        self.max_bytes = int(os.getenv("AUDIT_LOG_MAX_BYTES", 10 * 1024 * 1024))
+        self.rotate_seconds = float(os.getenv("AUDIT_LOG_ROTATE_SECONDS", 86400))
+        self.retention_days = float(os.getenv("AUDIT_LOG_RETENTION_DAYS", 365))
+        # Longest a history read waits for earlier entries to be written
+        self.read_flush_timeout = float(os.getenv("AUDIT_LOG_READ_FLUSH_TIMEOUT_SECONDS", 1))
+        # A full queue makes log_event wait for the writer rather than drop entries
+        self._queue = queue.Queue(maxsize=int(os.getenv("AUDIT_LOG_QUEUE_SIZE", 10000)))
+        self._writer = None
+        self._writer_lock = Lock()
         self._load_logs()
+        self._segment_started = self._first_timestamp()
+        atexit.register(self.close)
 
     @staticmethod
     def get_instance():
@@ -27,25 +134,244 @@ class Logger:
         return Logger.__instance
 
     def _load_logs(self):
-        if os.path.exists(self._log_file):
-            with open(self._log_file, "r") as f:
-                self.logs = [json.loads(line) for line in f]
+        # Only the tail of the file, newest last
+        self.recent.extend(reversed(list(islice(self.iter_history(), self.recent.maxlen))))
+
+    def _first_timestamp(self):
+        # When the live segment was started, from its first entry
+        if not os.path.exists(self._log_file):
+            return None
+        with open(self._log_file, "r") as f:
+            first_line = f.readline()
+        try:
+            return datetime.strptime(json.loads(first_line)["timestamp"], TIMESTAMP_FORMAT).timestamp()
+        except (ValueError, KeyError, TypeError):
+            return None if not first_line else time.time()
+
+    # --- Background writer ---
+    def _ensure_writer(self):
+        if self._writer is None or not self._writer.is_alive():
+            with self._writer_lock:
+                if self._writer is None or not self._writer.is_alive():
+                    self._writer = Thread(target=self._run_writer, name="audit-log-writer", daemon=True)
+                    self._writer.start()
 
-    def _save_log(self, entry):
-        with open(self._log_file, "a") as f:
-            f.write(json.dumps(entry) + "\n")
+    def _run_writer(self):
+        batch = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                entry = None
+            stopping = entry is _STOP
+            forced = stopping or isinstance(entry, _FlushRequest)
+            if isinstance(entry, tuple): # (entry, serialized line)
+                batch.append(entry)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (forced or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                try:
+                    self._write_batch(batch)
+                except Exception as e: # Never let one bad batch stop the writer
+                    print(f"[ERROR] Could not write {len(batch)} audit log entries: {e}")
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+                batch = []
+                deadline = None
+            if forced:
+                if not stopping:
+                    entry.done.set()
+                self._queue.task_done()
+
+    def _write_batch(self, batch):
+        try:
+            self._rotate_if_due()
+        except OSError as e: # Keep appending to the current segment
+            print(f"[ERROR] Could not rotate the audit log: {e}")
+        try:
+            if self._segment_started is None:
+                self._segment_started = time.time()
+            with open(self._log_file, "a") as f:
+                f.write("".join(line for _, line in batch))
+                if self.fsync_policy == "batch":
+                    f.flush()
+                    os.fsync(f.fileno())
+        except OSError as e:
+            print(f"[ERROR] Could not write {len(batch)} audit log entries: {e}")
+        db = SessionLocal()
+        try:
+            db.execute(insert(AuditEntry), [_to_row(entry) for entry, _ in batch])
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            print(f"[ERROR] Could not index {len(batch)} audit log entries: {e}")
+        finally:
+            db.close()
+        for entry, _ in batch:
+            print(f"[LOG] {entry['username']} | {entry['action']} | {entry['details']}")
+
+    # --- Rotation and retention (writer thread only) ---
+    def _rotate_if_due(self):
+        if not os.path.exists(self._log_file) or os.path.getsize(self._log_file) == 0:
+            return
+        too_big = self.max_bytes and os.path.getsize(self._log_file) >= self.max_bytes
+        too_old = (self.rotate_seconds and self._segment_started is not None
+                   and time.time() - self._segment_started >= self.rotate_seconds)
+        if too_big or too_old:
+            self._rotate()
+
+    def _rotate(self):
+        rotated_at = datetime.now()
+        archive = f"{self._log_file}.{rotated_at.strftime(ARCHIVE_STAMP_FORMAT)}.gz"
+        # Move the segment aside first: with several worker processes appending to
+        # audit.log, a batch written after a copy would be lost by removing the file.
+        # Appends made after the rename go to a new audit.log.
+        rotating = f"{self._log_file}.{os.getpid()}.rotating"
+        try:
+            os.replace(self._log_file, rotating)
+        except FileNotFoundError: # Another process rotated it first
+            self._segment_started = None
+            return
+        self._segment_started = None
+        with open(rotating, "rb") as src, gzip.open(archive + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(archive + ".tmp", archive) # Only complete archives get the .gz name
+        os.remove(rotating)
+        print(f"[INFO] Rotated audit log to {archive}")
+        self._apply_retention(rotated_at)
+
+    def _apply_retention(self, now):
+        if not self.retention_days:
+            return
+        cutoff = now - timedelta(days=self.retention_days)
+        # An archive holds only entries from before its rotation time
+        for rotated_at, path in archive_segments(self._log_file):
+            if rotated_at < cutoff:
+                os.remove(path)
+                print(f"[INFO] Removed expired audit log archive {path}")
+        db = SessionLocal()
+        try:
+            db.execute(delete(AuditEntry).where(AuditEntry.timestamp < cutoff.strftime(TIMESTAMP_FORMAT)))
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            print(f"[ERROR] Could not prune expired audit log entries: {e}")
+        finally:
+            db.close()
 
     def log_event(self, username, action, details=None):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
         log_entry = {
             "timestamp": timestamp,
             "username": username,
             "action": action,
             "details": details or {}
         }
-        self.logs.append(log_entry)
-        self._save_log(log_entry)
-        print(f"[LOG] {username} | {action} | {details}")
-    
+        line = json.dumps(log_entry) + "\n" # Raises here, for the caller, if details aren't JSON-serializable
+        self.recent.append(log_entry)
+        self._ensure_writer()
+        self._queue.put((log_entry, line))
+
+    def flush(self, timeout=None):
+        """
+        Writes pending entries now and blocks until those logged before this call
+        are in audit.log, or timeout seconds have passed. Entries logged meanwhile
+        by other threads are not waited for. Returns False on timeout.
+        """
+        if self._writer is None or not self._writer.is_alive():
+            return True
+        request = _FlushRequest()
+        try:
+            self._queue.put(request, timeout=timeout)
+        except queue.Full:
+            return False
+        return request.done.wait(timeout)
+
+    def close(self):
+        """Flushes pending entries and stops the writer; a later log_event starts a new one."""
+        with self._writer_lock:
+            if self._writer is not None and self._writer.is_alive():
+                self._queue.put(_STOP)
+                self._writer.join()
+            self._writer = None
+
+    def iter_history(self):
+        """Yields every retained entry, newest first: audit.log from its end, then each archive."""
+        self.flush(self.read_flush_timeout)
+        archives = archive_segments(self._log_file) # Listed before a rotation can add one
+        live = read_lines_reversed(self._log_file) if os.path.exists(self._log_file) else []
+        segments = [live] + [_read_archive_reversed(path) for _, path in reversed(archives)]
+        for line in (line for segment in segments for line in segment):
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError: # A line torn by a crash mid-write
+                continue
+
+    def get_log_page(self, offset=0, limit=50):
+        """Entries offset..offset+limit, newest first; from memory when recent enough."""
+        recent = list(self.recent) # Snapshot; other threads keep appending
+        if offset + limit <= len(recent):
+            newest_first = reversed(recent)
+        else:
+            newest_first = self.iter_history()
+        return list(islice(newest_first, offset, offset + limit))
+
+    def query_logs(self, since=None, until=None, username=None, action=None, cursor=None, limit=50):
+        """
+        Entries newest first, filtered on the indexed columns: since (inclusive) and
+        until (exclusive) are "YYYY-MM-DD HH:MM:SS" strings or prefixes of one.
+        Returns (entries, next_cursor); pass next_cursor back for the following
+        page. It is None on the last page. Raises ValueError for a malformed cursor.
+        Waits at most read_flush_timeout for entries logged before the call.
+        """
+        self.flush(self.read_flush_timeout)
+        # (timestamp, id) order walks the timestamp indexes, so a time range stops early
+        statement = select(AuditEntry).order_by(AuditEntry.timestamp.desc(), AuditEntry.id.desc()).limit(limit + 1)
+        if since:
+            statement = statement.where(AuditEntry.timestamp >= since)
+        if until:
+            statement = statement.where(AuditEntry.timestamp < until)
+        if username:
+            statement = statement.where(AuditEntry.username == username)
+        if action:
+            statement = statement.where(AuditEntry.action == action)
+        if cursor:
+            timestamp, _, entry_id = cursor.rpartition("|")
+            if not timestamp or not entry_id.isdigit():
+                raise ValueError(f"Invalid cursor: {cursor!r}")
+            statement = statement.where(tuple_(AuditEntry.timestamp, AuditEntry.id) < tuple_(timestamp, int(entry_id)))
+        db = SessionLocal()
+        try:
+            rows = db.execute(statement).scalars().all()
+        finally:
+            db.close()
+        next_cursor = f"{rows[limit - 1].timestamp}|{rows[limit - 1].id}" if len(rows) > limit else None
+        return [_from_row(row) for row in rows[:limit]], next_cursor
+
+    @classmethod
+    def import_log_file(cls, connection, chunk_size=1000):
+        """Copies the archives and audit.log into the audit_log table (used when the table is created). Returns the count."""
+        imported = 0
+        lines = iter_segment_lines(cls._log_file)
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                break
+            rows = []
+            for line in chunk:
+                try:
+                    rows.append(_to_row(json.loads(line)))
+                except json.JSONDecodeError: # A line torn by a crash mid-write
+                    continue
+            if rows:
+                connection.execute(insert(AuditEntry), rows)
+                imported += len(rows)
+        return imported
+
     def get_logs(self):
-        return self.logs
\ No newline at end of file
+        """The most recent entries kept in memory, oldest first."""
+        return list(self.recent)
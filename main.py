@@ -1,31 +1,43 @@
 from database import create_tables
+from async_database import async_engine
 from authentication import AuthManager
 from department_manager import DepartmentManager
+from department_scope import DepartmentScopeResolver
 department_manager = DepartmentManager()
 auth_manager = AuthManager.get_instance()
+scope_resolver = DepartmentScopeResolver.get_instance()
 create_tables()
 auth_manager.create_default_admin()
 department_manager.create_default_department()
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, FileResponse  
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, FileResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from typing import Optional
 from pdf_report import PDFReportGenerator
 from pdf_payslip import PDFPayslipGenerator
-from attendance import AttendanceManager
-from notification import NotificationManager, InAppNotifier
+from attendance import AttendanceManager, hours_from_seconds
+from notification import NotificationManager, InAppNotifier, NotificationDispatcher, EmailNotifier, SMTPEmailTransport
 from payroll import PayrollManager, ConcreteStrategyA
 from logger import Logger
-from datetime import datetime
+from blocking_executor import BlockingExecutor, ExecutorSaturatedError
+import os
+from urllib.parse import urlencode
 app = FastAPI()
 logger = Logger.get_instance()
+LOGS_PAGE_SIZE = 100 # Audit entries per /logs page
+NOTIFICATIONS_PAGE_SIZE = 20 # Notifications per /notifications page
+blocking_executor = BlockingExecutor.get_instance()
+run_blocking = blocking_executor.run # Await this for sync DB calls, PDF rendering and file writes
 pdf_generator = PDFReportGenerator()
 pdf_payslip_generator = PDFPayslipGenerator()
 attendance_manager = AttendanceManager()
-notification_manager = NotificationManager()
+notification_dispatcher = NotificationDispatcher()
+notification_manager = NotificationManager(dispatcher=notification_dispatcher) # Routes only enqueue
 
 inapp_notifier = InAppNotifier(notification_manager.subject) 
+# Email is opt-in: set EMAIL_SMTP_HOST (and EMAIL_DIGEST_WINDOW_SECONDS to send digests)
+email_notifier = EmailNotifier(notification_manager.subject, transport=SMTPEmailTransport.from_env()) if os.getenv("EMAIL_SMTP_HOST") else None
 payroll_manager = PayrollManager(strategy=ConcreteStrategyA(), notifier=notification_manager)
 
 # Static files and templates
@@ -33,6 +45,60 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 
+# ----------------------
+# Background workers
+# ----------------------
+@app.on_event("startup")
+def start_background_workers():
+    auth_manager.sessions.start_reaper(float(os.getenv("SESSION_REAP_INTERVAL_SECONDS", 60)))
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    auth_manager.sessions.stop_reaper()
+    blocking_executor.shutdown()
+    logger.close() # Flush queued audit entries
+    notification_dispatcher.shutdown() # Deliver queued notifications
+    if email_notifier:
+        email_notifier.close() # Send pending digests
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
+
+
+async def get_principal(request: Request):
+    """Returns the session's principal (username, role, department_id), or None if not logged in."""
+    token = request.cookies.get("session_token")
+    if not token:
+        return None
+    return await run_blocking(auth_manager.get_principal, token) # One session lookup per request
+
+
+@app.exception_handler(ExecutorSaturatedError)
+async def executor_saturated(request: Request, exc: ExecutorSaturatedError):
+    # Shed load instead of queueing behind a backlog of blocking calls
+    return HTMLResponse("Server is busy, please try again shortly.", status_code=503, headers={"Retry-After": "1"})
+
+
+@app.get("/metrics/executor")
+async def executor_metrics(request: Request):
+    principal = await get_principal(request)
+    if not principal or principal["role"] != "admin":
+        return RedirectResponse(url="/login")
+    return JSONResponse(blocking_executor.metrics())
+
+
+@app.get("/metrics/sessions")
+async def session_metrics(request: Request):
+    principal = await get_principal(request)
+    if not principal or principal["role"] != "admin":
+        return RedirectResponse(url="/login")
+    # Counting live sessions may query the shared store
+    return JSONResponse(await run_blocking(auth_manager.get_session_stats))
+
+
 # ----------------------
 # Dashboard
 # ----------------------
@@ -43,21 +109,19 @@ async def home():
 
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request):
-    token = request.cookies.get("session_token")
-    if token and auth_manager.validate_token(token):
-        username = auth_manager.get_logged_in_user(token)
-        role = auth_manager.get_user_role(token)
+    principal = await get_principal(request)
+    if principal:
+        username, role = principal["username"], principal["role"]
 
-        # Load user's notifications
-        notifications = [
-            n for n in inapp_notifier.notifications if n["to"] == username
-        ][::-1]  # latest first
+        # Latest few notifications, from the per-recipient index
+        notifications, _ = await run_blocking(inapp_notifier.get_notifications, username, limit=5)
 
         return templates.TemplateResponse("dashboard.html", {
             "request": request,
             "username": username,
             "role": role,
-            "notifications": notifications
+            "notifications": notifications,
+            "unread_count": await run_blocking(inapp_notifier.unread_count, username)
         })
     return RedirectResponse(url="/login")
 
@@ -73,7 +137,7 @@ async def login_page(request: Request):
 
 @app.post("/login")
 async def login_user(request: Request, username: str = Form(...), password: str = Form(...)):
-    success, result = auth_manager.login(username, password)
+    success, result = await run_blocking(auth_manager.login, username, password)
     if not success:
         logger.log_event(username, "Login Failed", {"reason": "Invalid credentials"})
         return templates.TemplateResponse("login.html", {"request": request, "error": result, "username": None})
@@ -92,14 +156,14 @@ async def register_page(request: Request):
 async def register_user(request: Request,
                         username: str = Form(...),
                         password: str = Form(...)):   
-    success, msg = auth_manager.register_user(username, password, "employee")  
+    success, msg = await run_blocking(auth_manager.register_user, username, password, "employee")  
     if not success:
         return templates.TemplateResponse("register.html", {"request": request, "error": msg, "username": None})
     
     # Log the registration attempt
     logger.log_event(username, "Registration Successful")  
 
-    success, token = auth_manager.login(username, password)
+    success, token = await run_blocking(auth_manager.login, username, password)
     response = RedirectResponse(url="/dashboard", status_code=303)
     response.set_cookie(key="session_token", value=token, httponly=True)
     return response
@@ -110,12 +174,12 @@ async def logout(request: Request):
     token = request.cookies.get("session_token")
     if token:
         # Get username BEFORE logging out the session
-        username = auth_manager.get_logged_in_user(token)
+        username = await run_blocking(auth_manager.get_logged_in_user, token)
         # Log the event with the correct username
         logger.log_event(username, "Logged out")
         
         # Now, log out the session
-        auth_manager.logout(token)
+        await run_blocking(auth_manager.logout, token)
     
     response = RedirectResponse(url="/login", status_code=303)
     response.delete_cookie("session_token")
@@ -124,108 +188,50 @@ async def logout(request: Request):
 # ----------------------
 # Attendance Routes
 # ----------------------
-@app.get("/attendance", response_class=HTMLResponse)
-async def attendance_page(request: Request):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
-        return RedirectResponse(url="/login")
-
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
-
-     
-    records = []
-    total_hours = 0
-
+def attendance_row(r):
+    return {
+        "employee_id": r.employee_id,
+        "date": r.date,
+        "check_in": r.check_in or '-',
+        "check_out": r.check_out or '-',
+        "hours": hours_from_seconds(r.worked_seconds)
+    }
+
+
+async def load_attendance(principal):
+    """Returns (records, total_hours) visible to the user, read through the async session."""
+    username, role = principal["username"], principal["role"]
     if role == 'admin': # Admin sees ALL records
-        all_db_records = attendance_manager.get_all_attendance_records()
-        for r in all_db_records:
-            hours_worked_for_entry = 0
-            if r.check_in and r.check_out:
-                try:
-                    in_time = datetime.strptime(r.check_in, "%H:%M:%S")
-                    out_time = datetime.strptime(r.check_out, "%H:%M:%S")
-                    delta = out_time - in_time
-                    hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                except ValueError:
-                    hours_worked_for_entry = 0 
-            records.append({
-                "employee_id": r.employee_id,
-                "date": r.date,
-                "check_in": r.check_in or '-',
-                "check_out": r.check_out or '-',
-                "hours": hours_worked_for_entry
-            })
-        total_hours_dict = attendance_manager.get_total_hours_for_all_employees()
-        total_hours = sum(total_hours_dict.values()) if total_hours_dict else 0
-        
-    elif role == 'manager': # Manager sees records for their department and sub-departments
-        
-        # Adjust this to use get_all_users and find the manager's department_id
-        manager_user_obj = next((u for u in auth_manager.get_all_users() if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
+        records = [attendance_row(r) for r in await attendance_manager.get_all_attendance_records_async()]
+        total_hours_dict = await attendance_manager.get_total_hours_for_all_employees_async()
+        return records, sum(total_hours_dict.values()) if total_hours_dict else 0
 
+    if role == 'manager': # Manager sees records for their department and sub-departments
+        # The manager's department comes from the session principal
+        manager_dept_id = principal["department_id"]
         if manager_dept_id:
-            # Get all relevant department IDs (manager's dept + its children)
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            
-            # Fetch users in these departments
-            users_in_relevant_depts = auth_manager.get_users_by_department_ids(relevant_dept_ids)
-            relevant_usernames = [u["username"] for u in users_in_relevant_depts]
-
-            # Fetch attendance records for these users
-            all_db_records = attendance_manager.get_attendance_for_employees(relevant_usernames)
-            for r in all_db_records:
-                hours_worked_for_entry = 0
-                if r.check_in and r.check_out:
-                    try:
-                        in_time = datetime.strptime(r.check_in, "%H:%M:%S")
-                        out_time = datetime.strptime(r.check_out, "%H:%M:%S")
-                        delta = out_time - in_time
-                        hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                    except ValueError:
-                        hours_worked_for_entry = 0 
-                records.append({
-                    "employee_id": r.employee_id,
-                    "date": r.date,
-                    "check_in": r.check_in or '-',
-                    "check_out": r.check_out or '-',
-                    "hours": hours_worked_for_entry
-                })
-            
+            all_db_records = await attendance_manager.get_attendance_for_department_async(manager_dept_id)
+            records = [attendance_row(r) for r in all_db_records]
             # Calculate total hours for relevant employees
-            total_hours_dict = attendance_manager.get_total_hours_for_employees(relevant_usernames)
-            total_hours = sum(total_hours_dict.values()) if total_hours_dict else 0
-        else:
-            # Manager not assigned to a department, show only their own records or a message
-            records = attendance_manager.get_attendance_for_employee(username)
-            for r in records:  
-                hours_worked_for_entry = 0
-                if r.get("check_in") and r.get("check_out"):
-                    try:
-                        in_time = datetime.strptime(r["check_in"], "%H:%M:%S")
-                        out_time = datetime.strptime(r["check_out"], "%H:%M:%S")
-                        delta = out_time - in_time
-                        hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                    except ValueError:
-                        hours_worked_for_entry = 0
-                r["hours"] = hours_worked_for_entry
-            total_hours = attendance_manager.get_total_hours_for_employee(username)
-            
-    else: # Employee role
-        records = attendance_manager.get_attendance_for_employee(username)
-        for r in records:
-            hours_worked_for_entry = 0
-            if r.get("check_in") and r.get("check_out"):
-                try:
-                    in_time = datetime.strptime(r["check_in"], "%H:%M:%S")
-                    out_time = datetime.strptime(r["check_out"], "%H:%M:%S")
-                    delta = out_time - in_time
-                    hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                except ValueError:
-                    hours_worked_for_entry = 0
-            r["hours"] = hours_worked_for_entry
-        total_hours = attendance_manager.get_total_hours_for_employee(username)
+            total_hours_dict = await attendance_manager.get_total_hours_for_department_async(manager_dept_id)
+            return records, sum(total_hours_dict.values()) if total_hours_dict else 0
+        # Manager not assigned to a department: show only their own records
+
+    # Employee role
+    records = await attendance_manager.get_attendance_for_employee_async(username)
+    total_hours = await attendance_manager.get_total_hours_for_employee_async(username)
+    return records, total_hours
+
+
+@app.get("/attendance", response_class=HTMLResponse)
+async def attendance_page(request: Request):
+    principal = await get_principal(request)
+    if not principal:
+        return RedirectResponse(url="/login")
+
+    username = principal["username"]
+    role = principal["role"]
+    records, total_hours = await load_attendance(principal)
 
     return templates.TemplateResponse("attendance.html", {
         "request": request,
@@ -240,101 +246,18 @@ async def attendance_page(request: Request):
 
 @app.post("/attendance/checkin")
 async def attendance_checkin(request: Request):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
 
-    success, msg = attendance_manager.check_in(username)
+    success, msg = await run_blocking(attendance_manager.check_in, username)
     notification_manager.send_notification(msg, username)
 
     # Re-fetch data based on role, just like the GET route
-    records = []
-    total_hours = 0
-
-    if role == 'admin': # Admin sees ALL records
-        all_db_records = attendance_manager.get_all_attendance_records()
-        for r in all_db_records:
-            hours_worked_for_entry = 0
-            if r.check_in and r.check_out:
-                try:
-                    in_time = datetime.strptime(r.check_in, "%H:%M:%S")
-                    out_time = datetime.strptime(r.check_out, "%H:%M:%S")
-                    delta = out_time - in_time
-                    hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                except ValueError:
-                    hours_worked_for_entry = 0 
-            records.append({
-                "employee_id": r.employee_id,
-                "date": r.date,
-                "check_in": r.check_in or '-',
-                "check_out": r.check_out or '-',
-                "hours": hours_worked_for_entry
-            })
-        total_hours_dict = attendance_manager.get_total_hours_for_all_employees()
-        total_hours = sum(total_hours_dict.values()) if total_hours_dict else 0
-
-    elif role == 'manager': # Manager sees records for their department and sub-departments
-        manager_user_obj = next((u for u in auth_manager.get_all_users() if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
-
-        if manager_dept_id:
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            users_in_relevant_depts = auth_manager.get_users_by_department_ids(relevant_dept_ids)
-            relevant_usernames = [u["username"] for u in users_in_relevant_depts]
-
-            all_db_records = attendance_manager.get_attendance_for_employees(relevant_usernames)
-            for r in all_db_records:
-                hours_worked_for_entry = 0
-                if r.check_in and r.check_out:
-                    try:
-                        in_time = datetime.strptime(r.check_in, "%H:%M:%S")
-                        out_time = datetime.strptime(r.check_out, "%H:%M:%S")
-                        delta = out_time - in_time
-                        hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                    except ValueError:
-                        hours_worked_for_entry = 0 
-                records.append({
-                    "employee_id": r.employee_id,
-                    "date": r.date,
-                    "check_in": r.check_in or '-',
-                    "check_out": r.check_out or '-',
-                    "hours": hours_worked_for_entry
-                })
-
-            total_hours_dict = attendance_manager.get_total_hours_for_employees(relevant_usernames)
-            total_hours = sum(total_hours_dict.values()) if total_hours_dict else 0
-        else:
-            records = attendance_manager.get_attendance_for_employee(username)
-            for r in records:
-                hours_worked_for_entry = 0
-                if r.get("check_in") and r.get("check_out"):
-                    try:
-                        in_time = datetime.strptime(r["check_in"], "%H:%M:%S")
-                        out_time = datetime.strptime(r["check_out"], "%H:%M:%S")
-                        delta = out_time - in_time
-                        hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                    except ValueError:
-                        hours_worked_for_entry = 0
-                r["hours"] = hours_worked_for_entry
-            total_hours = attendance_manager.get_total_hours_for_employee(username)
-
-    else: # Employee role
-        records = attendance_manager.get_attendance_for_employee(username)
-        for r in records:
-            hours_worked_for_entry = 0
-            if r.get("check_in") and r.get("check_out"):
-                try:
-                    in_time = datetime.strptime(r["check_in"], "%H:%M:%S")
-                    out_time = datetime.strptime(r["check_out"], "%H:%M:%S")
-                    delta = out_time - in_time
-                    hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                except ValueError:
-                    hours_worked_for_entry = 0
-            r["hours"] = hours_worked_for_entry
-        total_hours = attendance_manager.get_total_hours_for_employee(username)
+    records, total_hours = await load_attendance(principal)
 
     return templates.TemplateResponse("attendance.html", {
         "request": request,
@@ -347,102 +270,18 @@ async def attendance_checkin(request: Request):
 
 @app.post("/attendance/checkout")
 async def attendance_checkout(request: Request):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
 
-    success, msg = attendance_manager.check_out(username)
+    success, msg = await run_blocking(attendance_manager.check_out, username)
     notification_manager.send_notification(msg, username)
 
     # Re-fetch data based on role, just like the GET route
-    records = []
-    total_hours = 0
-
-    if role == 'admin': # Admin sees ALL records
-        all_db_records = attendance_manager.get_all_attendance_records()
-        for r in all_db_records:
-            hours_worked_for_entry = 0
-            if r.check_in and r.check_out:
-                try:
-                    in_time = datetime.strptime(r.check_in, "%H:%M:%S")
-                    out_time = datetime.strptime(r.check_out, "%H:%M:%S")
-                    delta = out_time - in_time
-                    hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                except ValueError:
-                    hours_worked_for_entry = 0 
-
-            records.append({
-                "employee_id": r.employee_id,
-                "date": r.date,
-                "check_in": r.check_in or '-',
-                "check_out": r.check_out or '-',
-                "hours": hours_worked_for_entry
-            })
-        total_hours_dict = attendance_manager.get_total_hours_for_all_employees()
-        total_hours = sum(total_hours_dict.values()) if total_hours_dict else 0
-
-    elif role == 'manager': # Manager sees records for their department and sub-departments
-        manager_user_obj = next((u for u in auth_manager.get_all_users() if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
-
-        if manager_dept_id:
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            users_in_relevant_depts = auth_manager.get_users_by_department_ids(relevant_dept_ids)
-            relevant_usernames = [u["username"] for u in users_in_relevant_depts]
-
-            all_db_records = attendance_manager.get_attendance_for_employees(relevant_usernames)
-            for r in all_db_records:
-                hours_worked_for_entry = 0
-                if r.check_in and r.check_out:
-                    try:
-                        in_time = datetime.strptime(r.check_in, "%H:%M:%S")
-                        out_time = datetime.strptime(r.check_out, "%H:%M:%S")
-                        delta = out_time - in_time
-                        hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                    except ValueError:
-                        hours_worked_for_entry = 0 
-                records.append({
-                    "employee_id": r.employee_id,
-                    "date": r.date,
-                    "check_in": r.check_in or '-',
-                    "check_out": r.check_out or '-',
-                    "hours": hours_worked_for_entry
-                })
-
-            total_hours_dict = attendance_manager.get_total_hours_for_employees(relevant_usernames)
-            total_hours = sum(total_hours_dict.values()) if total_hours_dict else 0
-        else:
-            records = attendance_manager.get_attendance_for_employee(username)
-            for r in records:
-                hours_worked_for_entry = 0
-                if r.get("check_in") and r.get("check_out"):
-                    try:
-                        in_time = datetime.strptime(r["check_in"], "%H:%M:%S")
-                        out_time = datetime.strptime(r["check_out"], "%H:%M:%S")
-                        delta = out_time - in_time
-                        hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                    except ValueError:
-                        hours_worked_for_entry = 0
-                r["hours"] = hours_worked_for_entry
-            total_hours = attendance_manager.get_total_hours_for_employee(username)
-
-    else: # Employee role
-        records = attendance_manager.get_attendance_for_employee(username)
-        for r in records:
-            hours_worked_for_entry = 0
-            if r.get("check_in") and r.get("check_out"):
-                try:
-                    in_time = datetime.strptime(r["check_in"], "%H:%M:%S")
-                    out_time = datetime.strptime(r["check_out"], "%H:%M:%S")
-                    delta = out_time - in_time
-                    hours_worked_for_entry = round(delta.total_seconds() / 3600, 2)
-                except ValueError:
-                    hours_worked_for_entry = 0
-            r["hours"] = hours_worked_for_entry
-        total_hours = attendance_manager.get_total_hours_for_employee(username)
+    records, total_hours = await load_attendance(principal)
 
     return templates.TemplateResponse("attendance.html", {
         "request": request,
@@ -457,24 +296,25 @@ async def attendance_checkout(request: Request):
 # Notifications Route
 # ----------------------
 @app.get("/notifications", response_class=HTMLResponse)
-async def notifications_page(request: Request):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+async def notifications_page(request: Request, cursor: Optional[int] = None):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
 
-    # Get notifications for this user
-    notifications = [
-        n for n in inapp_notifier.notifications if n["to"] == username
-    ][::-1]  # latest first
+    # One page for this user, latest first
+    notifications, next_cursor = await run_blocking(inapp_notifier.get_notifications, username, cursor=cursor, limit=NOTIFICATIONS_PAGE_SIZE)
+    if cursor is None and notifications:
+        await run_blocking(inapp_notifier.mark_read, username, notifications[0]["id"])
 
     return templates.TemplateResponse("notification.html", {
         "request": request,
         "username": username,
         "role": role,
-        "notifications": notifications
+        "notifications": notifications,
+        "next_cursor": next_cursor
     })
 
 
@@ -483,33 +323,27 @@ async def notifications_page(request: Request):
 # ----------------------
 @app.get("/payroll", response_class=HTMLResponse)
 async def payroll_page(request: Request):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
     
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
     
-    # Fetch all users for the payslip generation dropdown (for admins/managers)
-    all_users = auth_manager.get_all_users()
+    # Fetch all users for the payslip generation dropdown (only rendered for admins)
+    all_users = await auth_manager.get_all_users_async() if role == "admin" else []
 
     if role == "admin": # Admin sees all payslips
-        slips = payroll_manager.get_all_payslips()
+        slips = await payroll_manager.get_all_payslips_async()
     elif role == "manager": # Manager sees payslips for their department and sub-departments
-        manager_user_obj = next((u for u in auth_manager.get_all_users() if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
+        manager_dept_id = principal["department_id"]
 
         if manager_dept_id:
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            # Get usernames in these departments
-            users_in_relevant_depts = auth_manager.get_users_by_department_ids(relevant_dept_ids)
-            relevant_usernames = [u["username"] for u in users_in_relevant_depts]
-            
-            slips = payroll_manager.get_payslips_by_employees(relevant_usernames) # New method needed in payroll.py
+            slips = await payroll_manager.get_payslips_for_department_async(manager_dept_id)
         else:
             slips = [] # Manager not assigned to a department sees no payslips by default
     else: # Employee sees only their own payslips
-        slips = payroll_manager.get_payslips_by_employee(username)
+        slips = await payroll_manager.get_payslips_by_employee_async(username)
 
     # Pass the correct template and context
     return templates.TemplateResponse("payroll.html", { # <-- Corrected template name
@@ -530,12 +364,12 @@ async def generate_payslip(request: Request,
                            overtime_hours: float = Form(...),
                            month: str = Form(...),
                            year: int = Form(...)):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
 
     # Initialize message and slip (will be set to None if generation fails)
     message = None
@@ -547,7 +381,8 @@ async def generate_payslip(request: Request,
         logger.log_event(username, "Payslip Generation Failed", {"reason": "Unauthorized role"})
     else:
         # Call generate_payslip and handle its new return format
-        success, result = payroll_manager.generate_payslip(
+        success, result = await run_blocking(
+            payroll_manager.generate_payslip,
             employee_id=employee_id,
             base_salary=base_salary,
             hours_worked=hours_worked,
@@ -567,22 +402,18 @@ async def generate_payslip(request: Request,
     # Re-fetch slips based on role for the template response (consistent with GET /payroll)
     slips = [] 
     if role == "admin":
-        slips = payroll_manager.get_all_payslips()
+        slips = await payroll_manager.get_all_payslips_async()
     elif role == "manager":
-        manager_user_obj = next((u for u in auth_manager.get_all_users() if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
+        manager_dept_id = principal["department_id"]
         if manager_dept_id:
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            users_in_relevant_depts = auth_manager.get_users_by_department_ids(relevant_dept_ids)
-            relevant_usernames = [u["username"] for u in users_in_relevant_depts]
-            slips = payroll_manager.get_payslips_by_employees(relevant_usernames)
+            slips = await payroll_manager.get_payslips_for_department_async(manager_dept_id)
         else:
             slips = []
     else: # Employee
-        slips = payroll_manager.get_payslips_by_employee(username)
+        slips = await payroll_manager.get_payslips_by_employee_async(username)
 
-    # Fetch all users for the dropdown (for admins/managers)
-    all_users = auth_manager.get_all_users()
+    # Fetch all users for the dropdown (only rendered for admins)
+    all_users = await auth_manager.get_all_users_async() if role == "admin" else []
 
     return templates.TemplateResponse("payroll.html", {
         "request": request,
@@ -595,14 +426,14 @@ async def generate_payslip(request: Request,
 
 @app.get("/payroll/download/{payslip_id}")
 async def download_payslip(request: Request, payslip_id: int):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
     
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token) # <-- Add this line
+    username = principal["username"]
+    role = principal["role"] # <-- Add this line
     
-    payslip_data = payroll_manager.get_payslip_by_id(payslip_id)
+    payslip_data = await run_blocking(payroll_manager.get_payslip_by_id, payslip_id)
     
     # Basic authorization check: ensure the user can only download their own payslip
     # or if the user is an admin/manager (add role check if needed)
@@ -612,7 +443,7 @@ async def download_payslip(request: Request, payslip_id: int):
         return RedirectResponse(url="/payroll", status_code=303)
     
     # Generate the PDF into an in-memory BytesIO object
-    pdf_bytes_io = pdf_payslip_generator.generate_payslip_pdf(payslip_data)
+    pdf_bytes_io = await run_blocking(pdf_payslip_generator.generate_payslip_pdf, payslip_data)
     
     # Set the BytesIO object's cursor to the beginning
     pdf_bytes_io.seek(0)
@@ -635,30 +466,28 @@ report_manager = ReportManager()
 # ----------------------
 @app.get("/reports", response_class=HTMLResponse)
 async def reports_page(request: Request):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
 
     task_report = {}
     total_hours = {}
     total_pay = {}
 
     if role == 'admin': # Admin sees all reports
-        task_report = report_manager.get_task_report_by_employee()
-        total_hours = report_manager.get_total_hours_by_employee()
-        total_pay = report_manager.get_total_pay_by_employee()
+        task_report = await report_manager.get_task_report_by_employee_async()
+        total_hours = await report_manager.get_total_hours_by_employee_async()
+        total_pay = await report_manager.get_total_pay_by_employee_async()
     elif role == 'manager': # Manager sees reports for their department and sub-departments
-        manager_user_obj = next((u for u in auth_manager.get_all_users() if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
+        manager_dept_id = principal["department_id"]
 
         if manager_dept_id:
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            task_report = report_manager.get_task_report_by_department_ids(relevant_dept_ids)
-            total_hours = report_manager.get_total_hours_by_department_ids(relevant_dept_ids)
-            total_pay = report_manager.get_total_pay_by_department_ids(relevant_dept_ids)
+            task_report = await report_manager.get_task_report_for_department_async(manager_dept_id)
+            total_hours = await report_manager.get_total_hours_for_department_async(manager_dept_id)
+            total_pay = await report_manager.get_total_pay_for_department_async(manager_dept_id)
         # If manager has no department, reports will be empty as initialized
     # Employees don't access this page (handled by main.py route guard)
     return templates.TemplateResponse("reports.html", {
@@ -672,15 +501,15 @@ async def reports_page(request: Request):
 
 @app.get("/reports/download/tasks")
 async def download_task_report(request: Request):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    role = auth_manager.get_user_role(token)
+    role = principal["role"]
     if role not in ["admin", "manager"]:
         return RedirectResponse(url="/dashboard")
 
-    filename = pdf_generator.generate_task_report_pdf()
+    filename = await run_blocking(pdf_generator.generate_task_report_pdf)
 
     return FileResponse(
         filename,
@@ -692,74 +521,40 @@ async def download_task_report(request: Request):
 
 from task_manager import TaskManager
 
-task_manager = TaskManager(notifier=inapp_notifier)
+task_manager = TaskManager(notifier=notification_manager)
 
 # ----------------------
 # Task Manager Routes
 # ----------------------
 @app.get("/tasks", response_class=HTMLResponse)
 async def tasks_page(request: Request):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
-    # Initialize tasks list
-    tasks = []
-
-    if role == 'admin': # Admin sees ALL tasks
-        tasks = task_manager.get_all_tasks()
-        
-    elif role == 'manager': # Manager sees tasks for their department and sub-departments
-        # Get the manager's department ID
-        manager_user_obj = next((u for u in auth_manager.get_all_users() if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
-
-        if manager_dept_id:
-            # Get all relevant department IDs (manager's dept + its children)
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            
-            # Fetch users in these departments
-            users_in_relevant_depts = auth_manager.get_users_by_department_ids(relevant_dept_ids)
-            relevant_usernames = [u["username"] for u in users_in_relevant_depts]
-
-            # Fetch tasks for these users
-            tasks = task_manager.get_tasks_for_employees(relevant_usernames) # New method
-        else:
-            # Manager not assigned to a department, show only their own tasks
-            tasks = task_manager.get_tasks_by_user(username)
-            
-    else: # Employee role
-        tasks = task_manager.get_tasks_by_user(username)
-    
-    # Fetch all users initially
-    all_users_for_dropdown = auth_manager.get_all_users()
+    username = principal["username"]
+    role = principal["role"]
 
     # Initialize tasks list
     tasks = []
 
     if role == 'admin': # Admin sees ALL tasks and can assign to anyone
-        tasks = task_manager.get_all_tasks()
-        all_users = all_users_for_dropdown # Admin can assign to all users
+        tasks = await task_manager.get_all_tasks_async()
+        all_users = await auth_manager.get_all_users_async() # Admin can assign to all users
         
     elif role == 'manager': # Manager sees tasks for their department and sub-departments, and can assign to users in those depts
-        manager_user_obj = next((u for u in all_users_for_dropdown if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
+        manager_dept_id = principal["department_id"]
 
         if manager_dept_id:
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            users_in_relevant_depts = auth_manager.get_users_by_department_ids(relevant_dept_ids)
-            relevant_usernames = [u["username"] for u in users_in_relevant_depts]
-            tasks = task_manager.get_tasks_for_employees(relevant_usernames)
-            all_users = users_in_relevant_depts # Manager can only assign to users in relevant depts
+            tasks = await task_manager.get_tasks_for_department_async(manager_dept_id)
+            all_users = await run_blocking(scope_resolver.get_users, manager_dept_id) # Manager can only assign to users in relevant depts
         else:
             # Manager not assigned to a department, show only their own tasks and can only assign to themselves
-            tasks = task_manager.get_tasks_by_user(username)
+            tasks = await task_manager.get_tasks_by_user_async(username)
             all_users = [{'username': username, 'role': role, 'department_id': manager_dept_id}] # Can only assign to self
             
     else: # Employee role - sees only their own tasks and can only assign to themselves
-        tasks = task_manager.get_tasks_by_user(username)
+        tasks = await task_manager.get_tasks_by_user_async(username)
         all_users = [{'username': username, 'role': role, 'department_id': None}] # Can only assign to self
 
     return templates.TemplateResponse("tasks.html", {
@@ -778,16 +573,16 @@ async def create_task(request: Request,
                       assigned_to: str = Form(...),
                       deadline: str = Form(...),
                       task_type: str = Form("Task")):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
     message = None # Initialize message
 
     try:
-        task_manager.create_task(title, description, assigned_to, deadline, task_type)
+        await run_blocking(task_manager.create_task, title, description, assigned_to, deadline, task_type)
         message = "Task created successfully!"
         logger.log_event(username, "Task Created", {"title": title, "assigned_to": assigned_to})
     except Exception as e:
@@ -797,34 +592,26 @@ async def create_task(request: Request,
     # Reload tasks and all users based on role
     tasks = [] # Initialize tasks list
     if role == 'admin': # Admin sees ALL tasks
-        tasks = task_manager.get_all_tasks()
+        tasks = await task_manager.get_all_tasks_async()
         
     elif role == 'manager': # Manager sees tasks for their department and sub-departments
-        manager_user_obj = next((u for u in auth_manager.get_all_users() if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
+        manager_dept_id = principal["department_id"]
 
         if manager_dept_id:
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            users_in_relevant_depts = auth_manager.get_users_by_department_ids(relevant_dept_ids)
-            relevant_usernames = [u["username"] for u in users_in_relevant_depts]
-            tasks = task_manager.get_tasks_for_employees(relevant_usernames)
+            tasks = await task_manager.get_tasks_for_department_async(manager_dept_id)
         else:
-            tasks = task_manager.get_tasks_by_user(username)
+            tasks = await task_manager.get_tasks_by_user_async(username)
             
     else: # Employee role
-        tasks = task_manager.get_tasks_by_user(username)
+        tasks = await task_manager.get_tasks_by_user_async(username)
     
     # Re-evaluate all_users for dropdown based on role after task creation
-    all_users_for_dropdown = auth_manager.get_all_users() # Fetch all users initially for manager logic
-
     if role == 'admin':
-        all_users = all_users_for_dropdown
+        all_users = await auth_manager.get_all_users_async()
     elif role == 'manager':
-        manager_user_obj = next((u for u in all_users_for_dropdown if u['username'] == username), None)
-        manager_dept_id = manager_user_obj['department_id'] if manager_user_obj else None
+        manager_dept_id = principal["department_id"]
         if manager_dept_id:
-            relevant_dept_ids = department_manager.get_all_department_ids_in_hierarchy(manager_dept_id)
-            all_users = auth_manager.get_users_by_department_ids(relevant_dept_ids)
+            all_users = await run_blocking(scope_resolver.get_users, manager_dept_id)
         else:
             all_users = [{'username': username, 'role': role, 'department_id': manager_dept_id}]
     else:
@@ -841,25 +628,25 @@ async def create_task(request: Request,
 
 @app.post("/tasks/update_status")
 async def update_task_status(request: Request, task_id: str = Form(...), new_status: str = Form(...)):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
     
     # Check if the user is authorized to update this task
-    task = task_manager.get_task_by_id(task_id)
+    task = await run_blocking(task_manager.get_task_by_id, task_id)
     if task and task.get('assigned_to') != username and role != 'admin':
         return RedirectResponse(url="/dashboard?message=Unauthorized to update this task.")
 
-    success, msg = task_manager.update_task_status(task_id, new_status)
+    success, msg = await run_blocking(task_manager.update_task_status, task_id, new_status)
     
     # Log the event
     logger.log_event(username, "Task Status Updated", {"task_id": task_id, "new_status": new_status})
     
     # Reload tasks and return to the page
-    tasks = task_manager.get_tasks_by_user(username)
+    tasks = await task_manager.get_tasks_by_user_async(username)
     return templates.TemplateResponse("tasks.html", {
         "request": request,
         "username": username,
@@ -873,18 +660,18 @@ async def update_task_status(request: Request, task_id: str = Form(...), new_sta
 # ----------------------
 @app.get("/admin/users", response_class=HTMLResponse)
 async def user_management_page(request: Request, message: str | None = None):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
 
     if role != "admin":
         return RedirectResponse(url="/dashboard")
     
-    all_users = auth_manager.get_all_users()
-    departments = department_manager.get_all_departments_db() # Fetch all departments
+    all_users = await auth_manager.get_all_users_async()
+    departments = await run_blocking(department_manager.get_all_departments_db) # Fetch all departments
 
     return templates.TemplateResponse("user_management.html", {
         "request": request,
@@ -897,16 +684,16 @@ async def user_management_page(request: Request, message: str | None = None):
 
 @app.post("/admin/update_role")
 async def update_user_role(request: Request, username: str = Form(...), new_role: str = Form(...), department_id: Optional[int] = Form(None)):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    admin_username = auth_manager.get_logged_in_user(token)
-    current_role = auth_manager.get_user_role(token)
+    admin_username = principal["username"]
+    current_role = principal["role"]
     if current_role != "admin":
         return RedirectResponse(url="/dashboard")
 
-    success, msg = auth_manager.update_user_role(admin_username, username, new_role, department_id if department_id != 0 else None)
+    success, msg = await run_blocking(auth_manager.update_user_role, admin_username, username, new_role, department_id if department_id != 0 else None)
     
     # Redirect back to the user management page with the message as a query parameter
     return RedirectResponse(f"/admin/users?message={msg}", status_code=303)
@@ -915,23 +702,43 @@ async def update_user_role(request: Request, username: str = Form(...), new_role
 # Audit Logs Route
 # ----------------------
 @app.get("/logs", response_class=HTMLResponse)
-async def logs_page(request: Request):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+async def logs_page(request: Request, username: Optional[str] = None, action: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None, cursor: Optional[str] = None):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    current_user = principal["username"]
+    role = principal["role"]
     if role != "admin":
         return RedirectResponse(url="/dashboard")
 
-    logs = logger.get_logs()[::-1]  # Latest first
+    # datetime-local inputs send "YYYY-MM-DDTHH:MM"; stored timestamps use a space
+    filters = {
+        "username": username or None,
+        "action": action or None,
+        "since": since.replace("T", " ") if since else None,
+        "until": until.replace("T", " ") if until else None,
+    }
+    # One page, latest first, from the indexed audit_log table
+    try:
+        logs, next_cursor = await run_blocking(logger.query_logs, cursor=cursor, limit=LOGS_PAGE_SIZE, **filters)
+    except ValueError:
+        return HTMLResponse("Invalid cursor.", status_code=400)
+    older_url = None
+    if next_cursor:
+        # Keep the values as sent so the form can show them again on the next page
+        query = {name: value for name, value in
+                 {"username": username, "action": action, "since": since, "until": until}.items() if value}
+        older_url = "/logs?" + urlencode({**query, "cursor": next_cursor})
 
     return templates.TemplateResponse("logs.html", {
         "request": request,
-        "username": username,
+        "username": current_user,
         "role": role,
-        "logs": logs
+        "logs": logs,
+        "filters": {"username": username or "", "action": action or "", "since": since or "", "until": until or ""},
+        "older_url": older_url
     })
 
 # ----------------------
@@ -939,18 +746,18 @@ async def logs_page(request: Request):
 # ----------------------
 @app.get("/admin/departments", response_class=HTMLResponse)
 async def department_management_page(request: Request, message: str | None = None):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    username = auth_manager.get_logged_in_user(token)
-    role = auth_manager.get_user_role(token)
+    username = principal["username"]
+    role = principal["role"]
 
     if role != "admin":
         return RedirectResponse(url="/dashboard?message=Unauthorized access to department management.")
 
-    departments_flat = department_manager.get_all_departments_db() # Get flat list for dropdowns
-    department_tree = department_manager.get_department_tree() # Get hierarchical structure for display
+    departments_flat = await run_blocking(department_manager.get_all_departments_db) # Get flat list for dropdowns
+    department_tree = await run_blocking(department_manager.get_department_tree) # Get hierarchical structure for display
 
     return templates.TemplateResponse("department_management.html", {
         "request": request,
@@ -963,43 +770,43 @@ async def department_management_page(request: Request, message: str | None = Non
 
 @app.post("/admin/departments/create")
 async def create_department(request: Request, name: str = Form(...), parent_id: Optional[int] = Form(None)):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    role = auth_manager.get_user_role(token)
+    role = principal["role"]
     if role != "admin":
         return RedirectResponse(url="/dashboard?message=Unauthorized to create departments.")
 
     # Use the direct DB method from DepartmentManager
-    success, msg = department_manager.create_department_db(name, parent_id if parent_id != 0 else None)
+    success, msg = await run_blocking(department_manager.create_department_db, name, parent_id if parent_id != 0 else None)
     
     return RedirectResponse(f"/admin/departments?message={msg}", status_code=303)
 
 @app.post("/admin/departments/update")
 async def update_department(request: Request, dept_id: int = Form(...), new_name: str = Form(...), new_parent_id: Optional[int] = Form(None)):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    role = auth_manager.get_user_role(token)
+    role = principal["role"]
     if role != "admin":
         return RedirectResponse(url="/dashboard?message=Unauthorized to update departments.")
 
-    success, msg = department_manager.update_department_db(dept_id, new_name, new_parent_id if new_parent_id != 0 else None)
+    success, msg = await run_blocking(department_manager.update_department_db, dept_id, new_name, new_parent_id if new_parent_id != 0 else None)
     
     return RedirectResponse(f"/admin/departments?message={msg}", status_code=303)
 
 @app.post("/admin/departments/delete")
 async def delete_department(request: Request, dept_id: int = Form(...)):
-    token = request.cookies.get("session_token")
-    if not token or not auth_manager.validate_token(token):
+    principal = await get_principal(request)
+    if not principal:
         return RedirectResponse(url="/login")
 
-    role = auth_manager.get_user_role(token)
+    role = principal["role"]
     if role != "admin":
         return RedirectResponse(url="/dashboard?message=Unauthorized to delete departments.")
 
-    success, msg = department_manager.delete_department_db(dept_id)
+    success, msg = await run_blocking(department_manager.delete_department_db, dept_id)
     
     return RedirectResponse(f"/admin/departments?message={msg}", status_code=303)
\ No newline at end of file
@@ -0,0 +1,263 @@
+# migrations.py
+
+import sys
+from datetime import datetime
+
+from sqlalchemy import (
+    Table, Column, Integer, String, Float, Text, DateTime, ForeignKey, MetaData, select, func, insert, inspect, text
+)
+
+from database import (
+    Base, engine, User, Task, Attendance, Payslip, Department, DepartmentClosure, UserSession, AuditEntry,
+    rebuild_department_closure, backfill_worked_seconds
+)
+from logger import Logger
+
+# The applied version lives in its own table, outside the models' metadata
+_version_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime, default=datetime.now),
+)
+
+
+# The schema the unversioned create_tables() produced, frozen here so that
+# version 1 always means the same tables whatever the models look like now.
+# Later steps add everything the models have gained since.
+_baseline_metadata = MetaData()
+Table(
+    "departments", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, unique=True, index=True),
+    Column("parent_department_id", Integer, nullable=True),
+)
+Table(
+    "users", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String, unique=True, index=True),
+    Column("password_hash", String),
+    Column("role", String),
+    Column("department_id", Integer, ForeignKey("departments.id"), nullable=True),
+)
+Table(
+    "tasks", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("title", String),
+    Column("description", Text),
+    Column("assigned_to", String),
+    Column("deadline", String),
+    Column("status", String),
+    Column("created_at", DateTime),
+    Column("type", String),
+    Column("department_id", Integer, ForeignKey("departments.id"), nullable=True),
+)
+Table(
+    "payslips", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("employee_id", String, index=True),
+    Column("base_salary", Float),
+    Column("hours_worked", Float),
+    Column("overtime_hours", Float),
+    Column("salary", Float),
+    Column("month", String),
+    Column("year", Integer),
+    Column("strategy", String),
+    Column("generated_at", DateTime),
+    Column("department_id", Integer, ForeignKey("departments.id"), nullable=True),
+)
+Table(
+    "attendance", _baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("employee_id", String, index=True),
+    Column("date", String),
+    Column("check_in", String),
+    Column("check_out", String, nullable=True),
+    Column("department_id", Integer, ForeignKey("departments.id"), nullable=True),
+)
+
+
+# --- Migrations ---
+# Each step inspects the database before changing it, so a step is safe to run
+# on a database that already has the change (e.g. one created by an older
+# create_tables() that was never versioned, or by an earlier release of a step).
+def _baseline(connection):
+    _baseline_metadata.create_all(bind=connection) # Skips tables that already exist
+
+
+def _department_closure(connection):
+    DepartmentClosure.__table__.create(connection, checkfirst=True)
+    departments = connection.execute(select(func.count()).select_from(Department.__table__)).scalar()
+    closure_rows = connection.execute(select(func.count()).select_from(DepartmentClosure.__table__)).scalar()
+    if departments and not closure_rows:
+        rebuild_department_closure(connection)
+
+
+def _attendance_worked_seconds(connection):
+    columns = {c["name"] for c in inspect(connection).get_columns("attendance")}
+    if "worked_seconds" not in columns:
+        connection.execute(text("ALTER TABLE attendance ADD COLUMN worked_seconds FLOAT"))
+        backfilled = backfill_worked_seconds(connection)
+        print(f"[INFO] Backfilled worked_seconds for {backfilled} attendance records.")
+
+
+def _attendance_date_types(connection):
+    # SQLite stores DATE/TIME as the same text the VARCHAR columns held;
+    # server databases need the column types converted.
+    if connection.dialect.name != "postgresql":
+        return
+    columns = {c["name"]: c["type"] for c in inspect(connection).get_columns("attendance")}
+    if isinstance(columns["date"], String):
+        connection.execute(text(
+            "ALTER TABLE attendance "
+            "ALTER COLUMN date TYPE DATE USING date::date, "
+            "ALTER COLUMN check_in TYPE TIME USING check_in::time, "
+            "ALTER COLUMN check_out TYPE TIME USING check_out::time"
+        ))
+
+
+def _hot_query_indexes(connection):
+    # Add the declared indexes that are missing; tables created by later steps get theirs then
+    existing = set(inspect(connection).get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _audit_log_store(connection):
+    AuditEntry.__table__.create(connection, checkfirst=True)
+    for index in AuditEntry.__table__.indexes:
+        index.create(connection, checkfirst=True)
+    if not connection.execute(select(func.count()).select_from(AuditEntry.__table__)).scalar():
+        imported = Logger.import_log_file(connection)
+        print(f"[INFO] Imported {imported} audit log entries.")
+
+
+def _session_absolute_expiry(connection):
+    if not inspect(connection).has_table("user_sessions"):
+        UserSession.__table__.create(connection)
+        return
+    # Sessions written before idle expiry had a single, absolute deadline
+    columns = {c["name"] for c in inspect(connection).get_columns("user_sessions")}
+    if "absolute_expires_at" not in columns:
+        connection.execute(text("ALTER TABLE user_sessions ADD COLUMN absolute_expires_at FLOAT"))
+        connection.execute(text("UPDATE user_sessions SET absolute_expires_at = expires_at"))
+
+
+MIGRATIONS = [
+    (1, "Baseline schema", _baseline),
+    (2, "Department closure table", _department_closure),
+    (3, "Add attendance.worked_seconds", _attendance_worked_seconds),
+    (4, "Native DATE/TIME attendance columns", _attendance_date_types),
+    (5, "Indexes for hot manager queries", _hot_query_indexes),
+    (6, "Indexed audit log store", _audit_log_store),
+    (7, "Session table with user_sessions.absolute_expires_at", _session_absolute_expiry),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(connection):
+    """Highest applied migration, or 0 for a database that has never been migrated."""
+    if not inspect(connection).has_table("schema_version"):
+        return 0
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def run_migrations(bind=engine, target_version=LATEST_VERSION):
+    """Applies pending migrations in order, one transaction each. Returns the versions applied."""
+    applied = []
+    with bind.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+    for version, description, migrate in MIGRATIONS:
+        if version > target_version:
+            break
+        with bind.begin() as connection:
+            if get_schema_version(connection) >= version:
+                continue # Already applied (possibly by another worker)
+            migrate(connection)
+            connection.execute(insert(schema_version).values(version=version, description=description))
+        print(f"[INFO] Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+# --- Query plan report ---
+# Representative statements for the queries the managers run on every page load.
+def _hot_queries():
+    return [
+        ("AttendanceManager.check_in lookup",
+         select(Attendance.id).where(Attendance.employee_id == "employee", Attendance.date == "2025-01-01")),
+        ("AttendanceManager.get_summary_by_date",
+         select(Attendance.employee_id, Attendance.check_in).where(Attendance.date == "2025-01-01")),
+        ("AttendanceManager.get_total_hours_for_employee",
+         select(func.sum(Attendance.worked_seconds)).where(Attendance.employee_id == "employee")),
+        ("TaskManager.get_tasks_by_user",
+         select(Task.id).where(Task.assigned_to == "employee")),
+        ("TaskManager tasks by department",
+         select(Task.id).where(Task.department_id == 1)),
+        ("ReportManager.get_task_status_summary",
+         select(Task.status, func.count()).group_by(Task.status)),
+        ("PayrollManager.get_payslips_by_employee",
+         select(Payslip.id).where(Payslip.employee_id == "employee", Payslip.year == 2025, Payslip.month == "January")),
+        ("Department members",
+         select(User.username).where(User.department_id == 1)),
+        ("Department subtree (closure)",
+         select(DepartmentClosure.descendant_id).where(DepartmentClosure.ancestor_id == 1)),
+        ("Logger.query_logs recent logins",
+         select(AuditEntry.id).where(AuditEntry.action == "Login Successful", AuditEntry.timestamp >= "2025-01-01 00:00:00")
+         .order_by(AuditEntry.timestamp.desc(), AuditEntry.id.desc()).limit(50)),
+        ("Logger.query_logs by user",
+         select(AuditEntry.id).where(AuditEntry.username == "employee")
+         .order_by(AuditEntry.timestamp.desc(), AuditEntry.id.desc()).limit(50)),
+        ("Session reaper",
+         select(UserSession.token).where(UserSession.expires_at <= 0).order_by(UserSession.expires_at)),
+    ]
+
+
+def _plan(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    if compiled.positiontup:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    if connection.dialect.name == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+        details = [row[-1] for row in rows]
+        # "SCAN <table>" without an index is a full table scan
+        full_scan = any(d.startswith("SCAN") and "USING" not in d for d in details)
+    else:
+        rows = connection.exec_driver_sql(f"EXPLAIN {compiled}", params).all()
+        details = [row[0] for row in rows]
+        full_scan = any("Seq Scan" in d for d in details)
+    return details, full_scan
+
+
+def explain_report(bind=engine):
+    """Returns [{"query", "plan", "full_scan"}] for each hot manager query."""
+    report = []
+    with bind.connect() as connection:
+        for name, statement in _hot_queries():
+            plan, full_scan = _plan(connection, statement)
+            report.append({"query": name, "plan": plan, "full_scan": full_scan})
+    return report
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        applied = run_migrations()
+        with engine.connect() as connection:
+            print(f"[INFO] Schema at version {get_schema_version(connection)} ({len(applied)} applied).")
+    elif command == "explain":
+        for entry in explain_report():
+            status = "FULL SCAN" if entry["full_scan"] else "ok"
+            print(f"[{status}] {entry['query']}")
+            for line in entry["plan"]:
+                print(f"    {line}")
+    else:
+        print("Usage: python migrations.py [upgrade|explain]")
+        sys.exit(1)
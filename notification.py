@@ -1,9 +1,19 @@
 # notification.py
 
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, timedelta
+import gzip
 import json
 import os
+import queue
+import smtplib
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+from email.message import EmailMessage
+from threading import Event, Lock, Thread
+from typing import Optional
+from logger import archive_segments, ARCHIVE_STAMP_FORMAT
 
 
 class NotificationObserver(ABC):
@@ -13,8 +23,13 @@ class NotificationObserver(ABC):
 
 
 class NotificationSubject:
-    def __init__(self):
+    """
+    Fans a notification out to the registered observers: inline by default, or
+    through a NotificationDispatcher, in which case notify_all only enqueues.
+    """
+    def __init__(self, dispatcher: Optional["NotificationDispatcher"] = None):
         self._observers = []
+        self.dispatcher = dispatcher
 
     def register_observer(self, observer: "NotificationObserver"):
         self._observers.append(observer)
@@ -24,64 +39,551 @@ class NotificationSubject:
 
     def notify_all(self, message, recipient):
         for observer in self._observers:
-            observer.update(message, recipient)
+            if self.dispatcher:
+                self.dispatcher.submit(observer, message, recipient)
+            else:
+                observer.update(message, recipient)
+
+
+_dead_letter_lock = Lock()
+
+def write_dead_letter(path, observer_name, recipient, message, error, attempts):
+    """Appends one undeliverable notification to the dead-letter JSONL file at path."""
+    record = {
+        "observer": observer_name,
+        "to": recipient,
+        "message": message,
+        "error": repr(error),
+        "attempts": attempts,
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    with _dead_letter_lock:
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+def read_dead_letters(path):
+    """Dead-lettered notifications in path, oldest first."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class NotificationDispatcher:
+    """
+    Delivers notifications to observers on background worker threads, so the
+    request that triggered one only pays for a queue put. A failing delivery
+    is retried per observer with exponential backoff (a retrying delivery
+    holds its worker while it waits); after max_attempts it is appended to
+    the dead-letter file instead.
+    """
+    def __init__(self, workers=None, max_attempts=None, backoff_seconds=None,
+                 dead_letter_file="notifications_dead_letter.jsonl"):
+        self.workers = workers or int(os.getenv("NOTIFICATION_WORKERS", 2))
+        self.max_attempts = max_attempts or int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", 3))
+        self.backoff_seconds = backoff_seconds if backoff_seconds is not None else float(os.getenv("NOTIFICATION_RETRY_BACKOFF_SECONDS", 0.5))
+        self.dead_letter_file = dead_letter_file
+        # A full queue makes submit wait for the workers rather than drop notifications
+        self._queue = queue.Queue(maxsize=int(os.getenv("NOTIFICATION_QUEUE_SIZE", 10000)))
+        self._threads = []
+        self._threads_lock = Lock()
+
+    def _ensure_workers(self):
+        with self._threads_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for _ in range(self.workers - len(self._threads)):
+                thread = Thread(target=self._run_worker, name="notification-dispatch", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, observer, message, recipient):
+        """Queues message for one observer and returns immediately."""
+        self._ensure_workers()
+        self._queue.put((observer, message, recipient))
+
+    def _run_worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None: # shutdown() sentinel
+                    return
+                self._deliver(*job)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, observer, message, recipient):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                observer.update(message, recipient)
+                return
+            except Exception as e:
+                error = e
+                if attempt < self.max_attempts:
+                    time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+        print(f"[ERROR] {type(observer).__name__} failed to deliver to {recipient} after {self.max_attempts} attempts: {error}")
+        write_dead_letter(self.dead_letter_file, type(observer).__name__, recipient, message, error, self.max_attempts)
+
+    def get_dead_letters(self):
+        """Deliveries that exhausted their retries, oldest first."""
+        return read_dead_letters(self.dead_letter_file)
+
+    def flush(self):
+        """Blocks until every queued notification has been delivered or dead-lettered."""
+        self._queue.join()
+
+    def shutdown(self):
+        """Drains the queue and stops the workers; a later submit starts new ones."""
+        with self._threads_lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def _entry_id(entry):
+    return entry["id"]
+
+
+def _iter_records(path):
+    # Parsed lines of a store file or gzip archive, skipping torn ones
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path, "r")) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
 
 
 class InAppNotifier(NotificationObserver):
-    def __init__(self, subject: NotificationSubject, log_file="notifications.json"):
-        self.notifications = []
+    """
+    Keeps in-app notifications in an append-only JSON Lines file. Each
+    notification is one appended line, so storing one costs the same however
+    long the history is, and a crash can at worst leave a partial last line,
+    which is skipped on load. compact() rewrites the file without such lines
+    through a temporary file that atomically replaces it.
+    Memory holds only each recipient's newest per_recipient_limit
+    notifications, indexed oldest to newest, so a user's page and unread count
+    don't depend on how many other users have notifications. Compaction moves
+    notifications older than archive_days into gzip segments
+    (notifications.jsonl.<time>.gz). Pages older than memory are read through
+    from the file and the segments. Read state is stored as "read up to id"
+    marker lines.
+    """
+    def __init__(self, subject: NotificationSubject, log_file="notifications.jsonl", legacy_file="notifications.json"):
         self.log_file = log_file
+        self.legacy_file = legacy_file # The old single-array JSON file, imported once
+        self.compact_threshold = int(os.getenv("NOTIFICATIONS_COMPACT_THRESHOLD", 1000))
+        self.per_recipient_limit = int(os.getenv("NOTIFICATIONS_PER_RECIPIENT", 200))
+        self.archive_days = float(os.getenv("NOTIFICATIONS_ARCHIVE_DAYS", 90))
+        # recipient -> their newest notifications in id order
+        self._by_recipient = defaultdict(lambda: deque(maxlen=self.per_recipient_limit))
+        self._cold = set() # Recipients with notifications only on disk (evicted or archived)
+        self._read_upto = {} # recipient -> id of the newest notification they have seen
+        self._next_id = 1
+        self._oldest_live = None # Timestamp of the first notification in log_file
+        self._next_archive_check = 0
+        self._dead_lines = 0 # Lines in log_file that compaction would drop
+        self._lock = Lock()
         self._load_logs()
         subject.register_observer(self)   # auto-register
 
     def _load_logs(self):
-        if os.path.exists(self.log_file):
-            try:
-                with open(self.log_file, "r") as f:
-                    self.notifications = json.load(f)
-                print(f"[INFO] Loaded {len(self.notifications)} stored notifications.")
-            except json.JSONDecodeError:
-                print("[ERROR] Failed to parse notifications.json.")
+        if not os.path.exists(self.log_file) and self.legacy_file and os.path.exists(self.legacy_file):
+            self._import_legacy()
+        if not os.path.exists(self.log_file):
+            return
+        stored = 0
+        missing_ids = False
+        ends_with_newline = True
+        with open(self.log_file, "r") as f:
+            for line in f:
+                ends_with_newline = line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError: # Torn by a crash mid-append, or blank
+                    self._dead_lines += 1
+                    continue
+                if "read" in record:
+                    self._set_read(record["read"], record["upto"])
+                elif "meta" in record: # Written by compaction
+                    self._next_id = max(self._next_id, record["meta"]["next_id"])
+                    self._cold.update(record["meta"]["cold"])
+                else:
+                    missing_ids = missing_ids or "id" not in record
+                    self._add(record)
+                    stored += 1
+        print(f"[INFO] Loaded {stored} stored notifications.")
+        if self._dead_lines or missing_ids or not ends_with_newline or self._archive_due():
+            self.compact() # Appends must start on a clean line
+
+    def _import_legacy(self):
+        try:
+            with open(self.legacy_file, "r") as f:
+                entries = json.load(f)
+        except json.JSONDecodeError:
+            print(f"[ERROR] Failed to parse {self.legacy_file}.")
+            return
+        for notification_id, entry in enumerate(entries, start=1):
+            entry.setdefault("id", notification_id)
+        self._rewrite(entries)
+        print(f"[INFO] Imported {len(entries)} notifications from {self.legacy_file}.")
+
+    def _add(self, entry):
+        if "id" not in entry:
+            entry["id"] = self._next_id
+        self._next_id = max(self._next_id, entry["id"] + 1)
+        if self._oldest_live is None:
+            self._oldest_live = entry["timestamp"]
+        entries = self._by_recipient[entry["to"]]
+        if len(entries) == entries.maxlen:
+            self._cold.add(entry["to"]) # The oldest one is evicted
+        entries.append(entry)
+
+    def _set_read(self, recipient, upto):
+        if recipient in self._read_upto:
+            self._dead_lines += 1 # The marker it replaces
+        self._read_upto[recipient] = max(upto, self._read_upto.get(recipient, 0))
+
+    def _append(self, record):
+        with open(self.log_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
 
-    def _save_logs(self):
-        with open(self.log_file, "w") as f:
-            json.dump(self.notifications, f, indent=4)
+    def _rewrite(self, records):
+        temp_file = self.log_file + ".tmp"
+        with open(temp_file, "w") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.log_file) # Readers see the old file or the new one, never half
+
+    # --- Compaction and archival ---
+    def _archive_cutoff(self):
+        if not self.archive_days:
+            return None
+        return (datetime.now() - timedelta(days=self.archive_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def _archive_due(self):
+        cutoff = self._archive_cutoff()
+        return cutoff is not None and self._oldest_live is not None and self._oldest_live < cutoff
+
+    def compact(self):
+        """
+        Rewrites the store without dead lines, streaming it, and moves
+        notifications older than archive_days to a new gzip segment.
+        """
+        with self._lock:
+            cutoff = self._archive_cutoff()
+            archive_file = f"{self.log_file}.{datetime.now().strftime(ARCHIVE_STAMP_FORMAT)}.gz"
+            archive = None
+            oldest_live = None
+            archived = self._newest_archive_ids()
+            next_id = 1 # Numbers id-less records the way loading did, so the ids are kept
+            temp_file = self.log_file + ".tmp"
+            with open(temp_file, "w") as live:
+                for record in _iter_records(self.log_file):
+                    if "to" not in record:
+                        continue # Markers; the current ones are written below
+                    record.setdefault("id", next_id)
+                    next_id = max(next_id, record["id"] + 1)
+                    if record["id"] in archived:
+                        continue # Left behind by a compaction that crashed after archiving
+                    if cutoff and record["timestamp"] < cutoff:
+                        if archive is None:
+                            archive = gzip.open(archive_file + ".tmp", "wt")
+                        archive.write(json.dumps(record) + "\n")
+                        self._cold.add(record["to"])
+                        continue
+                    oldest_live = oldest_live or record["timestamp"]
+                    live.write(json.dumps(record) + "\n")
+                for recipient, upto in self._read_upto.items():
+                    live.write(json.dumps({"read": recipient, "upto": upto}) + "\n")
+                live.write(json.dumps({"meta": {"next_id": self._next_id, "cold": sorted(self._cold)}}) + "\n")
+                live.flush()
+                os.fsync(live.fileno())
+            if archive is not None:
+                archive.close()
+                os.replace(archive_file + ".tmp", archive_file) # Archive first: a crash can't lose entries
+                print(f"[INFO] Archived notifications older than {cutoff} to {archive_file}")
+            os.replace(temp_file, self.log_file)
+            self._oldest_live = oldest_live
+            self._dead_lines = 0
+
+    def _newest_archive_ids(self):
+        # A crash between the two os.replace calls in compact() can only duplicate the newest segment
+        segments = archive_segments(self.log_file)
+        if not segments:
+            return set()
+        return {record["id"] for record in _iter_records(segments[-1][1]) if "id" in record}
+
+    def _compact_if_due(self):
+        # The notification is already stored, so a failure here must not reach the caller:
+        # NotificationDispatcher would retry the update and store it twice
+        try:
+            if self._dead_lines >= self.compact_threshold:
+                self.compact()
+            elif time.time() >= self._next_archive_check:
+                self._next_archive_check = time.time() + 3600 # Archival works in coarse steps
+                if self._archive_due():
+                    self.compact()
+        except Exception as e:
+            print(f"[ERROR] Failed to compact {self.log_file}: {e}")
 
     def update(self, message, recipient):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        entry = {
-            "to": recipient,
-            "message": message,
-            "timestamp": timestamp
-        }
-        self.notifications.append(entry)
-        self._save_logs()
+        with self._lock:
+            entry = {
+                "id": self._next_id,
+                "to": recipient,
+                "message": message,
+                "timestamp": timestamp
+            }
+            self._append(entry)
+            self._add(entry)
+        self._compact_if_due()
         print(f"[In-App] ({recipient}) {message}")
 
+    # --- Per-recipient reads ---
+    @property
+    def notifications(self):
+        """The notifications held in memory (each recipient's newest), oldest first."""
+        with self._lock:
+            return sorted((entry for entries in self._by_recipient.values() for entry in entries), key=_entry_id)
+
+    def _read_cold(self, recipient, before, limit):
+        # recipient's notifications with id < before, newest first: the store file, then archives newest first
+        paths = [self.log_file] + [path for _, path in reversed(archive_segments(self.log_file))]
+        found = []
+        seen = set() # A crashed compaction can leave records in both the store and an archive
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            matches = deque(maxlen=limit - len(found)) # Keeps the newest matches in this segment
+            for record in _iter_records(path):
+                if "id" not in record:
+                    continue
+                if before is not None and record["id"] >= before:
+                    break # Ids ascend within a segment, so the rest are newer still
+                if record["to"] == recipient and record["id"] not in seen:
+                    matches.append(record)
+            found.extend(reversed(matches))
+            seen.update(record["id"] for record in matches)
+            if len(found) >= limit:
+                break
+        return found
+
+    def get_notifications(self, recipient, cursor=None, limit=20):
+        """
+        A page of recipient's notifications, newest first, and the cursor for
+        the next (older) page, or None on the last page. Pages beyond what is
+        held in memory are read from disk.
+        """
+        with self._lock:
+            entries = self._by_recipient.get(recipient, ())
+            end = len(entries) if cursor is None else bisect_left(entries, cursor, key=_entry_id)
+            start = max(end - limit, 0)
+            page = [entries[i] for i in range(end - 1, start - 1, -1)]
+            has_older = start > 0
+            oldest_in_memory = entries[0]["id"] if entries else None
+            cold = recipient in self._cold
+        if not has_older and cold:
+            bounds = [i for i in (cursor, oldest_in_memory) if i is not None]
+            wanted = limit - len(page)
+            older = self._read_cold(recipient, min(bounds) if bounds else None, wanted + 1)
+            has_older = len(older) > wanted
+            page += older[:wanted]
+        return page, (page[-1]["id"] if has_older and page else None)
+
+    def unread_count(self, recipient):
+        """Unread notifications among those held in memory (so at most per_recipient_limit)."""
+        with self._lock:
+            entries = self._by_recipient.get(recipient, ())
+            return len(entries) - bisect_right(entries, self._read_upto.get(recipient, 0), key=_entry_id)
+
+    def mark_read(self, recipient, upto=None):
+        """Marks recipient's notifications up to id upto (default: all of them) as read."""
+        with self._lock:
+            entries = self._by_recipient.get(recipient)
+            if upto is None:
+                upto = entries[-1]["id"] if entries else 0
+            if upto <= self._read_upto.get(recipient, 0):
+                return
+            self._append({"read": recipient, "upto": upto})
+            self._set_read(recipient, upto)
+        self._compact_if_due()
+
     # Added method for compatibility with TaskManager and PayrollManager
     def send_notification(self, message, recipient):
         self.update(message, recipient)
 
 
+class EmailTransport(ABC):
+    """
+    Sends a batch of email.message.EmailMessage objects and returns
+    [(message, error)] for the ones that were not accepted.
+    """
+    @abstractmethod
+    def send(self, messages):
+        pass
+
+
+class ConsoleEmailTransport(EmailTransport):
+    """Prints messages instead of sending them (the default, for development)."""
+    def send(self, messages):
+        for email in messages:
+            print(f"--- [Email Service] Sending email to {email['To']} ---")
+            print(f"Subject: {email['Subject']}")
+            print(f"Body: {email.get_content().rstrip()}")
+            print("--------------------------------------------------")
+        return []
+
+
+class SMTPEmailTransport(EmailTransport):
+    """Sends each batch over a single SMTP connection."""
+    def __init__(self, host, port=25, username=None, password=None, starttls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("EMAIL_SMTP_HOST", "localhost"),
+            int(os.getenv("EMAIL_SMTP_PORT", 25)),
+            username=os.getenv("EMAIL_SMTP_USERNAME"),
+            password=os.getenv("EMAIL_SMTP_PASSWORD"),
+            starttls=os.getenv("EMAIL_SMTP_STARTTLS", "0") == "1"
+        )
+
+    def send(self, messages):
+        failed = []
+        sent = 0 # Messages the server has accepted or refused
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+                if self.starttls:
+                    smtp.starttls()
+                if self.username:
+                    smtp.login(self.username, self.password)
+                for email in messages:
+                    try:
+                        smtp.send_message(email)
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                        failed.append((email, e)) # Refused; the connection is still usable
+                    sent += 1
+        except (smtplib.SMTPException, OSError) as e:
+            # Lost the connection (or never had it): nothing after `sent` went out
+            failed.extend((email, e) for email in messages[sent:])
+        return failed
+
+
 class EmailNotifier(NotificationObserver):
-    def __init__(self, subject: NotificationSubject):
+    """
+    Emails notifications through a pluggable EmailTransport. By default every
+    notification is one message. With a digest window, notifications are held
+    per recipient instead. Every window, one digest per recipient goes out,
+    all in a single transport call, so a payroll run for N employees is one
+    batch of N digests rather than N separate sends.
+    """
+    def __init__(self, subject: NotificationSubject, transport: Optional[EmailTransport] = None,
+                 digest_window=None, sender=None, domain=None, max_attempts=None,
+                 dead_letter_file="notifications_dead_letter.jsonl"):
+        self.transport = transport or ConsoleEmailTransport()
+        self.digest_window = digest_window if digest_window is not None else float(os.getenv("EMAIL_DIGEST_WINDOW_SECONDS", 0))
+        self.sender = sender or os.getenv("EMAIL_FROM", "noreply@company.local")
+        self.domain = domain or os.getenv("EMAIL_DOMAIN", "company.local") # Recipients are usernames
+        # A digest that fails max_attempts windows in a row is dead-lettered instead of retried
+        self.max_attempts = max_attempts or int(os.getenv("EMAIL_MAX_ATTEMPTS", 3))
+        self.dead_letter_file = dead_letter_file
+        self._pending = defaultdict(list) # recipient -> [(timestamp, message, failed attempts)]
+        self._lock = Lock()
+        self._stop = Event()
+        self._flusher = None
         subject.register_observer(self)
 
+    def _build_email(self, recipient, subject_line, body):
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = recipient if "@" in recipient else f"{recipient}@{self.domain}"
+        email["Subject"] = subject_line
+        email.set_content(body)
+        return email
+
+    def _build_digest(self, recipient, items):
+        if len(items) == 1:
+            return self._build_email(recipient, "System Notification", items[0][1])
+        body = "\n".join(f"{timestamp} - {message}" for timestamp, message, _ in items)
+        return self._build_email(recipient, f"{len(items)} new notifications", body)
+
     def _send_email(self, recipient, message):
-        """Simulates sending an email via an external service."""
-        print(f"--- [Email Service] Sending email to {recipient} ---")
-        print(f"Subject: System Notification")
-        print(f"Body: {message}")
-        print("--------------------------------------------------")
+        failed = self.transport.send([self._build_email(recipient, "System Notification", message)])
+        if failed:
+            raise failed[0][1] # Lets a NotificationDispatcher retry it
 
     def update(self, message, recipient):
-        # We will assume this calls a real email API
-        self._send_email(recipient, message)
+        if not self.digest_window:
+            self._send_email(recipient, message)
+            return
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._pending[recipient].append((timestamp, message, 0))
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stop.clear()
+                self._flusher = Thread(target=self._run_flusher, name="email-digest", daemon=True)
+                self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._stop.wait(self.digest_window):
+            self.flush()
+
+    def flush(self):
+        """
+        Sends a digest for each recipient with pending notifications, in one
+        transport call. Returns how many were sent. Only failed digests are
+        kept for the next window, and a notification whose digest has failed
+        max_attempts times goes to the dead-letter file.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(list)
+        if not pending:
+            return 0
+        recipients = list(pending)
+        messages = [self._build_digest(recipient, pending[recipient]) for recipient in recipients]
+        recipient_of = {id(email): recipient for email, recipient in zip(messages, recipients)}
+        try:
+            failed = self.transport.send(messages)
+        except Exception as e: # A transport that doesn't report per message
+            failed = [(email, e) for email in messages]
+        retry = defaultdict(list)
+        for email, error in failed:
+            recipient = recipient_of[id(email)]
+            for timestamp, message, attempts in pending[recipient]:
+                if attempts + 1 >= self.max_attempts:
+                    write_dead_letter(self.dead_letter_file, type(self).__name__, recipient, message, error, attempts + 1)
+                else:
+                    retry[recipient].append((timestamp, message, attempts + 1))
+            print(f"[ERROR] Could not send the email digest to {recipient}: {error}")
+        if retry:
+            # Ahead of anything queued meanwhile
+            with self._lock:
+                for recipient, items in retry.items():
+                    self._pending[recipient][:0] = items
+        return len(messages) - len(failed)
+
+    def close(self):
+        """Stops the digest timer and sends whatever is pending."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
 
 
 class NotificationManager:
-    def __init__(self):
-        self.subject = NotificationSubject()
+    def __init__(self, dispatcher: Optional[NotificationDispatcher] = None):
+        self.subject = NotificationSubject(dispatcher)
 
     def send_notification(self, event_message, recipient):
         self.subject.notify_all(event_message, recipient)
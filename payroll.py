@@ -5,7 +5,9 @@ from datetime import datetime
 import json
 import os
 import uuid
-from database import SessionLocal, Payslip
+from sqlalchemy import select
+from database import SessionLocal, Payslip, scope_to_department, run_query
+from async_database import run_query_async
 from typing import Any, Tuple, List # Import Tuple and Any for type hints
 
 # Strategy Pattern
@@ -35,6 +37,23 @@ class ConcreteStrategyB(Strategy):  # Commission Salary Strategy
         return round(base_salary + (sales * self.commission_rate), 2)
 
 
+def _payslip_dicts(result):
+    return [
+        {
+            "slip_id": s.id,
+            "employee_id": s.employee_id,
+            "base_salary": s.base_salary,
+            "hours_worked": s.hours_worked,
+            "overtime_hours": s.overtime_hours,
+            "salary": s.salary,
+            "month": s.month,
+            "year": s.year,
+            "strategy": s.strategy,
+            "generated_at": s.generated_at.strftime("%Y-%m-%d %H:%M:%S")
+        } for s in result.scalars()
+    ]
+
+
 # Context
 class PayrollManager:
     def __init__(self, strategy=None, notifier=None):
@@ -90,47 +109,29 @@ class PayrollManager:
         finally:
             db.close()
 
+    # --- Read queries ---
+    # Each builder returns (statement, shape), run by the plain method on a sync
+    # session and by its *_async variant, awaited by the routes, on an async one.
+    def _payslips_by_employee_query(self, employee_id):
+        return select(Payslip).where(Payslip.employee_id == employee_id), _payslip_dicts
+
+    def _all_payslips_query(self):
+        return select(Payslip), _payslip_dicts
+
+    def _department_payslips_query(self, root_department_id):
+        return scope_to_department(select(Payslip), Payslip.employee_id, root_department_id), _payslip_dicts
+
     def get_payslips_by_employee(self, employee_id):
-        db = SessionLocal()
-        try:
-            slips = db.query(Payslip).filter(Payslip.employee_id == employee_id).all()
-            return [
-                {
-                    "slip_id": s.id,
-                    "employee_id": s.employee_id,
-                    "base_salary": s.base_salary,
-                    "hours_worked": s.hours_worked,
-                    "overtime_hours": s.overtime_hours,
-                    "salary": s.salary,
-                    "month": s.month,
-                    "year": s.year,
-                    "strategy": s.strategy,
-                    "generated_at": s.generated_at.strftime("%Y-%m-%d %H:%M:%S")
-                } for s in slips
-            ]
-        finally:
-            db.close()
+        return run_query(*self._payslips_by_employee_query(employee_id))
+
+    async def get_payslips_by_employee_async(self, employee_id):
+        return await run_query_async(*self._payslips_by_employee_query(employee_id))
 
     def get_all_payslips(self):
-        db = SessionLocal()
-        try:
-            slips = db.query(Payslip).all()
-            return [
-                {
-                    "slip_id": s.id,
-                    "employee_id": s.employee_id,
-                    "base_salary": s.base_salary,
-                    "hours_worked": s.hours_worked,
-                    "overtime_hours": s.overtime_hours,
-                    "salary": s.salary,
-                    "month": s.month,
-                    "year": s.year,
-                    "strategy": s.strategy,
-                    "generated_at": s.generated_at.strftime("%Y-%m-%d %H:%M:%S")
-                } for s in slips
-            ]
-        finally:
-            db.close()
+        return run_query(*self._all_payslips_query())
+
+    async def get_all_payslips_async(self):
+        return await run_query_async(*self._all_payslips_query())
     
     def get_payslip_by_id(self, payslip_id):
         db = SessionLocal()
@@ -172,4 +173,11 @@ class PayrollManager:
                 } for s in slips
             ]
         finally:
-            db.close()
\ No newline at end of file
+            db.close()
+
+    def get_payslips_for_department(self, root_department_id):
+        """Payslips for every employee in a department and its sub-departments."""
+        return run_query(*self._department_payslips_query(root_department_id))
+
+    async def get_payslips_for_department_async(self, root_department_id):
+        return await run_query_async(*self._department_payslips_query(root_department_id))
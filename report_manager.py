@@ -1,58 +1,60 @@
 # report_manager.py
 
 from collections import defaultdict
-from datetime import datetime
-from database import SessionLocal, Task, Attendance, Payslip
+from sqlalchemy import func, select
+from database import SessionLocal, Task, Attendance, Payslip, User, scope_to_department, run_query
+from async_database import run_query_async
+from attendance import hours_from_seconds
 from typing import List
+
+# Result shapes shared by the sync and async report methods
+def _task_report(result):
+    report = defaultdict(list)
+    for task in result:
+        report[task.assigned_to].append({
+            "title": task.title,
+            "status": task.status,
+            "deadline": task.deadline
+        })
+    return dict(report)
+
+def _hours_report(result):
+    return {employee_id: hours_from_seconds(total) for employee_id, total in result}
+
+def _pay_report(result):
+    return {employee_id: float(total) for employee_id, total in result}
+
 class ReportManager:
     def __init__(self):
         pass # The constructor no longer needs to specify file paths.
 
     def get_task_report_by_employee(self):
-        db = SessionLocal()
-        try:
-            tasks = db.query(Task).all()
-            report = defaultdict(list)
-            for task in tasks:
-                report[task.assigned_to].append({
-                    "title": task.title,
-                    "status": task.status,
-                    "deadline": task.deadline
-                })
-            return dict(report)
-        finally:
-            db.close()
+        return run_query(*self._task_report_query())
+
+    async def get_task_report_by_employee_async(self):
+        return await run_query_async(*self._task_report_query())
 
     def get_task_status_summary(self):
         db = SessionLocal()
         try:
-            tasks = db.query(Task).all()
-            summary = defaultdict(int)
-            for task in tasks:
-                summary[task.status] += 1
-            return dict(summary)
+            # Count per status in SQL rather than loading every task
+            rows = db.query(Task.status, func.count(Task.id)).group_by(Task.status).all()
+            return {status: count for status, count in rows}
         finally:
             db.close()
 
     def get_total_hours_by_employee(self):
-        db = SessionLocal()
-        try:
-            entries = db.query(Attendance).all()
-            totals = defaultdict(float)
-            for e in entries:
-                if e.check_in and e.check_out:
-                    in_time = datetime.strptime(e.check_in, "%H:%M:%S")
-                    out_time = datetime.strptime(e.check_out, "%H:%M:%S")
-                    worked = round((out_time - in_time).total_seconds() / 3600, 2)
-                    totals[e.employee_id] += worked
-            return dict(totals)
-        finally:
-            db.close()
+        return run_query(*self._hours_report_query())
+
+    async def get_total_hours_by_employee_async(self):
+        return await run_query_async(*self._hours_report_query())
 
     def get_attendance_by_date(self, target_date):
         db = SessionLocal()
         try:
-            entries = db.query(Attendance).filter(Attendance.date == target_date).all()
+            entries = db.query(Attendance.employee_id, Attendance.check_in, Attendance.check_out).filter(
+                Attendance.date == target_date
+            ).all()
             return [
                 {
                     "employee_id": e.employee_id,
@@ -66,7 +68,7 @@ class ReportManager:
     def get_payslips_by_employee(self):
         db = SessionLocal()
         try:
-            slips = db.query(Payslip).all()
+            slips = db.query(Payslip.employee_id, Payslip.month, Payslip.year, Payslip.salary, Payslip.strategy).all()
             report = defaultdict(list)
             for slip in slips:
                 report[slip.employee_id].append({
@@ -80,75 +82,66 @@ class ReportManager:
             db.close()
 
     def get_total_pay_by_employee(self):
-        db = SessionLocal()
-        try:
-            slips = db.query(Payslip).all()
-            totals = defaultdict(float)
-            for slip in slips:
-                totals[slip.employee_id] += slip.salary
-            return dict(totals)
-        finally:
-            db.close()
-    
-    def get_task_report_by_department_ids(self, department_ids: List[int]):
-        db = SessionLocal()
-        try:
-            # Get usernames associated with these department IDs
-            from database import User # Import User model here to avoid circular dependency
-            users_in_depts = db.query(User).filter(User.department_id.in_(department_ids)).all()
-            usernames = [u.username for u in users_in_depts]
+        return run_query(*self._pay_report_query())
 
-            if not usernames:
-                return {} # No users in these departments
+    async def get_total_pay_by_employee_async(self):
+        return await run_query_async(*self._pay_report_query())
 
-            tasks = db.query(Task).filter(Task.assigned_to.in_(usernames)).all()
-            report = defaultdict(list)
-            for task in tasks:
-                report[task.assigned_to].append({
-                    "title": task.title,
-                    "status": task.status,
-                    "deadline": task.deadline
-                })
-            return dict(report)
-        finally:
-            db.close()
+    # --- Report queries ---
+    # Each builder returns (statement, shape); an optional scope narrows the rows,
+    # e.g. to a department. Totals are grouped in SQL.
+    def _task_report_query(self, scope=lambda statement: statement):
+        statement = select(Task.assigned_to, Task.title, Task.status, Task.deadline)
+        return scope(statement), _task_report
+
+    def _hours_report_query(self, scope=lambda statement: statement):
+        # SUM(worked_seconds) per employee; open entries don't count
+        statement = scope(select(Attendance.employee_id, func.sum(Attendance.worked_seconds)))
+        statement = statement.where(Attendance.worked_seconds.is_not(None)).group_by(Attendance.employee_id)
+        return statement, _hours_report
+
+    def _pay_report_query(self, scope=lambda statement: statement):
+        statement = scope(select(Payslip.employee_id, func.sum(Payslip.salary)))
+        return statement.group_by(Payslip.employee_id), _pay_report
+
+    # --- Department-scoped reports ---
+    # Each runs as one statement joining the report table to users on username,
+    # so large departments don't turn into huge IN (...) lists of usernames.
+    @staticmethod
+    def _in_departments(username_column, department_ids):
+        return lambda statement: statement.join(User, User.username == username_column).where(
+            User.department_id.in_(department_ids)
+        )
+
+    def get_task_report_by_department_ids(self, department_ids: List[int]):
+        return run_query(*self._task_report_query(self._in_departments(Task.assigned_to, department_ids)))
 
     def get_total_hours_by_department_ids(self, department_ids: List[int]):
-        db = SessionLocal()
-        try:
-            from database import User # Import User model here
-            users_in_depts = db.query(User).filter(User.department_id.in_(department_ids)).all()
-            usernames = [u.username for u in users_in_depts]
-
-            if not usernames:
-                return {}
-
-            entries = db.query(Attendance).filter(Attendance.employee_id.in_(usernames)).all()
-            totals = defaultdict(float)
-            for e in entries:
-                if e.check_in and e.check_out:
-                    in_time = datetime.strptime(e.check_in, "%H:%M:%S")
-                    out_time = datetime.strptime(e.check_out, "%H:%M:%S")
-                    worked = round((out_time - in_time).total_seconds() / 3600, 2)
-                    totals[e.employee_id] += worked
-            return dict(totals)
-        finally:
-            db.close()
+        return run_query(*self._hours_report_query(self._in_departments(Attendance.employee_id, department_ids)))
 
     def get_total_pay_by_department_ids(self, department_ids: List[int]):
-        db = SessionLocal()
-        try:
-            from database import User # Import User model here
-            users_in_depts = db.query(User).filter(User.department_id.in_(department_ids)).all()
-            usernames = [u.username for u in users_in_depts]
+        return run_query(*self._pay_report_query(self._in_departments(Payslip.employee_id, department_ids)))
 
-            if not usernames:
-                return {}
+    # Variants scoped by a root department: the hierarchy is resolved through the
+    # department_closure table inside the same statement.
+    @staticmethod
+    def _under_department(username_column, root_department_id):
+        return lambda statement: scope_to_department(statement, username_column, root_department_id)
 
-            slips = db.query(Payslip).filter(Payslip.employee_id.in_(usernames)).all()
-            totals = defaultdict(float)
-            for slip in slips:
-                totals[slip.employee_id] += slip.salary
-            return dict(totals)
-        finally:
-            db.close()
\ No newline at end of file
+    def get_task_report_for_department(self, root_department_id: int):
+        return run_query(*self._task_report_query(self._under_department(Task.assigned_to, root_department_id)))
+
+    async def get_task_report_for_department_async(self, root_department_id: int):
+        return await run_query_async(*self._task_report_query(self._under_department(Task.assigned_to, root_department_id)))
+
+    def get_total_hours_for_department(self, root_department_id: int):
+        return run_query(*self._hours_report_query(self._under_department(Attendance.employee_id, root_department_id)))
+
+    async def get_total_hours_for_department_async(self, root_department_id: int):
+        return await run_query_async(*self._hours_report_query(self._under_department(Attendance.employee_id, root_department_id)))
+
+    def get_total_pay_for_department(self, root_department_id: int):
+        return run_query(*self._pay_report_query(self._under_department(Payslip.employee_id, root_department_id)))
+
+    async def get_total_pay_for_department_async(self, root_department_id: int):
+        return await run_query_async(*self._pay_report_query(self._under_department(Payslip.employee_id, root_department_id)))
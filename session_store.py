@@ -0,0 +1,497 @@
+# session_store.py
+
+import heapq
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from threading import Lock, Event, Thread
+from typing import Optional, List, Tuple
+
+from database import SessionLocal, UserSession
+
+DEFAULT_SESSION_TTL_SECONDS = 12 * 60 * 60
+DEFAULT_SESSION_IDLE_TTL_SECONDS = 60 * 60
+
+# (principal, absolute_expires_at, expires_at) where expires_at is the effective
+# deadline: the earlier of the absolute expiry and the idle expiry.
+SessionEntry = Tuple[dict, float, float]
+
+
+class SessionStore(ABC):
+    """
+    Abstract session store used by AuthManager.
+    Maps a session token to a principal dict. A session ends when it has been
+    unused for idle_ttl_seconds or, at the latest, ttl_seconds after login.
+
+    Shared backends keep a small, bounded local read-through cache so that
+    validate_token does not become a remote lookup on every request. Entries in
+    that cache live for at most cache_ttl_seconds, which bounds how long another
+    worker's logout or role change can go unnoticed here.
+    """
+    def __init__(self, ttl_seconds=DEFAULT_SESSION_TTL_SECONDS, idle_ttl_seconds=DEFAULT_SESSION_IDLE_TTL_SECONDS,
+                 cache_size=1024, cache_ttl_seconds=5.0, touch_interval_seconds=None):
+        self.ttl_seconds = ttl_seconds
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.cache_size = cache_size
+        self.cache_ttl_seconds = cache_ttl_seconds
+        # Sliding the idle deadline is a write on shared backends, so only do it
+        # once the deadline would move by at least this much.
+        if touch_interval_seconds is None:
+            touch_interval_seconds = idle_ttl_seconds / 10 if idle_ttl_seconds else 0
+        self.touch_interval_seconds = touch_interval_seconds
+        self._cache = OrderedDict() # token -> (entry, cached_until)
+        self._cache_lock = Lock()
+        self._stats_lock = Lock()
+        self._expired_count = 0
+        self._reaped_count = 0
+        self._reaper_thread = None
+        self._reaper_stop = Event()
+
+    # --- Backend hooks ---
+    @abstractmethod
+    def _load(self, token) -> Optional[SessionEntry]:
+        """Returns the stored entry for token, or None if it does not exist."""
+        pass
+
+    @abstractmethod
+    def _save(self, token, principal, absolute_expires_at, expires_at):
+        pass
+
+    @abstractmethod
+    def _update(self, token, principal):
+        """Replaces the principal of an existing session, keeping its expiry."""
+        pass
+
+    @abstractmethod
+    def _touch(self, token, principal, expires_at):
+        """Moves the effective deadline of an existing session."""
+        pass
+
+    @abstractmethod
+    def _delete(self, token) -> bool:
+        pass
+
+    @abstractmethod
+    def _tokens_for_user(self, username) -> List[str]:
+        pass
+
+    @abstractmethod
+    def _reap(self, now, max_items=None) -> int:
+        """Removes sessions whose deadline is <= now, oldest first. Returns how many were removed."""
+        pass
+
+    @abstractmethod
+    def _count_live(self) -> int:
+        pass
+
+    # --- Local read-through cache ---
+    def _cache_get(self, token) -> Optional[SessionEntry]:
+        if not self.cache_size:
+            return None
+        with self._cache_lock:
+            cached = self._cache.get(token)
+            if cached is None:
+                return None
+            entry, cached_until = cached
+            if cached_until <= time.time():
+                del self._cache[token]
+                return None
+            self._cache.move_to_end(token)
+            return entry
+
+    def _cache_put(self, token, entry):
+        if not self.cache_size:
+            return
+        with self._cache_lock:
+            self._cache[token] = (entry, time.time() + self.cache_ttl_seconds)
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_pop(self, token):
+        with self._cache_lock:
+            self._cache.pop(token, None)
+
+    def _count_expired(self, count=1):
+        with self._stats_lock:
+            self._expired_count += count
+
+    # --- Public API ---
+    def get(self, token) -> Optional[dict]:
+        """Returns the session's principal and slides its idle deadline, or None if unknown/expired."""
+        entry = self._cache_get(token)
+        if entry is None:
+            entry = self._load(token)
+            if entry is None:
+                return None
+        principal, absolute_expires_at, expires_at = entry
+        now = time.time()
+        if expires_at <= now:
+            self._cache_pop(token)
+            if self._delete(token):
+                self._count_expired()
+            return None
+        if self.idle_ttl_seconds:
+            new_expires_at = min(absolute_expires_at, now + self.idle_ttl_seconds)
+            if new_expires_at - expires_at > self.touch_interval_seconds:
+                self._touch(token, principal, new_expires_at)
+                expires_at = new_expires_at
+        self._cache_put(token, (principal, absolute_expires_at, expires_at))
+        return principal
+
+    def put(self, token, principal):
+        now = time.time()
+        absolute_expires_at = now + self.ttl_seconds
+        expires_at = min(absolute_expires_at, now + self.idle_ttl_seconds) if self.idle_ttl_seconds else absolute_expires_at
+        self._save(token, principal, absolute_expires_at, expires_at)
+        self._cache_put(token, (principal, absolute_expires_at, expires_at))
+        # Logins pay for a small slice of reaping so that the store stays bounded
+        # even when no background reaper is running.
+        self.reap(max_items=16)
+
+    def update(self, token, principal):
+        """Replaces the principal of an existing session without extending its expiry."""
+        self._cache_pop(token)
+        self._update(token, principal)
+
+    def delete(self, token) -> bool:
+        self._cache_pop(token)
+        return self._delete(token)
+
+    def tokens_for_user(self, username) -> List[str]:
+        return self._tokens_for_user(username)
+
+    def reap(self, max_items=None) -> int:
+        """Removes expired sessions in deadline order; cost is proportional to the number removed."""
+        reaped = self._reap(time.time(), max_items)
+        if reaped:
+            with self._stats_lock:
+                self._expired_count += reaped
+                self._reaped_count += reaped
+        return reaped
+
+    def stats(self) -> dict:
+        """Counters for monitoring: sessions currently stored, sessions that timed out, and how many the reaper removed."""
+        with self._stats_lock:
+            return {
+                "live": self._count_live(),
+                "expired": self._expired_count,
+                "reaped": self._reaped_count
+            }
+
+    def start_reaper(self, interval_seconds=60.0):
+        """Starts a daemon thread that reaps expired sessions every interval_seconds."""
+        if self._reaper_thread and self._reaper_thread.is_alive():
+            return
+        self._reaper_stop.clear()
+
+        def run():
+            while not self._reaper_stop.wait(interval_seconds):
+                try:
+                    self.reap()
+                except Exception as e:
+                    print(f"[ERROR] Session reaper failed: {e}")
+
+        self._reaper_thread = Thread(target=run, name="session-reaper", daemon=True)
+        self._reaper_thread.start()
+
+    def stop_reaper(self):
+        self._reaper_stop.set()
+        if self._reaper_thread:
+            self._reaper_thread.join()
+            self._reaper_thread = None
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local store. Only suitable for a single worker.
+    Deadlines are kept in a min-heap with one entry per session. Sliding a
+    session's idle deadline does not touch the heap; when the reaper pops a
+    stale entry for a session that is still alive it simply pushes it back
+    with the current deadline.
+    """
+    def __init__(self, ttl_seconds=DEFAULT_SESSION_TTL_SECONDS, idle_ttl_seconds=DEFAULT_SESSION_IDLE_TTL_SECONDS):
+        # The data already lives in this process, so no read-through cache is needed
+        super().__init__(ttl_seconds=ttl_seconds, idle_ttl_seconds=idle_ttl_seconds,
+                         cache_size=0, touch_interval_seconds=0)
+        self._sessions = {} # token -> [principal, absolute_expires_at, expires_at]
+        self._tokens_by_user = defaultdict(set)
+        self._deadlines = [] # heap of (expires_at, token)
+        self._lock = Lock()
+
+    def _load(self, token):
+        entry = self._sessions.get(token)
+        return tuple(entry) if entry is not None else None
+
+    def _save(self, token, principal, absolute_expires_at, expires_at):
+        with self._lock:
+            self._sessions[token] = [principal, absolute_expires_at, expires_at]
+            self._tokens_by_user[principal["username"]].add(token)
+            heapq.heappush(self._deadlines, (expires_at, token))
+
+    def _update(self, token, principal):
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is not None:
+                entry[0] = principal
+
+    def _touch(self, token, principal, expires_at):
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is not None:
+                entry[2] = expires_at
+
+    def _remove_locked(self, token):
+        entry = self._sessions.pop(token, None)
+        if entry is None:
+            return False
+        username = entry[0]["username"]
+        tokens = self._tokens_by_user.get(username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[username]
+        return True
+
+    def _delete(self, token):
+        # The token's heap entry is left behind and discarded when it is popped
+        with self._lock:
+            return self._remove_locked(token)
+
+    def _tokens_for_user(self, username):
+        with self._lock:
+            return list(self._tokens_by_user.get(username, ()))
+
+    def _reap(self, now, max_items=None):
+        reaped = 0
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                if max_items is not None and reaped >= max_items:
+                    break
+                _, token = heapq.heappop(self._deadlines)
+                entry = self._sessions.get(token)
+                if entry is None:
+                    continue # Logged out or already expired on access
+                if entry[2] > now:
+                    heapq.heappush(self._deadlines, (entry[2], token)) # Deadline slid since it was pushed
+                    continue
+                self._remove_locked(token)
+                reaped += 1
+            # Logouts leave dead heap entries behind; rebuild once they dominate
+            if len(self._deadlines) > 2 * len(self._sessions) + 64:
+                self._deadlines = [(entry[2], t) for t, entry in self._sessions.items()]
+                heapq.heapify(self._deadlines)
+        return reaped
+
+    def _count_live(self):
+        return len(self._sessions)
+
+
+class DatabaseSessionStore(SessionStore):
+    """
+    Stores sessions in the user_sessions table of the application database,
+    so every worker sharing company.db sees the same tokens.
+    Reaping is a range delete on the indexed expires_at column.
+    """
+    def _load(self, token):
+        db = SessionLocal()
+        try:
+            row = db.query(UserSession).filter(UserSession.token == token).first()
+            if not row:
+                return None
+            return json.loads(row.principal), row.absolute_expires_at, row.expires_at
+        finally:
+            db.close()
+
+    def _save(self, token, principal, absolute_expires_at, expires_at):
+        db = SessionLocal()
+        try:
+            row = db.query(UserSession).filter(UserSession.token == token).first()
+            if row is None:
+                row = UserSession(token=token)
+                db.add(row)
+            row.username = principal["username"]
+            row.principal = json.dumps(principal)
+            row.absolute_expires_at = absolute_expires_at
+            row.expires_at = expires_at
+            db.commit()
+        finally:
+            db.close()
+
+    def _update(self, token, principal):
+        db = SessionLocal()
+        try:
+            row = db.query(UserSession).filter(UserSession.token == token).first()
+            if row is not None:
+                row.principal = json.dumps(principal)
+                db.commit()
+        finally:
+            db.close()
+
+    def _touch(self, token, principal, expires_at):
+        db = SessionLocal()
+        try:
+            db.query(UserSession).filter(UserSession.token == token).update(
+                {UserSession.expires_at: expires_at}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _delete(self, token):
+        db = SessionLocal()
+        try:
+            deleted = db.query(UserSession).filter(UserSession.token == token).delete(synchronize_session=False)
+            db.commit()
+            return deleted > 0
+        finally:
+            db.close()
+
+    def _tokens_for_user(self, username):
+        db = SessionLocal()
+        try:
+            rows = db.query(UserSession.token).filter(
+                UserSession.username == username,
+                UserSession.expires_at > time.time()
+            ).all()
+            return [r.token for r in rows]
+        finally:
+            db.close()
+
+    def _reap(self, now, max_items=None):
+        db = SessionLocal()
+        try:
+            expired = db.query(UserSession.token).filter(UserSession.expires_at <= now).order_by(UserSession.expires_at)
+            if max_items is not None:
+                expired = expired.limit(max_items)
+            tokens = [r.token for r in expired.all()]
+            if not tokens:
+                return 0
+            db.query(UserSession).filter(UserSession.token.in_(tokens)).delete(synchronize_session=False)
+            db.commit()
+            return len(tokens)
+        finally:
+            db.close()
+
+    def _count_live(self):
+        db = SessionLocal()
+        try:
+            return db.query(UserSession).filter(UserSession.expires_at > time.time()).count()
+        finally:
+            db.close()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Stores sessions in Redis (or any server speaking the same commands).
+    Redis expires session keys itself; a sorted set of deadlines lets the
+    reaper clean the per-user token sets in O(expired).
+    `client` only needs get/set(px=)/delete/sadd/srem/smembers/pexpire and
+    zadd/zrem/zrangebyscore/zcount, as provided by redis-py's Redis class.
+    """
+    def __init__(self, client, prefix="session:", **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis # Optional dependency, only needed for this backend
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, token):
+        return f"{self.prefix}{token}"
+
+    def _user_key(self, username):
+        return f"{self.prefix}user:{username}"
+
+    def _expiry_key(self):
+        return f"{self.prefix}expiry"
+
+    def _write(self, token, principal, absolute_expires_at, expires_at):
+        ttl_ms = max(1, int((expires_at - time.time()) * 1000))
+        value = {"principal": principal, "absolute_expires_at": absolute_expires_at, "expires_at": expires_at}
+        self.client.set(self._key(token), json.dumps(value), px=ttl_ms)
+        # Tokens never contain ":", so the member can carry the username for reaping
+        self.client.zadd(self._expiry_key(), {f"{token}:{principal['username']}": expires_at})
+        return ttl_ms
+
+    def _load(self, token):
+        raw = self.client.get(self._key(token))
+        if not raw:
+            return None
+        value = json.loads(raw)
+        return value["principal"], value["absolute_expires_at"], value["expires_at"]
+
+    def _save(self, token, principal, absolute_expires_at, expires_at):
+        self._write(token, principal, absolute_expires_at, expires_at)
+        user_key = self._user_key(principal["username"])
+        self.client.sadd(user_key, token)
+        self.client.pexpire(user_key, int(self.ttl_seconds * 1000))
+
+    def _update(self, token, principal):
+        entry = self._load(token)
+        if entry is not None:
+            self._write(token, principal, entry[1], entry[2])
+
+    def _touch(self, token, principal, expires_at):
+        entry = self._load(token)
+        if entry is not None:
+            self._write(token, entry[0], entry[1], expires_at)
+
+    def _delete(self, token):
+        entry = self._load(token)
+        removed = bool(self.client.delete(self._key(token)))
+        if entry:
+            username = entry[0]["username"]
+            self.client.srem(self._user_key(username), token)
+            self.client.zrem(self._expiry_key(), f"{token}:{username}")
+        return removed
+
+    def _tokens_for_user(self, username):
+        tokens = []
+        for token in self.client.smembers(self._user_key(username)):
+            token = token.decode() if isinstance(token, bytes) else token
+            if self.client.get(self._key(token)) is not None:
+                tokens.append(token)
+        return tokens
+
+    def _reap(self, now, max_items=None):
+        members = self.client.zrangebyscore(self._expiry_key(), "-inf", now,
+                                            start=0 if max_items else None, num=max_items)
+        for member in members:
+            member = member.decode() if isinstance(member, bytes) else member
+            token, username = member.split(":", 1)
+            self.client.delete(self._key(token)) # Usually already expired by Redis
+            self.client.srem(self._user_key(username), token)
+            self.client.zrem(self._expiry_key(), member)
+        return len(members)
+
+    def _count_live(self):
+        return self.client.zcount(self._expiry_key(), f"({time.time()}", "+inf")
+
+
+def create_session_store_from_env() -> SessionStore:
+    """
+    Builds the session store selected by SESSION_BACKEND (memory, database or redis).
+    Use database or redis when running more than one uvicorn worker.
+    """
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    ttl_seconds = int(os.getenv("SESSION_TTL_SECONDS", DEFAULT_SESSION_TTL_SECONDS))
+    idle_ttl_seconds = int(os.getenv("SESSION_IDLE_TTL_SECONDS", DEFAULT_SESSION_IDLE_TTL_SECONDS))
+    if backend == "memory":
+        return InMemorySessionStore(ttl_seconds=ttl_seconds, idle_ttl_seconds=idle_ttl_seconds)
+    cache_size = int(os.getenv("SESSION_CACHE_SIZE", 1024))
+    cache_ttl_seconds = float(os.getenv("SESSION_CACHE_TTL_SECONDS", 5))
+    options = dict(ttl_seconds=ttl_seconds, idle_ttl_seconds=idle_ttl_seconds,
+                   cache_size=cache_size, cache_ttl_seconds=cache_ttl_seconds)
+    if backend == "database":
+        return DatabaseSessionStore(**options)
+    if backend == "redis":
+        return RedisSessionStore.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), **options)
+    raise ValueError(f"Unknown session backend: {backend}")
@@ -2,7 +2,9 @@ from enum import Enum
 import uuid
 from datetime import datetime
 from abc import ABC, abstractmethod
-from database import SessionLocal, Task
+from sqlalchemy import select
+from database import SessionLocal, Task, scope_to_department, run_query
+from async_database import run_query_async
 from typing import List
 class TaskStatus(Enum):
     NOT_STARTED = "Not Started"
@@ -87,6 +89,19 @@ class DeadlineSensitiveTaskCreator(TaskCreator):
 
 
 # ---------------- Task Manager ----------------
+def _task_dicts(result):
+    return [
+        {
+            "id": t.id,
+            "title": t.title,
+            "description": t.description,
+            "assigned_to": t.assigned_to,
+            "deadline": t.deadline,
+            "status": t.status,
+            "created_at": t.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        } for t in result.scalars()
+    ]
+
 class TaskManager:
     def __init__(self, notifier=None):
         self.notifier = notifier
@@ -159,41 +174,30 @@ class TaskManager:
         finally:
             db.close()
 
+    # --- Read queries ---
+    # Each builder returns (statement, shape), run by the plain method on a sync
+    # session and by its *_async variant, awaited by the routes, on an async one.
+    def _tasks_by_user_query(self, username):
+        return select(Task).where(Task.assigned_to == username), _task_dicts
+
+    def _all_tasks_query(self):
+        return select(Task), _task_dicts
+
+    def _department_tasks_query(self, root_department_id):
+        return scope_to_department(select(Task), Task.assigned_to, root_department_id), _task_dicts
+
     def get_tasks_by_user(self, username):
-        db = SessionLocal()
-        try:
-            tasks = db.query(Task).filter(Task.assigned_to == username).all()
-            return [
-                {
-                    "id": t.id,
-                    "title": t.title,
-                    "description": t.description,
-                    "assigned_to": t.assigned_to,
-                    "deadline": t.deadline,
-                    "status": t.status,
-                    "created_at": t.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                } for t in tasks
-            ]
-        finally:
-            db.close()
+        return run_query(*self._tasks_by_user_query(username))
+
+    async def get_tasks_by_user_async(self, username):
+        return await run_query_async(*self._tasks_by_user_query(username))
 
     def get_all_tasks(self):
-        db = SessionLocal()
-        try:
-            tasks = db.query(Task).all()
-            return [
-                {
-                    "id": t.id,
-                    "title": t.title,
-                    "description": t.description,
-                    "assigned_to": t.assigned_to,
-                    "deadline": t.deadline,
-                    "status": t.status,
-                    "created_at": t.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                } for t in tasks
-            ]
-        finally:
-            db.close()
+        return run_query(*self._all_tasks_query())
+
+    async def get_all_tasks_async(self):
+        return await run_query_async(*self._all_tasks_query())
+
     def get_tasks_for_employees(self, employee_ids: List[str]):
         db = SessionLocal()
         try:
@@ -210,4 +214,11 @@ class TaskManager:
                 } for t in tasks
             ]
         finally:
-            db.close()
\ No newline at end of file
+            db.close()
+
+    def get_tasks_for_department(self, root_department_id):
+        """Tasks assigned to anyone in a department and its sub-departments."""
+        return run_query(*self._department_tasks_query(root_department_id))
+
+    async def get_tasks_for_department_async(self, root_department_id):
+        return await run_query_async(*self._department_tasks_query(root_department_id))
@@ -1,31 +1,18 @@
 # test_attendance.py
 
-import os
 import pytest
-import time # Added for time.sleep
 from datetime import datetime, timedelta
 from attendance import AttendanceManager
 from notification import NotificationManager, InAppNotifier # For notifier integration
-from database import create_tables, SessionLocal, Attendance, engine # Import engine
+from database import create_tables, SessionLocal, Attendance, engine, reset_database # Import engine
 from collections import defaultdict # Added for get_total_hours_for_employees in test
 
 # Helper function to clean up database
 @pytest.fixture(autouse=True)
 def setup_and_teardown_db():
-    # Helper to force-delete the database file, with retries
+    # Helper to reset the database between tests
     def force_delete_db():
-        SessionLocal.remove() # Ensure session is removed
-        engine.dispose() # Dispose of the engine to release file lock
-        if os.path.exists("company.db"):
-            for i in range(5):
-                try:
-                    os.remove("company.db")
-                    break # Success!
-                except PermissionError as e:
-                    print(f"Failed to delete DB, retrying... ({i+1}/5)")
-                    time.sleep(0.1) # Wait for 1 second before retrying
-                    if i == 4:
-                        raise e # Re-raise if all retries fail
+        reset_database() # Deletes company.db, or drops all tables on a server database
     
     # --- Setup Phase ---
     force_delete_db() # Call the helper before setup
@@ -124,3 +111,66 @@ def test_attendance_records_and_total_hours():
     assert selected_employees_total_hours[employee1] == 16.0
     assert selected_employees_total_hours[employee2] == 7.0
     print(f"Total hours for selected employees ({employee1}, {employee2}): {selected_employees_total_hours}")
+
+def test_worked_seconds_stored_and_backfilled():
+    print("\n--- Stored Worked Duration Test ---")
+    am = AttendanceManager()
+    am.check_in("emp_ws")
+    am.check_out("emp_ws")
+    db = SessionLocal()
+    try:
+        entry = db.query(Attendance).filter(Attendance.employee_id == "emp_ws").first()
+        assert entry.worked_seconds is not None and entry.worked_seconds >= 0
+        # Direct ORM writes get the duration too
+        entry.check_in, entry.check_out = "09:00:00", "12:30:00"
+        db.commit()
+        db.refresh(entry)
+        assert entry.worked_seconds == 3.5 * 3600
+    finally:
+        db.close()
+    assert am.get_total_hours_for_employee("emp_ws") == 3.5
+
+    # A database from before the column existed is migrated and backfilled by create_tables
+    reset_database()
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE attendance (id INTEGER PRIMARY KEY, employee_id VARCHAR, date VARCHAR, "
+            "check_in VARCHAR, check_out VARCHAR, department_id INTEGER)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO attendance (id, employee_id, date, check_in, check_out) VALUES "
+            "(1, 'legacy', '2025-01-02', '08:00:00', '16:15:00'), (2, 'legacy', '2025-01-03', '08:00:00', NULL)"
+        )
+    create_tables()
+    assert am.get_total_hours_for_employee("legacy") == 8.25
+    assert am.get_total_hours_for_all_employees() == {"legacy": 8.25}
+
+def test_attendance_date_range_and_indexes():
+    print("\n--- Attendance Date Range Test ---")
+    am = AttendanceManager()
+    db = SessionLocal()
+    try:
+        for day in ("2025-03-01", "2025-03-02", "2025-03-05"):
+            db.add(Attendance(employee_id="emp_a", date=day, check_in="09:00:00", check_out="17:00:00"))
+        db.add(Attendance(employee_id="emp_b", date="2025-03-02", check_in="10:00:00", check_out="12:00:00"))
+        db.commit()
+    finally:
+        db.close()
+
+    records = am.get_attendance_between("2025-03-01", "2025-03-02")
+    assert [(r["employee_id"], r["date"]) for r in records] == [
+        ("emp_a", "2025-03-01"), ("emp_a", "2025-03-02"), ("emp_b", "2025-03-02")
+    ]
+    assert records[0]["check_in"] == "09:00:00" # Values still come back as strings
+    only_b = am.get_attendance_between(datetime(2025, 3, 1).date(), "2025-03-31", employee_ids=["emp_b"])
+    assert [(r["date"], r["hours"]) for r in only_b] == [("2025-03-02", 2.0)]
+    assert am.get_summary_by_date("2025-03-05")[0]["check_out"] == "17:00:00"
+
+    # The per-day lookups are served by the composite index rather than a table scan
+    if engine.dialect.name != "sqlite":
+        return # Query plan format below is SQLite's
+    with engine.connect() as connection:
+        plan = connection.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT id FROM attendance WHERE employee_id = 'emp_a' AND date = '2025-03-01'"
+        ).all()
+    assert "ix_attendance_employee_date" in " ".join(str(row) for row in plan)
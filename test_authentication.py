@@ -1,30 +1,19 @@
 # test_authentication.py
 
-import os
 import pytest
 import time # Added for time.sleep
 import hashlib # Added for password hashing
 from authentication import AuthManager
-from database import create_tables, SessionLocal, User, Department, engine # Import engine
+from database import create_tables, SessionLocal, User, Department, engine, reset_database # Import engine
 from department_manager import DepartmentManager
+from session_store import InMemorySessionStore, DatabaseSessionStore, RedisSessionStore
 
 # Helper function to clean up database and create default admin/department
 @pytest.fixture(autouse=True)
 def setup_and_teardown_db():
-    # Helper to force-delete the database file, with retries
+    # Helper to reset the database between tests
     def force_delete_db():
-        SessionLocal.remove() # Ensure session is removed
-        engine.dispose() # Dispose of the engine to release file lock
-        if os.path.exists("company.db"):
-            for i in range(5):
-                try:
-                    os.remove("company.db")
-                    break # Success!
-                except PermissionError as e:
-                    print(f"Failed to delete DB, retrying... ({i+1}/5)")
-                    time.sleep(0.1) # Shorten sleep slightly for faster retries
-                    if i == 4:
-                        raise e # Re-raise if all retries fail
+        reset_database() # Deletes company.db, or drops all tables on a server database
     
     # --- Setup Phase ---
     force_delete_db() # Call the helper before setup
@@ -150,3 +139,193 @@ def test_token_validation_and_logout():
     # Verify token is no longer valid
     assert auth_manager.validate_token(admin_token) is False
     print("Admin token is invalid after logout.")
+
+def test_principal_cache_and_invalidation():
+    print("\n--- Principal Cache Test ---")
+    from sqlalchemy import event
+    auth_manager = AuthManager.get_instance()
+    dept_manager = DepartmentManager()
+
+    auth_manager.register_user("jane_doe", "janepass", "employee")
+    success, parent_obj = dept_manager.create_department_db("Engineering", None)
+    engineering_id = parent_obj.id
+    success, token = auth_manager.login("jane_doe", "janepass")
+    assert success is True
+
+    # Identity lookups are served from the session store, not the database
+    queries = []
+    def count_queries(*args):
+        queries.append(args)
+    event.listen(engine, "before_cursor_execute", count_queries)
+    try:
+        assert auth_manager.get_logged_in_user(token) == "jane_doe"
+        assert auth_manager.get_user_role(token) == "employee"
+        assert auth_manager.get_department_scope(token) == []
+    finally:
+        event.remove(engine, "before_cursor_execute", count_queries)
+    assert queries == []
+    print("Identity resolved with zero database queries.")
+
+    # Role/department changes are reflected on the live session
+    success, msg = auth_manager.update_user_role("admin", "jane_doe", "manager", engineering_id)
+    assert success is True
+    assert auth_manager.get_user_role(token) == "manager"
+    assert auth_manager.get_department_scope(token) == [engineering_id]
+
+    # Adding a sub-department invalidates the cached scope
+    success, child_obj = dept_manager.create_department_db("Platform", None)
+    dept_manager.update_department_db(child_obj.id, None, engineering_id)
+    assert sorted(auth_manager.get_department_scope(token)) == sorted([engineering_id, child_obj.id])
+    print(f"Scope after adding sub-department: {auth_manager.get_department_scope(token)}")
+
+    auth_manager.logout(token)
+    assert auth_manager.get_principal(token) is None
+
+
+class FakeRedis:
+    """Minimal local stand-in for the subset of redis-py used by RedisSessionStore."""
+    def __init__(self):
+        self.values = {}
+        self.sets = {}
+        self.expiry = {}
+
+    def _alive(self, key):
+        if key in self.expiry and self.expiry[key] <= time.time():
+            self.values.pop(key, None)
+            self.sets.pop(key, None)
+            del self.expiry[key]
+        return key in self.values or key in self.sets
+
+    def get(self, key):
+        return self.values.get(key) if self._alive(key) else None
+
+    def set(self, key, value, px=None):
+        self.values[key] = value.encode()
+        if px:
+            self.expiry[key] = time.time() + px / 1000
+
+    def delete(self, key):
+        existed = self._alive(key)
+        self.values.pop(key, None)
+        self.expiry.pop(key, None)
+        return int(existed)
+
+    def pttl(self, key):
+        if not self._alive(key):
+            return -2
+        return int((self.expiry[key] - time.time()) * 1000) if key in self.expiry else -1
+
+    def sadd(self, key, member):
+        self.sets.setdefault(key, set()).add(member.encode())
+
+    def srem(self, key, member):
+        self.sets.get(key, set()).discard(member.encode())
+
+    def smembers(self, key):
+        return set(self.sets.get(key, set())) if self._alive(key) else set()
+
+    def pexpire(self, key, milliseconds):
+        self.expiry[key] = time.time() + milliseconds / 1000
+
+    def zadd(self, key, mapping):
+        self.sets.setdefault(key, {}).update({m.encode(): score for m, score in mapping.items()})
+
+    def zrem(self, key, member):
+        self.sets.get(key, {}).pop(member.encode(), None)
+
+    def zrangebyscore(self, key, low, high, start=None, num=None):
+        members = sorted((score, m) for m, score in self.sets.get(key, {}).items() if score <= high)
+        members = [m for _, m in members]
+        return members[start:start + num] if num is not None else members
+
+    def zcount(self, key, low, high):
+        low = float(low.lstrip("("))
+        return sum(1 for score in self.sets.get(key, {}).values() if score > low)
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda ttl: InMemorySessionStore(ttl_seconds=ttl),
+    lambda ttl: DatabaseSessionStore(ttl_seconds=ttl, cache_ttl_seconds=0.05),
+    lambda ttl: RedisSessionStore(FakeRedis(), ttl_seconds=ttl, cache_ttl_seconds=0.05),
+], ids=["memory", "database", "redis"])
+def test_session_store_backends(make_store):
+    print("\n--- Session Store Backend Test ---")
+    store = make_store(1)
+    store.idle_ttl_seconds = 0
+    principal = {"username": "admin", "role": "admin", "department_id": None}
+
+    store.put("tok-1", principal)
+    assert store.get("tok-1") == principal
+    assert "tok-1" in store
+    assert store.tokens_for_user("admin") == ["tok-1"]
+
+    store.update("tok-1", dict(principal, role="manager"))
+    assert store.get("tok-1")["role"] == "manager"
+
+    assert store.delete("tok-1") is True
+    assert store.get("tok-1") is None
+    assert store.delete("tok-1") is False
+
+    # Sessions expire after the TTL, including entries held in the local cache
+    store.put("tok-2", principal)
+    time.sleep(1.1)
+    assert store.get("tok-2") is None
+    print(f"{type(store).__name__} passed put/get/update/delete/expiry.")
+
+def test_shared_session_store_across_workers():
+    print("\n--- Shared Session Store Test ---")
+    auth_manager = AuthManager.get_instance()
+    worker_a = DatabaseSessionStore(cache_ttl_seconds=0)
+    worker_b = DatabaseSessionStore(cache_ttl_seconds=0)
+    auth_manager.set_session_store(worker_a)
+    try:
+        success, token = auth_manager.login("admin", "admin")
+        assert success is True
+        # A token issued by one worker is valid on another one sharing the database
+        assert token in worker_b
+        assert worker_b.get(token)["username"] == "admin"
+
+        auth_manager.logout(token)
+        assert token not in worker_b
+    finally:
+        auth_manager.set_session_store(InMemorySessionStore())
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda: InMemorySessionStore(ttl_seconds=60, idle_ttl_seconds=0.3),
+    lambda: DatabaseSessionStore(ttl_seconds=60, idle_ttl_seconds=0.3, cache_size=0),
+    lambda: RedisSessionStore(FakeRedis(), ttl_seconds=60, idle_ttl_seconds=0.3, cache_size=0),
+], ids=["memory", "database", "redis"])
+def test_session_idle_expiry_and_reaping(make_store):
+    print("\n--- Session Idle Expiry and Reaping Test ---")
+    store = make_store()
+    store.touch_interval_seconds = 0
+    for i in range(5):
+        store.put(f"idle-{i}", {"username": f"user{i}", "role": "employee", "department_id": None})
+    store.put("active", {"username": "active_user", "role": "employee", "department_id": None})
+    assert store.stats()["live"] == 6
+
+    # Keep one session busy past the idle TTL; the others are abandoned
+    for _ in range(4):
+        time.sleep(0.1)
+        assert store.get("active") is not None
+
+    assert store.reap() == 5
+    assert store.get("active") is not None
+    assert store.get("idle-0") is None
+    assert store.tokens_for_user("user0") == []
+    stats = store.stats()
+    assert stats == {"live": 1, "expired": 5, "reaped": 5}
+    print(f"Session stats after reaping: {stats}")
+
+def test_session_absolute_expiry():
+    print("\n--- Session Absolute Expiry Test ---")
+    store = InMemorySessionStore(ttl_seconds=0.3, idle_ttl_seconds=10)
+    store.put("tok", {"username": "admin", "role": "admin", "department_id": None})
+    # Activity slides the idle deadline but never past the absolute limit
+    for _ in range(2):
+        time.sleep(0.1)
+        assert store.get("tok") is not None
+    time.sleep(0.15)
+    assert store.get("tok") is None
+    assert store.stats()["expired"] == 1
@@ -0,0 +1,71 @@
+# test_blocking_executor.py
+
+import asyncio
+import threading
+import pytest
+from blocking_executor import BlockingExecutor, ExecutorSaturatedError
+
+def test_blocking_executor_runs_off_the_event_loop():
+    print("\n--- Blocking Executor Test ---")
+    executor = BlockingExecutor(max_workers=2, max_queue=4)
+
+    async def main():
+        loop_thread = threading.get_ident()
+        thread_ids = await asyncio.gather(*(executor.run(threading.get_ident) for _ in range(4)))
+        assert loop_thread not in thread_ids
+        return await executor.run(lambda a, b=0: a + b, 1, b=2)
+
+    assert asyncio.run(main()) == 3
+    metrics = executor.metrics()
+    assert metrics["completed"] == 5
+    assert metrics["active"] == 0 and metrics["queue_depth"] == 0
+    executor.shutdown()
+
+def test_blocking_executor_rejects_when_queue_full():
+    print("\n--- Blocking Executor Saturation Test ---")
+    executor = BlockingExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def main():
+        running = asyncio.ensure_future(executor.run(release.wait)) # Occupies the only worker
+        while executor.metrics()["active"] == 0:
+            await asyncio.sleep(0.01)
+        queued = asyncio.ensure_future(executor.run(lambda: "queued")) # Fills the queue
+        await asyncio.sleep(0)
+        assert executor.metrics()["queue_depth"] == 1
+        assert executor.metrics()["saturation"] == 1.0
+        with pytest.raises(ExecutorSaturatedError):
+            await executor.run(lambda: "rejected")
+        release.set()
+        return await running, await queued
+
+    assert asyncio.run(main()) == (True, "queued")
+    metrics = executor.metrics()
+    assert metrics["rejected"] == 1
+    assert metrics["max_wait_ms"] > 0
+    executor.shutdown()
+
+def test_blocking_executor_releases_slots_of_cancelled_calls():
+    print("\n--- Blocking Executor Cancellation Test ---")
+    executor = BlockingExecutor(max_workers=1, max_queue=3)
+    release = threading.Event()
+
+    async def main():
+        running = asyncio.ensure_future(executor.run(release.wait)) # Occupies the only worker
+        while executor.metrics()["active"] == 0:
+            await asyncio.sleep(0.01)
+        waiters = [asyncio.ensure_future(executor.run(lambda: "never")) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert executor.metrics()["queue_depth"] == 3
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert executor.metrics()["queue_depth"] == 0
+        release.set()
+        await running
+        return await executor.run(lambda: "after")
+
+    assert asyncio.run(main()) == "after"
+    metrics = executor.metrics()
+    assert metrics["queue_depth"] == 0 and metrics["rejected"] == 0
+    executor.shutdown()
@@ -1,30 +1,17 @@
 # test_department_management.py
 
-import os
 import pytest
-import time # Added for time.sleep
 from department_manager import DepartmentManager
-from database import create_tables, SessionLocal, Department, User, engine # Import engine and User
+from database import create_tables, SessionLocal, Department, User, engine, reset_database # Import engine and User
 from authentication import AuthManager # For default admin creation
 import hashlib # For password hashing in user creation
 
 # Helper function to clean up database
 @pytest.fixture(autouse=True)
 def setup_and_teardown_db():
-    # Helper to force-delete the database file, with retries
+    # Helper to reset the database between tests
     def force_delete_db():
-        SessionLocal.remove()
-        engine.dispose() # Dispose of the engine to release file lock
-        if os.path.exists("company.db"):
-            for i in range(5):
-                try:
-                    os.remove("company.db")
-                    break
-                except PermissionError as e:
-                    print(f"Failed to delete DB, retrying... ({i+1}/5)")
-                    time.sleep(0.1)
-                    if i == 4:
-                        raise e
+        reset_database() # Deletes company.db, or drops all tables on a server database
     
     # --- Setup Phase ---
     force_delete_db()
@@ -52,4 +39,233 @@ def test_create_default_department():
         print(f"Default department '{default_dept.name}' created successfully.")
     finally:
         db.close()
- 
\ No newline at end of file
+ 
+def test_department_scope_resolver_cache():
+    print("\n--- Department Scope Resolver Test ---")
+    from department_scope import DepartmentScopeResolver
+    resolver = DepartmentScopeResolver.get_instance()
+    dept_manager = DepartmentManager()
+    auth_manager = AuthManager.get_instance()
+
+    success, sales = dept_manager.create_department_db("Sales", None)
+    success, emea = dept_manager.create_department_db("EMEA Sales", None)
+    dept_manager.update_department_db(emea.id, None, sales.id)
+    auth_manager.register_user("seller", "pass", "employee")
+    auth_manager.update_user_role("admin", "seller", "employee", emea.id)
+
+    dept_ids, usernames = resolver.resolve(sales.id)
+    assert sorted(dept_ids) == sorted([sales.id, emea.id])
+    assert usernames == ["seller"]
+
+    # Cached: a second resolve issues no queries
+    from sqlalchemy import event
+    queries = []
+    def count_queries(*args):
+        queries.append(args)
+    event.listen(engine, "before_cursor_execute", count_queries)
+    try:
+        assert resolver.resolve(sales.id) == (dept_ids, usernames)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_queries)
+    assert queries == []
+
+    # User changes invalidate the cached scope
+    auth_manager.update_user_role("admin", "seller", "employee", None)
+    assert resolver.resolve(sales.id)[1] == []
+
+    # Department changes invalidate it too, even when written directly
+    db = SessionLocal()
+    try:
+        db.add(Department(name="APAC Sales", parent_department_id=sales.id))
+        db.commit()
+    finally:
+        db.close()
+    assert len(resolver.get_department_ids(sales.id)) == 3
+    print(f"Scope for Sales: {resolver.resolve(sales.id)}")
+
+def test_department_scope_resolver_skips_stale_loads(monkeypatch):
+    print("\n--- Department Scope Resolver Race Test ---")
+    from department_scope import DepartmentScopeResolver
+    resolver = DepartmentScopeResolver.get_instance()
+    success, sales = DepartmentManager().create_department_db("Sales", None)
+    load_scope = resolver._load_scope
+    def load_then_write(department_id):
+        scope = load_scope(department_id)
+        resolver.invalidate() # A commit lands after the query
+        return scope
+    monkeypatch.setattr(resolver, "_load_scope", load_then_write)
+    resolver.get_department_ids(sales.id)
+    monkeypatch.undo()
+    assert sales.id not in resolver._scopes # The possibly stale scope was not cached
+    resolver.get_department_ids(sales.id)
+    assert sales.id in resolver._scopes
+
+def test_department_hierarchy_index():
+    print("\n--- Department Hierarchy Index Test ---")
+    dept_manager = DepartmentManager()
+
+    # Build:  Ops -> (Logistics -> (Fleet, Warehouse), Support)
+    success, ops = dept_manager.create_department_db("Ops", None)
+    assert success is True
+    success, logistics = dept_manager.create_department_db("Logistics", ops.id)
+    assert success is True # Creating with a parent used to be rejected
+    _, fleet = dept_manager.create_department_db("Fleet", logistics.id)
+    _, warehouse = dept_manager.create_department_db("Warehouse", logistics.id)
+    _, support = dept_manager.create_department_db("Support", ops.id)
+
+    ops_ids = dept_manager.get_all_department_ids_in_hierarchy(ops.id)
+    assert ops_ids[0] == ops.id
+    assert sorted(ops_ids) == sorted([ops.id, logistics.id, fleet.id, warehouse.id, support.id])
+    assert sorted(dept_manager.get_all_department_ids_in_hierarchy(logistics.id)) == sorted([logistics.id, fleet.id, warehouse.id])
+    assert dept_manager.get_all_department_ids_in_hierarchy(support.id) == [support.id]
+    assert dept_manager.get_all_department_ids_in_hierarchy(9999) == []
+
+    # Repeated lookups are served from the cached index
+    from sqlalchemy import event
+    queries = []
+    def count_queries(*args):
+        queries.append(args)
+    event.listen(engine, "before_cursor_execute", count_queries)
+    try:
+        for _ in range(10):
+            dept_manager.get_all_department_ids_in_hierarchy(ops.id)
+            dept_manager.get_department_tree()
+    finally:
+        event.remove(engine, "before_cursor_execute", count_queries)
+    assert queries == []
+
+    # Moving an ancestor under its own descendant is rejected
+    success, msg = dept_manager.update_department_db(ops.id, None, fleet.id)
+    assert success is False
+    assert "Circular dependency" in msg
+
+    # Moves are reflected immediately
+    success, msg = dept_manager.update_department_db(fleet.id, None, support.id)
+    assert success is True
+    assert sorted(dept_manager.get_all_department_ids_in_hierarchy(support.id)) == sorted([support.id, fleet.id])
+
+    tree = dept_manager.get_department_tree()
+    ops_node = next(n for n in tree if n["id"] == ops.id)
+    assert ops_node["type"] == "composite"
+    assert {c["name"] for c in ops_node["children"]} == {"Logistics", "Support"}
+    print(f"Department tree: {tree}")
+
+def test_department_hierarchy_index_skips_stale_builds(monkeypatch):
+    print("\n--- Department Hierarchy Index Race Test ---")
+    import department_manager
+    dept_manager = DepartmentManager()
+    success, ops = dept_manager.create_department_db("Ops", None)
+    build_index = department_manager.DepartmentHierarchyIndex
+    def build_then_write(rows):
+        DepartmentManager.invalidate_hierarchy_cache() # A commit lands after the query
+        return build_index(rows)
+    monkeypatch.setattr(department_manager, "DepartmentHierarchyIndex", build_then_write)
+    assert dept_manager.get_all_department_ids_in_hierarchy(ops.id) == [ops.id]
+    monkeypatch.undo()
+    assert DepartmentManager._hierarchy_index is None # The possibly stale index was not cached
+    dept_manager.get_all_department_ids_in_hierarchy(ops.id)
+    assert DepartmentManager._hierarchy_index is not None
+
+def test_department_hierarchy_sql_mode():
+    print("\n--- Department Hierarchy (SQL Mode) Test ---")
+    from sqlalchemy import event
+    dept_manager = DepartmentManager(hierarchy_mode="sql")
+
+    # A deep chain: Level0 -> Level1 -> ... -> Level5
+    ids = []
+    parent_id = None
+    for level in range(6):
+        success, dept = dept_manager.create_department_db(f"Level{level}", parent_id)
+        assert success is True
+        ids.append(dept.id)
+        parent_id = dept.id
+
+    queries = []
+    def count_queries(*args):
+        queries.append(args)
+    event.listen(engine, "before_cursor_execute", count_queries)
+    try:
+        subtree = dept_manager.get_all_department_ids_in_hierarchy(ids[0])
+    finally:
+        event.remove(engine, "before_cursor_execute", count_queries)
+    assert subtree[0] == ids[0]
+    assert sorted(subtree) == sorted(ids)
+    assert len(queries) == 1 # One round trip regardless of depth
+    assert dept_manager.get_all_department_ids_in_hierarchy(ids[4]) == [ids[4], ids[5]]
+    assert dept_manager.get_all_department_ids_in_hierarchy(9999) == []
+
+    # Circular dependency check is one closure-table lookup
+    success, msg = dept_manager.update_department_db(ids[0], None, ids[5])
+    assert success is False
+    assert "Circular dependency" in msg
+    success, msg = dept_manager.update_department_db(ids[5], None, ids[0])
+    assert success is True
+    assert DepartmentManager(hierarchy_mode="index").get_all_department_ids_in_hierarchy(ids[0])[0] == ids[0]
+    print(f"Subtree of Level0 via closure table: {subtree}")
+
+def test_department_closure_table():
+    print("\n--- Department Closure Table Test ---")
+    import random
+    from database import DepartmentClosure, rebuild_department_closure
+    dept_manager = DepartmentManager()
+
+    def closure_pairs():
+        db = SessionLocal()
+        try:
+            return {(c.ancestor_id, c.descendant_id, c.depth) for c in db.query(DepartmentClosure).all()}
+        finally:
+            db.close()
+
+    def expected_pairs():
+        # Walk parent pointers for every department
+        departments = {d.id: d.parent_department_id for d in dept_manager.get_all_departments_db()}
+        pairs = set()
+        for dept_id in departments:
+            ancestor, depth = dept_id, 0
+            while ancestor is not None:
+                pairs.add((ancestor, dept_id, depth))
+                ancestor, depth = departments.get(ancestor), depth + 1
+        return pairs
+
+    # Random tree built through the manager and through direct inserts
+    random.seed(7)
+    ids = []
+    for i in range(25):
+        parent = random.choice(ids) if ids and i % 3 else None
+        if i % 2:
+            success, dept = dept_manager.create_department_db(f"D{i}", parent)
+            ids.append(dept.id)
+        else:
+            db = SessionLocal()
+            try:
+                dept = Department(name=f"D{i}", parent_department_id=parent)
+                db.add(dept)
+                db.commit()
+                ids.append(dept.id)
+            finally:
+                db.close()
+    assert closure_pairs() == expected_pairs()
+
+    # Move subtrees around, including to the top level
+    for _ in range(15):
+        dept_id, new_parent = random.sample(ids, 2)
+        dept_manager.update_department_db(dept_id, None, new_parent if random.random() < 0.8 else 0)
+    assert closure_pairs() == expected_pairs()
+
+    # Delete leaves
+    for dept_id in list(ids):
+        success, _ = dept_manager.delete_department_db(dept_id)
+        if success:
+            ids.remove(dept_id)
+    assert closure_pairs() == expected_pairs()
+
+    # Backfill from scratch produces the same table
+    maintained = closure_pairs()
+    with engine.begin() as connection:
+        rebuild_department_closure(connection)
+    assert closure_pairs() == maintained
+
+    root = ids[0]
+    for dept_id in ids:
+        assert dept_manager.is_in_hierarchy(dept_id, root) == (dept_id in dept_manager.get_all_department_ids_in_hierarchy(root))
+    print(f"Closure table holds {len(maintained)} rows for {len(ids) + 1} departments.")
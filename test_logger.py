@@ -0,0 +1,216 @@
+# test_logger.py
+
+import gzip
+import json
+import time
+from datetime import datetime
+from unittest import mock
+import pytest
+from logger import Logger, archive_segments
+from database import create_tables, reset_database, SessionLocal, AuditEntry
+
+@pytest.fixture(autouse=True)
+def log_path(tmp_path, monkeypatch):
+    # Fresh Logger instances write to a temporary audit.log and an empty audit_log table
+    path = tmp_path / "audit.log"
+    monkeypatch.setattr(Logger, "_log_file", str(path))
+    monkeypatch.setattr(Logger, "_Logger__instance", None)
+    monkeypatch.setenv("AUDIT_LOG_RETENTION_DAYS", "0") # Keep the fixed 2024 test entries
+    reset_database()
+    create_tables()
+    return path
+
+@pytest.fixture
+def audit_logger(monkeypatch):
+    monkeypatch.setenv("AUDIT_LOG_BATCH_SIZE", "50")
+    monkeypatch.setenv("AUDIT_LOG_FLUSH_INTERVAL_SECONDS", "60")
+    logger = Logger.get_instance()
+    yield logger
+    logger.close()
+
+def read_entries(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def test_logger_batches_writes(audit_logger, log_path):
+    print("\n--- Audit Log Batching Test ---")
+    with mock.patch.object(audit_logger, "_write_batch", wraps=audit_logger._write_batch) as write_batch:
+        for i in range(120):
+            audit_logger.log_event("alice", "Task Created", {"n": i})
+        # Two full batches of 50; close() writes the remaining 20 without waiting for the interval
+        audit_logger.close()
+        assert write_batch.call_count == 3
+
+    entries = read_entries(log_path)
+    assert [e["details"]["n"] for e in entries] == list(range(120))
+    assert len(audit_logger.get_logs()) == 120
+
+def test_logger_flush_and_restart_after_close(audit_logger, log_path, monkeypatch):
+    print("\n--- Audit Log Flush Test ---")
+    audit_logger.flush_interval = 0.01
+    audit_logger.log_event("bob", "Login Successful")
+    audit_logger.flush()
+    assert read_entries(log_path)[0]["action"] == "Login Successful"
+
+    audit_logger.close()
+    audit_logger.log_event("bob", "Logged out") # Starts a new writer
+    audit_logger.close()
+    assert [e["action"] for e in read_entries(log_path)] == ["Login Successful", "Logged out"]
+
+    # A new instance reloads what was written
+    monkeypatch.setattr(Logger, "_Logger__instance", None)
+    assert len(Logger.get_instance().get_logs()) == 2
+
+def test_logger_survives_bad_entries_and_batches(audit_logger, log_path):
+    print("\n--- Audit Log Error Handling Test ---")
+    with pytest.raises(TypeError): # Reported to the caller, never queued
+        audit_logger.log_event("x", "bad", {"when": datetime.now()})
+
+    with mock.patch.object(audit_logger, "_write_batch", side_effect=RuntimeError("disk on fire")):
+        audit_logger.log_event("x", "lost")
+        audit_logger.flush() # Returns even though the batch failed
+    audit_logger.log_event("x", "ok")
+    audit_logger.flush()
+    assert [e["action"] for e in read_entries(log_path)] == ["ok"]
+
+def test_logger_flush_waits_only_for_earlier_entries(audit_logger, log_path):
+    print("\n--- Audit Log Bounded Flush Test ---")
+    import threading
+    audit_logger.log_event("carol", "Login Successful")
+    stop = threading.Event()
+
+    def keep_logging(): # Keeps the queue from ever draining
+        while not stop.is_set():
+            audit_logger.log_event("dave", "Task Updated")
+    logging_thread = threading.Thread(target=keep_logging)
+    logging_thread.start()
+    try:
+        assert audit_logger.flush(timeout=5) is True
+        assert read_entries(log_path)[0]["username"] == "carol"
+        entries, _ = audit_logger.query_logs(username="carol")
+        assert [e["action"] for e in entries] == ["Login Successful"]
+    finally:
+        stop.set()
+        logging_thread.join()
+
+    # A stuck writer delays history reads and /logs queries by at most read_flush_timeout
+    release = threading.Event()
+    with mock.patch.object(audit_logger, "_write_batch", side_effect=lambda batch: release.wait()):
+        try:
+            audit_logger.log_event("carol", "Logged out")
+            assert audit_logger.flush(timeout=0.05) is False
+            audit_logger.read_flush_timeout = 0.05
+            started = time.monotonic()
+            next(audit_logger.iter_history())
+            audit_logger.query_logs(username="carol")
+            assert time.monotonic() - started < 1
+        finally:
+            release.set()
+        assert audit_logger.flush(timeout=5) is True
+
+def test_logger_rejects_unknown_fsync_policy(monkeypatch):
+    monkeypatch.setenv("AUDIT_LOG_FSYNC", "always")
+    with pytest.raises(ValueError):
+        Logger()
+
+def test_logger_keeps_recent_entries_and_pages_history(log_path, monkeypatch):
+    print("\n--- Audit Log History Test ---")
+    with open(log_path, "w") as f:
+        for i in range(500):
+            f.write(json.dumps({"timestamp": "2024-01-01 00:00:00", "username": "u", "action": "a", "details": {"n": i}}) + "\n")
+        f.write('{"timestamp": "2024-01-01') # Torn last line
+    monkeypatch.setenv("AUDIT_LOG_RECENT_SIZE", "50")
+    logger = Logger.get_instance()
+    try:
+        # Only the tail is loaded
+        assert [e["details"]["n"] for e in logger.get_logs()] == list(range(450, 500))
+
+        # Pages within the buffer and beyond it, newest first
+        assert [e["details"]["n"] for e in logger.get_log_page(0, 3)] == [499, 498, 497]
+        assert [e["details"]["n"] for e in logger.get_log_page(495, 10)] == [4, 3, 2, 1, 0]
+
+        with open(log_path, "a") as f:
+            f.write("\n") # Let the writer start on a fresh line after the torn one
+        logger.log_event("u", "new")
+        assert logger.get_log_page(0, 1)[0]["action"] == "new"
+        assert logger.get_log_page(60, 1)[0]["details"]["n"] == 440 # From disk, after a flush
+    finally:
+        logger.close()
+
+def test_logger_query_filters_and_cursor_pages(audit_logger, log_path):
+    print("\n--- Audit Log Query Test ---")
+    with open(log_path, "w") as f: # History from before the audit_log table existed
+        for minute in range(30):
+            f.write(json.dumps({"timestamp": f"2024-01-01 10:{minute:02d}:00", "username": "carol",
+                                "action": "Login Successful" if minute % 2 else "Task Created", "details": {}}) + "\n")
+    reset_database()
+    create_tables() # Imports the file into audit_log
+    audit_logger.log_event("dave", "Login Successful", {"ip": "10.0.0.1"})
+
+    entries, cursor = audit_logger.query_logs(username="dave")
+    assert entries == [{"timestamp": entries[0]["timestamp"], "username": "dave", "action": "Login Successful", "details": {"ip": "10.0.0.1"}}]
+    assert cursor is None
+
+    # Logins between 10:10 and 10:20, newest first, two per page
+    pages, cursor = [], None
+    while True:
+        entries, cursor = audit_logger.query_logs(since="2024-01-01 10:10", until="2024-01-01 10:20",
+                                                  action="Login Successful", cursor=cursor, limit=2)
+        pages.append([e["timestamp"][11:16] for e in entries])
+        if cursor is None:
+            break
+    assert pages == [["10:19", "10:17"], ["10:15", "10:13"], ["10:11"]]
+
+    # Malformed cursors are rejected instead of failing inside the query
+    for bad_cursor in ("garbage", "2024-01-01 10:15:00|abc", "|5"):
+        with pytest.raises(ValueError):
+            audit_logger.query_logs(cursor=bad_cursor)
+
+def test_logger_rotates_compresses_and_expires_segments(log_path, monkeypatch):
+    print("\n--- Audit Log Rotation Test ---")
+    expired_archive = log_path.parent / "audit.log.20000101-000000-000000.gz"
+    with gzip.open(expired_archive, "wt") as f:
+        f.write(json.dumps({"timestamp": "2000-01-01 00:00:00", "username": "old", "action": "a", "details": {}}) + "\n")
+    reset_database()
+    create_tables() # Imports the expired archive into audit_log
+
+    monkeypatch.setenv("AUDIT_LOG_BATCH_SIZE", "1")
+    monkeypatch.setenv("AUDIT_LOG_MAX_BYTES", "300")
+    monkeypatch.setenv("AUDIT_LOG_RETENTION_DAYS", "30")
+    logger = Logger.get_instance()
+    try:
+        for i in range(10):
+            logger.log_event("erin", "Task Created", {"n": i})
+            logger.flush()
+        # Rotated by size; the expired archive and its table rows are gone
+        archives = archive_segments(str(log_path))
+        assert len(archives) >= 2
+        assert expired_archive not in [path for _, path in archives]
+        db = SessionLocal()
+        try:
+            assert db.query(AuditEntry).filter(AuditEntry.username == "old").count() == 0
+        finally:
+            db.close()
+
+        # History reads across the live file and the compressed segments
+        assert [e["details"]["n"] for e in logger.iter_history()] == list(range(9, -1, -1))
+
+        # Rotated by age
+        logger.rotate_seconds = 60
+        logger._segment_started = time.time() - 120
+        logger.log_event("erin", "Logged out")
+        logger.flush()
+        assert len(archive_segments(str(log_path))) == len(archives) + 1
+        assert log_path.read_text().count("\n") == 1
+        assert not list(log_path.parent.glob("*.rotating")) # Renamed segments are removed once compressed
+    finally:
+        logger.close()
+
+    # A rebuilt table is imported from every segment
+    reset_database()
+    create_tables()
+    db = SessionLocal()
+    try:
+        assert db.query(AuditEntry).filter(AuditEntry.username == "erin").count() == 11
+    finally:
+        db.close()
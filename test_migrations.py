@@ -0,0 +1,101 @@
+# test_migrations.py
+
+import time
+import pytest
+from sqlalchemy import inspect, text
+from database import create_tables, engine, reset_database
+from migrations import run_migrations, get_schema_version, explain_report, LATEST_VERSION
+from session_store import DatabaseSessionStore
+
+@pytest.fixture(autouse=True)
+def setup_and_teardown_db():
+    reset_database()
+    yield
+    reset_database()
+
+def test_migrations_record_version_and_are_idempotent():
+    print("\n--- Migration Runner Test ---")
+    create_tables()
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == LATEST_VERSION
+    assert run_migrations(engine) == [] # Nothing left to apply
+
+def test_migrations_apply_their_changes_in_order():
+    print("\n--- Migration Steps Test ---")
+    # Version 1 is the original schema, not whatever the models hold today
+    assert run_migrations(engine, target_version=1) == [1]
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        tables = set(inspector.get_table_names())
+        assert {"users", "departments", "tasks", "attendance", "payslips"} <= tables
+        assert not tables & {"department_closure", "user_sessions", "audit_log"}
+        assert "worked_seconds" not in {c["name"] for c in inspector.get_columns("attendance")}
+        assert "ix_tasks_assigned_to" not in {ix["name"] for ix in inspector.get_indexes("tasks")}
+
+    assert run_migrations(engine) == list(range(2, LATEST_VERSION + 1))
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        assert {"department_closure", "user_sessions", "audit_log"} <= set(inspector.get_table_names())
+        assert "worked_seconds" in {c["name"] for c in inspector.get_columns("attendance")}
+        assert "absolute_expires_at" in {c["name"] for c in inspector.get_columns("user_sessions")}
+        assert "ix_tasks_assigned_to" in {ix["name"] for ix in inspector.get_indexes("tasks")}
+        assert "ix_user_sessions_expires_at" in {ix["name"] for ix in inspector.get_indexes("user_sessions")}
+
+def test_migrations_upgrade_unversioned_database():
+    print("\n--- Legacy Database Upgrade Test ---")
+    # A database written by the old create_tables(): tables exist, no indexes, no version
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE tasks (id INTEGER PRIMARY KEY, title VARCHAR, description TEXT, assigned_to VARCHAR, "
+            "deadline VARCHAR, status VARCHAR, created_at TIMESTAMP, type VARCHAR, department_id INTEGER)"
+        )
+        connection.exec_driver_sql(
+            "CREATE TABLE payslips (id INTEGER PRIMARY KEY, employee_id VARCHAR, base_salary FLOAT, "
+            "hours_worked FLOAT, overtime_hours FLOAT, salary FLOAT, month VARCHAR, year INTEGER, "
+            "strategy VARCHAR, generated_at TIMESTAMP, department_id INTEGER)"
+        )
+        connection.exec_driver_sql("INSERT INTO tasks (id, title, assigned_to, status) VALUES (1, 'Old task', 'emp', 'Not Started')")
+
+    assert run_migrations(engine) == list(range(1, LATEST_VERSION + 1))
+    with engine.connect() as connection:
+        task_indexes = {ix["name"] for ix in inspect(connection).get_indexes("tasks")}
+        payslip_indexes = {ix["name"] for ix in inspect(connection).get_indexes("payslips")}
+        assert {"ix_tasks_assigned_to", "ix_tasks_status", "ix_tasks_department_id"} <= task_indexes
+        assert "ix_payslips_employee_period" in payslip_indexes
+        assert connection.exec_driver_sql("SELECT title FROM tasks").scalar() == "Old task" # Data kept
+
+def test_migrations_add_absolute_session_expiry():
+    print("\n--- Session Table Upgrade Test ---")
+    # user_sessions as written before sessions had an idle deadline
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE user_sessions (token VARCHAR PRIMARY KEY, username VARCHAR, principal TEXT, expires_at FLOAT)"
+        )
+        connection.execute(
+            text("INSERT INTO user_sessions VALUES ('old-token', 'alice', :principal, :expires_at)"),
+            {"principal": '{"username": "alice"}', "expires_at": time.time() + 3600}
+        )
+
+    run_migrations(engine)
+    store = DatabaseSessionStore(cache_ttl_seconds=0)
+    assert store.get("old-token") == {"username": "alice"} # Existing sessions keep working
+    store.put("new-token", {"username": "bob"})
+    assert store.get("new-token") == {"username": "bob"}
+
+def test_explain_report_has_no_full_scans():
+    print("\n--- Explain Report Test ---")
+    create_tables()
+    report = explain_report(engine)
+    assert report
+    full_scans = [entry["query"] for entry in report if entry["full_scan"]]
+    assert full_scans == [], f"Queries doing full table scans: {full_scans}"
+
+@pytest.mark.skipif(engine.dialect.name != "sqlite", reason="SQLite pragmas")
+def test_engine_applies_sqlite_pragmas():
+    print("\n--- Engine Pragmas Test ---")
+    create_tables()
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar().lower() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1 # NORMAL
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+    assert engine.pool.size() == 10
@@ -0,0 +1,296 @@
+# test_notification.py
+
+import json
+import os
+import socket
+import threading
+import pytest
+from notification import (
+    NotificationManager, InAppNotifier, NotificationDispatcher, NotificationObserver,
+    EmailNotifier, EmailTransport, SMTPEmailTransport, read_dead_letters
+)
+
+@pytest.fixture
+def store_paths(tmp_path, monkeypatch):
+    monkeypatch.setenv("NOTIFICATIONS_ARCHIVE_DAYS", "0") # Keep the fixed 2025 test entries live
+    return str(tmp_path / "notifications.jsonl"), str(tmp_path / "notifications.json")
+
+def test_inapp_notifier_appends_one_line_per_notification(store_paths):
+    print("\n--- Notification Store Append Test ---")
+    log_file, legacy_file = store_paths
+    with open(legacy_file, "w") as f:
+        json.dump([{"to": "alice", "message": "old", "timestamp": "2025-08-17 20:13:54"}], f, indent=4)
+
+    manager = NotificationManager()
+    notifier = InAppNotifier(manager.subject, log_file=log_file, legacy_file=legacy_file)
+    assert [n["message"] for n in notifier.notifications] == ["old"] # Imported from the legacy file
+
+    with open(log_file, "rb") as f:
+        before = f.read()
+    manager.send_notification("Payslip generated", "alice")
+    with open(log_file, "rb") as f:
+        after = f.read()
+    # The existing history is untouched; one line is appended
+    assert after.startswith(before)
+    assert json.loads(after[len(before):])["message"] == "Payslip generated"
+
+    reloaded = InAppNotifier(NotificationManager().subject, log_file=log_file, legacy_file=legacy_file)
+    assert [n["message"] for n in reloaded.notifications] == ["old", "Payslip generated"]
+
+def test_inapp_notifier_recovers_from_torn_append(store_paths):
+    print("\n--- Notification Store Recovery Test ---")
+    log_file, legacy_file = store_paths
+    with open(log_file, "w") as f:
+        f.write(json.dumps({"to": "bob", "message": "kept", "timestamp": "2025-08-17 20:13:54"}) + "\n")
+        f.write('{"to": "bob", "mess') # Crash mid-append
+
+    manager = NotificationManager()
+    notifier = InAppNotifier(manager.subject, log_file=log_file, legacy_file=legacy_file)
+    assert [n["message"] for n in notifier.notifications] == ["kept"]
+
+    manager.send_notification("next", "bob")
+    with open(log_file) as f:
+        records = [json.loads(line) for line in f]
+    assert [r["message"] for r in records if "to" in r] == ["kept", "next"] # Plus compaction's meta record
+
+def test_inapp_notifier_pages_and_counts_unread_per_recipient(store_paths):
+    print("\n--- Notification Index Test ---")
+    log_file, legacy_file = store_paths
+    manager = NotificationManager()
+    notifier = InAppNotifier(manager.subject, log_file=log_file, legacy_file=legacy_file)
+    notifier.compact_threshold = 2
+    for i in range(7):
+        manager.send_notification(f"carol {i}", "carol")
+        manager.send_notification(f"dave {i}", "dave")
+
+    # Newest first, three per page, only carol's
+    pages, cursor = [], None
+    while True:
+        page, cursor = notifier.get_notifications("carol", cursor=cursor, limit=3)
+        pages.append([n["message"][-1] for n in page])
+        if cursor is None:
+            break
+    assert pages == [["6", "5", "4"], ["3", "2", "1"], ["0"]]
+    assert notifier.get_notifications("nobody") == ([], None)
+
+    assert notifier.unread_count("carol") == 7
+    newest, _ = notifier.get_notifications("carol", limit=3)
+    notifier.mark_read("carol", newest[-1]["id"]) # Everything up to "carol 4"
+    assert notifier.unread_count("carol") == 2
+    notifier.mark_read("carol")
+    notifier.mark_read("dave")
+    manager.send_notification("carol 7", "carol")
+    assert notifier.unread_count("carol") == 1
+    assert notifier.unread_count("dave") == 0
+
+    # Read state survives a reload; superseded markers were compacted away
+    reloaded = InAppNotifier(NotificationManager().subject, log_file=log_file, legacy_file=legacy_file)
+    assert reloaded.unread_count("carol") == 1 and reloaded.unread_count("dave") == 0
+    with open(log_file) as f:
+        markers = [line for line in f if '"read"' in line]
+    assert len(markers) <= 3
+
+class FlakyObserver(NotificationObserver):
+    """Fails the first `failures` deliveries, optionally waits on `gate`, and records what it delivered."""
+    def __init__(self, failures=0, gate=None):
+        self.failures = failures
+        self.gate = gate
+        self.calls = 0
+        self.delivered = []
+
+    def update(self, message, recipient):
+        self.calls += 1
+        if self.gate:
+            self.gate.wait(5)
+        if self.calls <= self.failures:
+            raise ConnectionError("mail server unavailable")
+        self.delivered.append((recipient, message))
+
+def test_dispatcher_enqueues_and_retries_in_background(tmp_path):
+    print("\n--- Notification Dispatch Test ---")
+    dispatcher = NotificationDispatcher(workers=2, max_attempts=3, backoff_seconds=0.01,
+                                        dead_letter_file=str(tmp_path / "dead.jsonl"))
+    manager = NotificationManager(dispatcher=dispatcher)
+    gate = threading.Event()
+    slow = FlakyObserver(gate=gate)
+    flaky = FlakyObserver(failures=2)
+    broken = FlakyObserver(failures=10)
+    for observer in (slow, flaky, broken):
+        manager.subject.register_observer(observer)
+    try:
+        manager.send_notification("Payslip generated", "erin") # Returns while slow is still blocked
+        assert slow.delivered == []
+        gate.set()
+        dispatcher.flush()
+
+        assert slow.delivered == [("erin", "Payslip generated")]
+        assert flaky.delivered == [("erin", "Payslip generated")] and flaky.calls == 3 # Succeeded on the last retry
+        assert broken.delivered == [] and broken.calls == 3
+        dead = dispatcher.get_dead_letters()
+        assert [(d["observer"], d["to"], d["attempts"]) for d in dead] == [("FlakyObserver", "erin", 3)]
+    finally:
+        dispatcher.shutdown()
+
+def test_dispatcher_does_not_duplicate_when_compaction_fails(store_paths, tmp_path, monkeypatch):
+    print("\n--- Notification Compaction Failure Test ---")
+    log_file, legacy_file = store_paths
+    dispatcher = NotificationDispatcher(workers=1, max_attempts=3, backoff_seconds=0.01,
+                                        dead_letter_file=str(tmp_path / "dead.jsonl"))
+    manager = NotificationManager(dispatcher=dispatcher)
+    notifier = InAppNotifier(manager.subject, log_file=log_file, legacy_file=legacy_file)
+    def broken_compact():
+        raise OSError("disk full")
+    monkeypatch.setattr(notifier, "compact", broken_compact)
+    notifier.compact_threshold = 0 # Compact after every update
+    try:
+        manager.send_notification("Task assigned", "judy")
+        dispatcher.flush()
+    finally:
+        dispatcher.shutdown()
+    assert [n["message"] for n in notifier.get_notifications("judy")[0]] == ["Task assigned"]
+    assert dispatcher.get_dead_letters() == []
+
+class RecordingTransport(EmailTransport):
+    """Records each batch; refuses messages to the addresses in `refuse`."""
+    def __init__(self, refuse=()):
+        self.batches = []
+        self.refuse = set(refuse)
+
+    def send(self, messages):
+        self.batches.append(list(messages))
+        return [(m, ConnectionRefusedError(m["To"])) for m in messages if m["To"] in self.refuse]
+
+def test_email_notifier_sends_one_digest_per_recipient():
+    print("\n--- Email Digest Test ---")
+    manager = NotificationManager()
+    immediate_transport, digest_transport = RecordingTransport(), RecordingTransport()
+    EmailNotifier(manager.subject, transport=immediate_transport, digest_window=0)
+    digest = EmailNotifier(manager.subject, transport=digest_transport, digest_window=60)
+    try:
+        # A payroll run: two notifications for each of 200 employees
+        for kind in ("Payslip generated", "Task assigned"):
+            for n in range(200):
+                manager.send_notification(kind, f"employee{n}")
+        assert len(immediate_transport.batches) == 400 # One send per event
+        assert digest_transport.batches == [] # Held until the window closes
+
+        assert digest.flush() == 200
+        assert len(digest_transport.batches) == 1 and len(digest_transport.batches[0]) == 200
+        email = digest_transport.batches[0][0]
+        assert email["To"] == "employee0@company.local"
+        assert email["Subject"] == "2 new notifications"
+        assert "Payslip generated" in email.get_content() and "Task assigned" in email.get_content()
+    finally:
+        digest.close()
+
+def test_email_digest_retries_only_failed_recipients(tmp_path):
+    print("\n--- Email Digest Failure Test ---")
+    manager = NotificationManager()
+    transport = RecordingTransport(refuse={"ivan@company.local"})
+    dead_letters = str(tmp_path / "dead.jsonl")
+    digest = EmailNotifier(manager.subject, transport=transport, digest_window=60, max_attempts=2, dead_letter_file=dead_letters)
+    try:
+        for name in ("ivan", "judy", "ken"):
+            manager.send_notification("Payslip generated", name)
+        assert digest.flush() == 2
+        assert digest.flush() == 0 # Only ivan's digest is retried
+        assert [[m["To"] for m in batch] for batch in transport.batches] == [
+            ["ivan@company.local", "judy@company.local", "ken@company.local"], ["ivan@company.local"]]
+        # Out of attempts: dead-lettered, not retried again
+        assert digest.flush() == 0 and len(transport.batches) == 2
+        assert [(d["observer"], d["to"], d["attempts"]) for d in read_dead_letters(dead_letters)] == [("EmailNotifier", "ivan", 2)]
+    finally:
+        digest.close()
+
+def test_email_digests_over_smtp(tmp_path):
+    print("\n--- Email Digest SMTP Test ---")
+    controller_module = pytest.importorskip("aiosmtpd.controller")
+    received = []
+
+    class Handler:
+        async def handle_DATA(self, server, session, envelope):
+            received.append(envelope)
+            return "250 Message accepted for delivery"
+
+    with socket.socket() as s: # A free local port for the stand-in server
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    controller = controller_module.Controller(Handler(), hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        manager = NotificationManager()
+        notifier = EmailNotifier(manager.subject, transport=SMTPEmailTransport("127.0.0.1", port), digest_window=60)
+        for n in range(3):
+            manager.send_notification(f"Task {n} assigned", "frank")
+        manager.send_notification("Payslip generated", "grace")
+        notifier.close()
+    finally:
+        controller.stop()
+    assert sorted(e.rcpt_tos[0] for e in received) == ["frank@company.local", "grace@company.local"]
+
+def test_inapp_notifier_bounds_memory_and_reads_archives(store_paths, monkeypatch):
+    print("\n--- Notification Retention Test ---")
+    log_file, legacy_file = store_paths
+    # Half of henry's history is older than the archive window
+    with open(log_file, "w") as f:
+        for n in range(10):
+            timestamp = "2020-01-01 00:00:00" if n < 5 else "2999-01-01 00:00:00"
+            f.write(json.dumps({"id": n + 1, "to": "henry", "message": f"henry {n}", "timestamp": timestamp}) + "\n")
+    monkeypatch.setenv("NOTIFICATIONS_PER_RECIPIENT", "3")
+    monkeypatch.setenv("NOTIFICATIONS_ARCHIVE_DAYS", "30")
+
+    manager = NotificationManager()
+    notifier = InAppNotifier(manager.subject, log_file=log_file, legacy_file=legacy_file)
+    archives = [p for p in os.listdir(os.path.dirname(log_file)) if p.endswith(".gz")]
+    assert len(archives) == 1 # Archived on load
+    with open(log_file) as f:
+        assert sum('"to"' in line for line in f) == 5
+    # Only the newest three are held in memory
+    assert [n["message"] for n in notifier.notifications] == ["henry 7", "henry 8", "henry 9"]
+
+    manager.send_notification("henry 10", "henry")
+    # Paging reads through memory, the live file and the archive
+    pages, cursor = [], None
+    while True:
+        page, cursor = notifier.get_notifications("henry", cursor=cursor, limit=4)
+        pages.append([int(n["message"].split()[1]) for n in page])
+        if cursor is None:
+            break
+    assert pages == [[10, 9, 8, 7], [6, 5, 4, 3], [2, 1, 0]]
+
+    # A restart keeps ids increasing and knows henry has archived history
+    reloaded = InAppNotifier(NotificationManager().subject, log_file=log_file, legacy_file=legacy_file)
+    reloaded.compact()
+    again = InAppNotifier(NotificationManager().subject, log_file=log_file, legacy_file=legacy_file)
+    again.update("henry 11", "henry")
+    assert again.get_notifications("henry", limit=1)[0][0]["id"] == 12
+    assert len(again.get_notifications("henry", limit=20)[0]) == 12
+
+def test_inapp_notifier_recovers_from_interrupted_archival(store_paths, monkeypatch):
+    print("\n--- Notification Archival Crash Test ---")
+    log_file, legacy_file = store_paths
+    with open(log_file, "w") as f:
+        for n in range(6):
+            timestamp = "2020-01-01 00:00:00" if n < 3 else "2999-01-01 00:00:00"
+            f.write(json.dumps({"id": n + 1, "to": "ivan", "message": f"ivan {n}", "timestamp": timestamp}) + "\n")
+    monkeypatch.setenv("NOTIFICATIONS_PER_RECIPIENT", "2")
+    monkeypatch.setenv("NOTIFICATIONS_ARCHIVE_DAYS", "30")
+
+    # Crash after the archive is in place but before the store is swapped
+    real_replace = os.replace
+    def replace(src, dst):
+        if dst == log_file:
+            raise OSError("simulated crash")
+        real_replace(src, dst)
+    monkeypatch.setattr(os, "replace", replace)
+    with pytest.raises(OSError):
+        InAppNotifier(NotificationManager().subject, log_file=log_file, legacy_file=legacy_file)
+    monkeypatch.setattr(os, "replace", real_replace)
+
+    notifier = InAppNotifier(NotificationManager().subject, log_file=log_file, legacy_file=legacy_file)
+    page, _ = notifier.get_notifications("ivan", limit=20)
+    assert [n["id"] for n in page] == [6, 5, 4, 3, 2, 1] # No duplicates from the store and the archive
+    with open(log_file) as f:
+        assert sum('"to"' in line for line in f) == 3 # The recompaction didn't keep the archived records
+    archives = [p for p in os.listdir(os.path.dirname(log_file)) if p.endswith(".gz")]
+    assert len(archives) == 1
@@ -1,29 +1,16 @@
 # test_payroll.py
 
-import os
 import pytest
-import time # Added for time.sleep
 from payroll import PayrollManager, ConcreteStrategyA, ConcreteStrategyB
 from notification import NotificationManager, InAppNotifier # For notifier integration
-from database import create_tables, SessionLocal, Payslip, engine # Import engine
+from database import create_tables, Payslip, reset_database
 
 # Helper function to clean up database
 @pytest.fixture(autouse=True)
 def setup_and_teardown_db():
-    # Helper to force-delete the database file, with retries
+    # Helper to reset the database between tests
     def force_delete_db():
-        SessionLocal.remove() # Ensure session is removed
-        engine.dispose() # Dispose of the engine to release file lock
-        if os.path.exists("company.db"):
-            for i in range(5):
-                try:
-                    os.remove("company.db")
-                    break # Success!
-                except PermissionError as e:
-                    print(f"Failed to delete DB, retrying... ({i+1}/5)")
-                    time.sleep(0.1) # Wait for 1 second before retrying
-                    if i == 4:
-                        raise e # Re-raise if all retries fail
+        reset_database() # Deletes company.db, or drops all tables on a server database
     
     # --- Setup Phase ---
     force_delete_db() # Call the helper before setup
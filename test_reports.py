@@ -1,8 +1,6 @@
 # test_reports.py
 
-import os
 import pytest
-import time # Added for time.sleep
 from datetime import datetime, timedelta
 from report_facade import ReportFacade
 from report_manager import ReportManager
@@ -10,27 +8,17 @@ from task_manager import TaskManager, TaskStatus
 from attendance import AttendanceManager
 from payroll import PayrollManager, ConcreteStrategyA
 from authentication import AuthManager
-from database import create_tables, SessionLocal, User, Department, Task, Attendance, Payslip, engine # Import engine
+from database import create_tables, SessionLocal, User, Department, Task, Attendance, Payslip, reset_database
+from async_database import async_engine
 from department_manager import DepartmentManager # Import DepartmentManager here
 import hashlib # For password hashing in user setup
 
 # Helper function to clean up database and set up initial data
 @pytest.fixture(autouse=True)
 def setup_and_teardown_db():
-    # Helper to force-delete the database file, with retries
+    # Helper to reset the database between tests
     def force_delete_db():
-        SessionLocal.remove() # Ensure session is removed
-        engine.dispose() # Dispose of the engine to release file lock
-        if os.path.exists("company.db"):
-            for i in range(5):
-                try:
-                    os.remove("company.db")
-                    break # Success!
-                except PermissionError as e:
-                    print(f"Failed to delete DB, retrying... ({i+1}/5)")
-                    time.sleep(0.1) # Wait for 1 second before retrying
-                    if i == 4:
-                        raise e # Re-raise if all retries fail
+        reset_database() # Deletes company.db, or drops all tables on a server database
     
     # --- Setup Phase ---
     force_delete_db() # Call the helper before setup
@@ -139,6 +127,34 @@ def test_report_facade_employee_summary():
     print(f"QA Employee Summary: {qa_emp_summary}")
 
  
+def test_report_manager_sql_aggregates():
+    print("\n--- Report Manager: SQL Aggregates Test ---")
+    report_manager = ReportManager()
+
+    # One task of each state set up in the fixture, the rest untouched
+    assert report_manager.get_task_status_summary() == {
+        TaskStatus.NOT_STARTED.value: 2,
+        TaskStatus.IN_PROGRESS.value: 1,
+        TaskStatus.COMPLETED.value: 1,
+    }
+
+    # Per-employee totals match the individual payslips
+    db = SessionLocal()
+    try:
+        slips = db.query(Payslip.employee_id, Payslip.salary).all()
+    finally:
+        db.close()
+    totals = report_manager.get_total_pay_by_employee()
+    assert totals == {employee_id: salary for employee_id, salary in slips}
+    assert "unassigned_emp" not in totals
+
+    # Row-level reports still return the individual entries
+    today = datetime.now().strftime("%Y-%m-%d")
+    entries = sorted(report_manager.get_attendance_by_date(today), key=lambda e: e["employee_id"])
+    assert [(e["employee_id"], e["check_in"], e["check_out"]) for e in entries] == [
+        ("dev_emp", "09:00:00", "17:00:00"), ("qa_emp", "09:00:00", "17:00:00")
+    ]
+
 def test_report_manager_department_filtered_reports():
     print("\n--- Report Manager: Department Filtered Reports Test ---")
     report_manager = ReportManager()
@@ -182,3 +198,76 @@ def test_report_manager_department_filtered_reports():
     assert dept_pay["dev_emp"] > 0
     assert dept_pay["qa_emp"] > 0
     print(f"Total pay for Dev/QA departments: {dept_pay}")
+
+def test_department_scoped_queries_use_closure_join():
+    print("\n--- Department-Scoped Queries Test ---")
+    report_manager = ReportManager()
+    db = SessionLocal()
+    try:
+        dev_dept_id = db.query(Department.id).filter(Department.name == "Development").scalar()
+        qa_dept_id = db.query(Department.id).filter(Department.name == "QA").scalar()
+    finally:
+        db.close()
+
+    # Scoping by the root department must match the IN-list based reports
+    dev_ids = DepartmentManager().get_all_department_ids_in_hierarchy(dev_dept_id)
+    assert report_manager.get_task_report_for_department(dev_dept_id) == report_manager.get_task_report_by_department_ids(dev_ids)
+    assert report_manager.get_total_hours_for_department(dev_dept_id) == {"dev_emp": 16.0, "qa_emp": 8.0}
+    assert set(report_manager.get_total_pay_for_department(dev_dept_id)) == {"dev_emp", "qa_emp"}
+
+    # A sub-department only sees its own members
+    assert [t["assigned_to"] for t in TaskManager().get_tasks_for_department(qa_dept_id)] == ["qa_emp"]
+    assert {r.employee_id for r in AttendanceManager().get_attendance_for_department(qa_dept_id)} == {"qa_emp"}
+    assert AttendanceManager().get_total_hours_for_department(qa_dept_id) == {"qa_emp": 8.0}
+    assert [s["employee_id"] for s in PayrollManager().get_payslips_for_department(qa_dept_id)] == ["qa_emp"]
+
+    # Moving a user changes the scope without any cache to refresh
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.username == "dev_emp").update({"department_id": qa_dept_id})
+        db.commit()
+    finally:
+        db.close()
+    assert {t["assigned_to"] for t in TaskManager().get_tasks_for_department(qa_dept_id)} == {"dev_emp", "qa_emp"}
+
+def test_async_read_variants_match_sync():
+    print("\n--- Async Read Variants Test ---")
+    import asyncio
+    report_manager = ReportManager()
+    attendance_manager = AttendanceManager()
+    task_manager = TaskManager()
+    payroll_manager = PayrollManager()
+    db = SessionLocal()
+    try:
+        dev_dept_id = db.query(Department.id).filter(Department.name == "Development").scalar()
+    finally:
+        db.close()
+
+    async def run(coro):
+        try:
+            return await coro
+        finally:
+            await async_engine.dispose() # Pooled connections belong to this loop
+
+    async def read_all():
+        return await asyncio.gather(
+            report_manager.get_total_hours_for_department_async(dev_dept_id),
+            report_manager.get_total_pay_by_employee_async(),
+            report_manager.get_task_report_for_department_async(dev_dept_id),
+            attendance_manager.get_total_hours_for_employee_async("dev_emp"),
+            task_manager.get_tasks_by_user_async("dev_emp"),
+            payroll_manager.get_payslips_for_department_async(dev_dept_id),
+            AuthManager.get_instance().get_all_users_async(),
+        )
+
+    assert asyncio.run(run(read_all())) == [
+        report_manager.get_total_hours_for_department(dev_dept_id),
+        report_manager.get_total_pay_by_employee(),
+        report_manager.get_task_report_for_department(dev_dept_id),
+        attendance_manager.get_total_hours_for_employee("dev_emp"),
+        task_manager.get_tasks_by_user("dev_emp"),
+        payroll_manager.get_payslips_for_department(dev_dept_id),
+        AuthManager.get_instance().get_all_users(),
+    ]
+    records = asyncio.run(run(attendance_manager.get_attendance_for_department_async(dev_dept_id)))
+    assert sorted(r.employee_id for r in records) == ["dev_emp", "dev_emp", "qa_emp"]